@@ -1,3 +1,23 @@
 from django.contrib import admin
+from .models import DirectoryStudent, MessageMirrorState, MirroredMessage
 
-# Register your models here.
+@admin.register(DirectoryStudent)
+class DirectoryStudentAdmin(admin.ModelAdmin):
+    list_display = ('uid', 'display_name', 'mail', 'department', 'synced_at')
+    list_filter = ('department',)
+    search_fields = ('uid', 'display_name', 'mail')
+    ordering = ('display_name',)
+
+
+@admin.register(MirroredMessage)
+class MirroredMessageAdmin(admin.ModelAdmin):
+    list_display = ('username', 'message_id', 'is_read', 'received_at', 'updated_at')
+    list_filter = ('is_read',)
+    search_fields = ('username', 'message_id')
+    ordering = ('-id',)
+
+
+@admin.register(MessageMirrorState)
+class MessageMirrorStateAdmin(admin.ModelAdmin):
+    list_display = ('username', 'messages', 'requested_at', 'synced_at')
+    search_fields = ('username',)
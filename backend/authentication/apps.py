@@ -1,6 +1,17 @@
+import os
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class AuthenticationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'authentication'
+
+    def ready(self):
+        # Прогрев пула соединений к LDAP API при старте воркера
+        if getattr(settings, 'LDAP_POOL_WARMUP', False):
+            from .ldap_service import ldap_service
+            ldap_service.warm_up_async()
+            # При preload воркеры создаются через fork - прогреваем и их
+            os.register_at_fork(after_in_child=ldap_service.warm_up_async)
@@ -0,0 +1,482 @@
+"""
+Асинхронный клиент LDAP API
+Используется async views под ASGI: ожидание ответа upstream не занимает поток воркера
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .ldap_service import LDAPService, ldap_service
+from .cache import refresh_results, search_cache
+from .singleflight import AsyncSingleFlight
+from .circuit_breaker import circuit_breakers
+from .student_directory import student_directory
+from .latency import upstream_timeouts
+from .retry_budget import retry_budget
+from .tracing import upstream_tracer
+from .bulkhead import AUTH, BulkheadFull, async_upstream_bulkhead, upstream_priority
+from .summaries import summarize
+from .prefetch import active_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncLDAPService(LDAPService):
+    """
+    Асинхронная версия LDAPService на httpx.AsyncClient
+    Endpoints, параметры запросов и формат ответов общие с синхронным сервисом
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.max_connections = getattr(settings, 'LDAP_ASYNC_MAX_CONNECTIONS', 500)
+        # Клиент на каждый event loop: {loop: (AsyncClient, генератор закрытия, его запуск)}
+        self._clients: Dict[asyncio.AbstractEventLoop, tuple] = {}
+        self._inflight = AsyncSingleFlight()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        AsyncClient текущего event loop
+        Клиент привязан к loop: в другом loop (async_to_sync, asyncio.run)
+        создается свой и закрывается вместе с этим loop
+        """
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(loop)
+        if entry is None:
+            # loop, закрытые без shutdown_asyncgens(): сокеты освободятся вместе с клиентом
+            for closed in [other for other in self._clients if other.is_closed()]:
+                del self._clients[closed]
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                verify=False,  # Отключаем проверку SSL сертификата
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.pool_maxsize,
+                ),
+            )
+            lifetime = self._client_lifetime(loop, client)
+            entry = self._clients[loop] = (client, lifetime, asyncio.ensure_future(lifetime.__anext__()))
+        return entry[0]
+
+    async def _client_lifetime(self, loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient):
+        """
+        Закрывает клиент перед закрытием его loop: loop.shutdown_asyncgens()
+        (asyncio.run, async_to_sync) завершает незаконченные async-генераторы
+        """
+        try:
+            yield
+        finally:
+            if self._clients.get(loop, (None,))[0] is client:
+                del self._clients[loop]
+            await client.aclose()
+
+    async def aclose(self):
+        """Закрывает соединения клиента текущего event loop"""
+        entry = self._clients.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            client, lifetime, started = entry
+            await started
+            await lifetime.aclose()
+
+    def _request_error(self, error: Exception) -> Dict:
+        """Ответ сервиса на исключение httpx"""
+        if isinstance(error, httpx.TimeoutException):
+            logger.error("LDAP API request timeout")
+            return {'error': 'Request timeout'}
+        if isinstance(error, (httpx.ConnectError, httpx.RemoteProtocolError)):
+            logger.error("LDAP API connection error")
+            return {'error': 'Connection error'}
+        logger.error(f"LDAP API request error: {error}")
+        return {'error': 'Request failed'}
+
+    async def _send(self, endpoint: str, method: str, headers: Dict,
+                    data: Dict = None, params: Dict = None) -> httpx.Response:
+        """Одна попытка запроса (место в async bulkhead, адаптивный таймаут, трассировка)"""
+        async with async_upstream_bulkhead.slot():
+            return await self._send_traced(endpoint, method, headers, data, params)
+
+    async def _send_traced(self, endpoint: str, method: str, headers: Dict,
+                           data: Dict = None, params: Dict = None) -> httpx.Response:
+        connect, read = upstream_timeouts.timeout(endpoint)
+        started = time.monotonic()
+        with upstream_tracer.trace(endpoint, method) as trace:
+            try:
+                if method == 'GET':
+                    response = await self.client.get(
+                        endpoint, headers=headers, params=params,
+                        timeout=httpx.Timeout(read, connect=connect),
+                        extensions={'trace': trace.httpx_hook}
+                    )
+                else:
+                    response = await self.client.post(
+                        endpoint, headers=headers, json=data, params=params,
+                        timeout=httpx.Timeout(read, connect=connect),
+                        extensions={'trace': trace.httpx_hook}
+                    )
+            except httpx.ConnectTimeout:
+                upstream_timeouts.record_connect(connect)
+                raise
+            except httpx.ReadTimeout:
+                upstream_timeouts.record(endpoint, read)
+                raise
+            trace.set_response(response.status_code, len(response.content))
+        if trace.connect:
+            upstream_timeouts.record_connect(trace.connect + trace.tls)
+        if response.status_code < 500:
+            upstream_timeouts.record(endpoint, time.monotonic() - started)
+        return response
+
+    async def _send_hedged(self, endpoint: str, send) -> httpx.Response:
+        """Hedged GET (см. LDAPService._send_hedged); проигравший запрос отменяется"""
+        delay = upstream_timeouts.hedge_delay(endpoint)
+        if delay is None:
+            return await send()
+
+        primary = asyncio.ensure_future(send())
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not retry_budget.try_retry():
+            return await primary
+        # Сервис может использоваться из нескольких event loop (async_to_sync в потоках)
+        with self._stats_lock:
+            self.hedged += 1
+
+        pending = {primary, asyncio.ensure_future(send())}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code < 500:
+                        return task.result()
+                if not pending:
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _make_request(self, endpoint: str, method: str = 'GET', data: Dict = None,
+                            headers: Dict = None, params: Dict = None,
+                            raw: bool = False) -> Tuple[bool, Dict]:
+        """
+        Выполняет запрос к LDAP API (повторы и hedging - как в LDAPService._make_request)
+
+        Returns:
+            Tuple[bool, Dict]: (success, response_data)
+        """
+        default_headers = self._build_headers(headers)
+        method = method.upper()
+
+        if method not in ('GET', 'POST'):
+            logger.error(f"Unsupported HTTP method: {method}")
+            return False, {'error': 'Unsupported HTTP method'}
+
+        breaker = circuit_breakers.get(endpoint)
+        if not breaker.allow():
+            return False, self._unavailable_error(endpoint, breaker)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"LDAP API Request (async): {method} {self.base_url}{endpoint}")
+
+        def send():
+            return self._send(endpoint, method, default_headers, data, params)
+
+        idempotent = self._is_idempotent(endpoint, method)
+        retry_budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                if method == 'GET' and self.hedge_requests:
+                    response = await self._send_hedged(endpoint, send)
+                else:
+                    response = await send()
+            except BulkheadFull as e:
+                return False, self._busy_error(endpoint, breaker, e)
+            except httpx.HTTPError as e:
+                # Неидемпотентный запрос повторяем, только если соединение не установлено
+                retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if retryable and attempt < self.max_retries and retry_budget.try_retry():
+                    attempt += 1
+                    await asyncio.sleep(self._retry_delay(attempt))
+                    continue
+                breaker.record(False)
+                return False, self._request_error(e)
+            except asyncio.CancelledError:
+                # Отмена клиентом - не сбой LDAP API: пробный запрос half-open освобождается без результата
+                breaker.cancel()
+                raise
+            except BaseException:
+                breaker.record(False)
+                raise
+
+            if (response.status_code >= 500 and idempotent and attempt < self.max_retries
+                    and retry_budget.try_retry()):
+                attempt += 1
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+            break
+
+        breaker.record(response.status_code < 500)
+        return self._handle_response(response, raw)
+
+    async def login(self, username: str, password: str) -> Tuple[bool, Dict]:
+        """Авторизация в LDAP"""
+        data = {
+            'username': username,
+            'password': password
+        }
+
+        with upstream_priority(AUTH):
+            success, response = await self._make_request(self.endpoints['login'], method='POST', data=data)
+
+        if success:
+            logger.info(f"LDAP login successful for user: {username}")
+        else:
+            logger.warning(f"LDAP login failed for user: {username}")
+
+        return success, response
+
+    async def refresh_token(self, refresh_token: str) -> Tuple[bool, Dict]:
+        """Обновление access токена (один запрос на refresh token, см. LDAPService.refresh_token)"""
+        key = self._refresh_key(refresh_token)
+        cached = refresh_results.get(key)
+        if cached is not None:
+            logger.info("LDAP token refresh reused")
+            return True, dict(cached)
+
+        async def exchange():
+            data = {
+                'refresh_token': refresh_token
+            }
+            with upstream_priority(AUTH):
+                success, response = await self._make_request(self.endpoints['refresh'], method='POST', data=data)
+            self._refresh_store(key, success, response)
+            return success, response
+
+        success, response = await self._inflight.do(key, exchange)
+
+        if success:
+            logger.info("LDAP token refresh successful")
+        else:
+            logger.warning("LDAP token refresh failed")
+
+        return success, dict(response)
+
+    async def _read_request(self, name: str, access_token: str, method: str = 'GET',
+                            params: Dict = None, refresh: bool = False) -> Tuple[bool, Dict]:
+        """Запрос к endpoint'у чтения: общий кэш + объединение запросов (см. LDAPService._read_request)"""
+        active_tokens.touch(access_token)
+        key, cached = self._cache_lookup(name, access_token, params, refresh)
+        if cached is not None:
+            return True, cached
+
+        # Устаревший ответ отдается сразу, обновление - в фоновом потоке через sync сервис
+        if not refresh:
+            stale = ldap_service._serve_stale(name, key, access_token, method, params)
+            if stale is not None:
+                return True, stale
+
+        headers = {
+            'Authorization': f'Bearer {access_token}'
+        }
+
+        success, response = await self._inflight.do(key, lambda: self._make_request(
+            self.endpoints[name], method=method, headers=headers, params=params,
+            raw=name in self.raw_endpoints
+        ))
+
+        self._cache_store(name, key, success, response)
+        return success, response
+
+    async def get_user_profile(self, access_token: str, refresh: bool = False) -> Tuple[bool, Dict]:
+        """Получение профиля пользователя"""
+        return await self._read_request('profile', access_token, method='POST', refresh=refresh)
+
+    async def get_active_courses(self, access_token: str, lang: str = 'en',
+                                 page: int = 1, page_size: int = 100,
+                                 refresh: bool = False) -> Tuple[bool, Dict]:
+        """Получение активных курсов"""
+        return await self._read_request(
+            'courses',
+            access_token,
+            method='GET',
+            params=self._courses_params(lang, page, page_size),
+            refresh=refresh
+        )
+
+    async def get_course_grades(self, access_token: str, refresh: bool = False) -> Tuple[bool, Dict]:
+        """Получение оценок по курсам"""
+        return await self._read_request('grades', access_token, method='GET', refresh=refresh)
+
+    async def get_course_attendance(self, access_token: str, refresh: bool = False) -> Tuple[bool, Dict]:
+        """Получение данных о посещаемости"""
+        return await self._read_request('attendance', access_token, method='GET', refresh=refresh)
+
+    async def get_summary(self, name: str, access_token: str, refresh: bool = False) -> Tuple[bool, Dict]:
+        """Сводка оценок или посещаемости (name: 'grades' | 'attendance')"""
+        method = self.get_course_grades if name == 'grades' else self.get_course_attendance
+        success, response = await method(access_token, refresh=refresh)
+        if not success:
+            return success, response
+        return True, summarize(name, response)
+
+    async def get_messages(self, access_token: str, refresh: bool = False) -> Tuple[bool, Dict]:
+        """Получение сообщений"""
+        logger.info("LDAP get messages")
+        return await self._read_request('messages', access_token, method='POST', refresh=refresh)
+
+    async def upload_image(self, access_token: str, image_data) -> Tuple[bool, Dict]:
+        """Загрузка изображения (потоковый multipart/form-data)"""
+        stream, error = self._upload_stream(image_data)
+        if error:
+            return False, error
+
+        headers = self._build_headers({
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': stream.content_type,
+            'Content-Length': str(len(stream))
+        })
+
+        logger.info("LDAP upload image")
+
+        breaker = circuit_breakers.get(self.endpoints['image'])
+        if not breaker.allow():
+            return False, self._unavailable_error(self.endpoints['image'], breaker)
+
+        try:
+            async with async_upstream_bulkhead.slot():
+                with upstream_tracer.trace(self.endpoints['image'], 'POST') as trace:
+                    response = await self.client.post(self.endpoints['image'], headers=headers,
+                                                     content=stream.aiter_chunks(),
+                                                     extensions={'trace': trace.httpx_hook})
+                    trace.set_response(response.status_code, len(response.content))
+        except BulkheadFull as e:
+            return False, self._busy_error(self.endpoints['image'], breaker, e)
+        except httpx.HTTPError as e:
+            breaker.record(False)
+            logger.error(f"LDAP image upload error: {e}")
+            return False, {'error': 'Upload failed'}
+        except ValueError as e:
+            breaker.record(True)
+            logger.error(f"LDAP image upload error: {e}")
+            return False, {'error': 'Upload failed'}
+        except asyncio.CancelledError:
+            breaker.cancel()
+            raise
+        except BaseException:
+            breaker.record(False)
+            raise
+        breaker.record(response.status_code < 500)
+
+        success, response_data = self._handle_response(response)
+        if not success and 'details' in response_data:
+            response_data = {'error': response_data['error']}
+        return self._upload_result(success, response_data, stream)
+
+    async def _search_directory(self, access_token: str, query: Optional[str],
+                                group: Optional[str], limit: int,
+                                offset: int = 0) -> Optional[Tuple[bool, Dict]]:
+        """Поиск по локальному справочнику (None - справочник не синхронизирован)"""
+        if not self.directory_mirror:
+            return None
+        # Загрузка индекса читает БД
+        index = await sync_to_async(student_directory.get_index)()
+        if index is None:
+            return None
+
+        success, profile = await self.get_user_profile(access_token)
+        records = index.search(query, group, limit, offset)
+        return self._directory_result(success, profile, records, offset, limit)
+
+    async def _search_page(self, access_token: str, query: Optional[str], group: Optional[str],
+                           chunk: tuple) -> Tuple[bool, Dict]:
+        skip, take = chunk
+        return await self._read_request(
+            'search_students',
+            access_token,
+            method='GET',
+            params=self._search_params(query, group, skip, take)
+        )
+
+    async def search_students(self, access_token: str, query: Optional[str] = None,
+                              group: Optional[str] = None, limit: int = 50,
+                              offset: int = 0, typeahead: bool = False) -> Tuple[bool, Dict]:
+        """Поиск студентов через LDAP API (см. LDAPService.search_students)"""
+        limit = max(1, min(limit, self.search_max_limit))
+        offset = max(0, offset)
+
+        try:
+            result = await self._search_directory(access_token, query, group, limit, offset)
+            if result is not None:
+                return result
+
+            if typeahead and self._normalize_query(query):
+                return await self._typeahead_search(access_token, query, group, limit, offset)
+            return await self._search_upstream(access_token, query, group, limit, offset)
+
+        except Exception as e:
+            logger.error(f"LDAP student search error: {e}")
+            return False, {'error': str(e), 'students': []}
+
+    async def _typeahead_search(self, access_token: str, query: str, group: Optional[str],
+                                limit: int, offset: int) -> Tuple[bool, Dict]:
+        """Поиск при наборе запроса (см. LDAPService._typeahead_search)"""
+        students = self._typeahead_lookup(query, group)
+        if students is not None:
+            success, profile = await self.get_user_profile(access_token)
+            if not success:
+                return self._search_error(profile)
+            return True, self._typeahead_page(students, offset, limit, complete=True)
+
+        success, response = await self._search_upstream(
+            access_token, query, group, self._typeahead_fetch_limit(offset, limit), 0
+        )
+        if not success:
+            return success, response
+        self._typeahead_store(query, group, response)
+
+        page = self._typeahead_page(response['students'], offset, limit,
+                                    complete=response['next_cursor'] is None)
+        if page is None:
+            return await self._search_upstream(access_token, query, group, limit, offset)
+        return True, page
+
+    async def _search_upstream(self, access_token: str, query: Optional[str], group: Optional[str],
+                               limit: int, offset: int) -> Tuple[bool, Dict]:
+        """Поиск в LDAP API (с кэшем результатов)"""
+        key = self._search_key(query, group, limit, offset)
+        cached = search_cache.get(key) if self.search_cache_ttl else None
+        if cached is not None:
+            success, profile = await self.get_user_profile(access_token)
+            return self._cached_search_result(success, profile, cached)
+
+        chunks = self._search_chunks(offset, limit)
+        first = await self._search_page(access_token, query, group, chunks[0])
+        if not first[0]:
+            return self._search_error(first[1])
+
+        # Следующие страницы запрашиваем параллельно (не больше search_parallel_pages)
+        rest = self._remaining_chunks(chunks, first[1])
+        semaphore = asyncio.Semaphore(self.search_parallel_pages)
+
+        async def fetch(chunk):
+            async with semaphore:
+                return await self._search_page(access_token, query, group, chunk)
+
+        pages = [first]
+        pages.extend(await asyncio.gather(*(fetch(chunk) for chunk in rest)))
+
+        total = first[1].get('count') if isinstance(first[1], dict) else None
+        result = self._search_result(chunks, pages, offset, limit, total)
+        self._search_cache_store(key, pages, result)
+        return result
+
+
+# Singleton instance
+async_ldap_service = AsyncLDAPService()
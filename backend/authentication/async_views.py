@@ -0,0 +1,425 @@
+"""
+Асинхронные LDAP прокси views (для запуска под ASGI)
+Повторяют контракт views.py / student_search.py, но не блокируют поток
+на время ожидания ответа от LDAP API.
+
+Подключаются вместо синхронных при LDAP_ASYNC_VIEWS=True (см. urls.py)
+"""
+
+import json
+import logging
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework import status
+
+from .async_ldap_service import async_ldap_service
+from .ldap_service import ldap_service
+from .cache import bypass_requested, response_age
+from .student_search import _search_offset, _typeahead_requested
+from .views import (
+    _raw_response, _upload_exceeds_limit, _upload_too_large_error, _versioned_response,
+    _summary_response,
+)
+from .payload import RawPayload
+from .inbox import message_inbox, parse_cursor
+
+logger = logging.getLogger(__name__)
+
+
+def async_api_view(methods):
+    """
+    Аналог @api_view для async views: проверка HTTP метода
+    (DRF и декораторы Django 4.2 не поддерживают корутины)
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return _json({
+                    'detail': f'Метод "{request.method}" не разрешен.'
+                }, status.HTTP_405_METHOD_NOT_ALLOWED)
+            return await view(request, *args, **kwargs)
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def _json(data, response_status=status.HTTP_200_OK):
+    return JsonResponse(data, status=response_status, safe=False, json_dumps_params={'ensure_ascii': False})
+
+
+def _request_data(request):
+    """Тело запроса: JSON-объект или form-data ({} для другого JSON)"""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except (ValueError, UnicodeDecodeError):
+            return {}
+        return data if isinstance(data, dict) else {}
+    return request.POST
+
+
+def _bearer_token(request):
+    auth_header = request.META.get('HTTP_AUTHORIZATION')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    return auth_header.split(' ')[1]
+
+
+def _token_required():
+    return _json({
+        'success': False,
+        'error': 'Bearer токен обязателен'
+    }, status.HTTP_401_UNAUTHORIZED)
+
+
+def _unavailable_response(ldap_response):
+    """503 + Retry-After, если circuit breaker отклонил запрос (см. views._unavailable_response)"""
+    if not isinstance(ldap_response, dict) or 'retry_after' not in ldap_response:
+        return None
+
+    response = _json({
+        'success': False,
+        'error': ldap_response.get('error', 'LDAP сервис временно недоступен')
+    }, status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = str(ldap_response['retry_after'])
+    return response
+
+
+def _proxy_response(success, ldap_response, default_error, unauthorized_markers=('unauthorized',), **fields):
+    """Ответ прокси в формате {'success': ..., 'data'|'error': ...}; fields - дополнительные поля конверта"""
+    if success:
+        payload = {
+            'success': True,
+            **fields,
+        }
+        # Устаревшие данные (stale-while-revalidate) помечаются stale/age и заголовком Age
+        age = response_age()
+        if age is not None:
+            payload['stale'] = True
+            payload['age'] = age
+        if isinstance(ldap_response, RawPayload):
+            response = _raw_response(payload, ldap_response)
+        else:
+            payload['data'] = ldap_response
+            response = _json(payload)
+        if age is not None:
+            response['Age'] = str(age)
+        return response
+
+    unavailable = _unavailable_response(ldap_response)
+    if unavailable:
+        return unavailable
+
+    error_message = ldap_response.get('error', default_error)
+
+    if any(marker in error_message.lower() for marker in unauthorized_markers):
+        response_status = status.HTTP_401_UNAUTHORIZED
+    else:
+        response_status = status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    return _json({
+        'success': False,
+        'error': error_message
+    }, response_status)
+
+
+def _success(ldap_response, **fields):
+    return _proxy_response(True, ldap_response, None, **fields)
+
+
+@async_api_view(['POST'])
+async def ldap_login(request):
+    """LDAP авторизация пользователя (см. views.ldap_login)"""
+    data = _request_data(request)
+    username = data.get('username')
+    password = data.get('password')
+
+    logger.info(f"LDAP login attempt - Username: {username}")
+
+    if not username or not password:
+        return _json({
+            'success': False,
+            'error': 'Имя пользователя и пароль обязательны'
+        }, status.HTTP_400_BAD_REQUEST)
+
+    success, ldap_response = await async_ldap_service.login(username, password)
+
+    if not success:
+        logger.warning(f"LDAP login failed for user: {username}")
+        unavailable = _unavailable_response(ldap_response)
+        if unavailable:
+            return unavailable
+
+        error_message = ldap_response.get('error', 'Неверное имя пользователя или пароль')
+
+        if 'timeout' in error_message.lower() or 'connection' in error_message.lower():
+            response_status = status.HTTP_503_SERVICE_UNAVAILABLE
+        else:
+            response_status = status.HTTP_401_UNAUTHORIZED
+
+        return _json({
+            'success': False,
+            'error': error_message
+        }, response_status)
+
+    if 'access_token' not in ldap_response or 'refresh_token' not in ldap_response:
+        logger.error(f"Invalid LDAP response format: {ldap_response}")
+        return _json({
+            'success': False,
+            'error': 'Неверный формат ответа от сервера авторизации'
+        }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # Фоновая загрузка курсов/оценок/посещаемости/сообщений в кэш (в пуле потоков)
+    if async_ldap_service.login_warmup:
+        ldap_service.warm_up_user(ldap_response['access_token'])
+
+    profile_success, profile_data = await async_ldap_service.get_user_profile(ldap_response['access_token'])
+    if not profile_success:
+        logger.warning(f"Failed to get profile for user: {username}")
+
+    return _json({
+        'success': True,
+        'data': {
+            'access_token': ldap_response['access_token'],
+            'refresh_token': ldap_response['refresh_token'],
+            'user': profile_data if profile_success else None
+        }
+    })
+
+
+@async_api_view(['POST'])
+async def ldap_refresh_token(request):
+    """Обновление access токена через LDAP (см. views.ldap_refresh_token)"""
+    refresh_token = _request_data(request).get('refresh_token')
+
+    if not refresh_token:
+        return _json({
+            'success': False,
+            'error': 'Refresh token обязателен'
+        }, status.HTTP_400_BAD_REQUEST)
+
+    success, ldap_response = await async_ldap_service.refresh_token(refresh_token)
+
+    if not success:
+        unavailable = _unavailable_response(ldap_response)
+        if unavailable:
+            return unavailable
+
+        return _json({
+            'success': False,
+            'error': ldap_response.get('error', 'Не удалось обновить токен')
+        }, status.HTTP_401_UNAUTHORIZED)
+
+    if 'access_token' not in ldap_response:
+        logger.error(f"Invalid refresh response format: {ldap_response}")
+        return _json({
+            'success': False,
+            'error': 'Неверный формат ответа от сервера'
+        }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return _json({
+        'success': True,
+        'data': {
+            'access_token': ldap_response['access_token'],
+            'refresh_token': ldap_response.get('refresh_token', refresh_token)
+        }
+    })
+
+
+@async_api_view(['POST'])
+async def ldap_get_user_profile(request):
+    """Профиль пользователя из LDAP"""
+    access_token = _bearer_token(request)
+    if not access_token:
+        return _token_required()
+
+    success, ldap_response = await async_ldap_service.get_user_profile(
+        access_token, refresh=bypass_requested(request)
+    )
+    return _proxy_response(success, ldap_response, 'Не удалось получить профиль',
+                           unauthorized_markers=('unauthorized', 'token'))
+
+
+@async_api_view(['GET'])
+async def ldap_get_active_courses(request):
+    """Активные курсы из LDAP"""
+    access_token = _bearer_token(request)
+    if not access_token:
+        return _token_required()
+
+    lang = request.GET.get('lang', 'en')
+    page = int(request.GET.get('page', 1))
+    page_size = int(request.GET.get('pageSize', 100))
+
+    success, ldap_response = await async_ldap_service.get_active_courses(
+        access_token, lang, page, page_size, refresh=bypass_requested(request)
+    )
+    return _proxy_response(success, ldap_response, 'Не удалось получить курсы')
+
+
+@async_api_view(['GET'])
+async def ldap_get_course_grades(request):
+    """Оценки по курсам из LDAP"""
+    access_token = _bearer_token(request)
+    if not access_token:
+        return _token_required()
+
+    success, ldap_response = await async_ldap_service.get_course_grades(
+        access_token, refresh=bypass_requested(request)
+    )
+    if success:
+        return _versioned_response(request, 'grades', access_token, ldap_response, _success)
+    return _proxy_response(success, ldap_response, 'Не удалось получить оценки')
+
+
+@async_api_view(['GET'])
+async def ldap_get_course_attendance(request):
+    """Посещаемость из LDAP"""
+    access_token = _bearer_token(request)
+    if not access_token:
+        return _token_required()
+
+    success, ldap_response = await async_ldap_service.get_course_attendance(
+        access_token, refresh=bypass_requested(request)
+    )
+    if success:
+        return _versioned_response(request, 'attendance', access_token, ldap_response, _success)
+    return _proxy_response(success, ldap_response, 'Не удалось получить данные о посещаемости')
+
+
+async def _summary(request, name, default_error):
+    access_token = _bearer_token(request)
+    if not access_token:
+        return _token_required()
+
+    success, ldap_response = await async_ldap_service.get_summary(
+        name, access_token, refresh=bypass_requested(request)
+    )
+    if success:
+        return _summary_response(request, ldap_response, _success)
+    return _proxy_response(success, ldap_response, default_error)
+
+
+@async_api_view(['GET'])
+async def ldap_get_grades_summary(request):
+    """Сводка оценок (средний балл, GPA, оценки по курсам)"""
+    return await _summary(request, 'grades', 'Не удалось получить оценки')
+
+
+@async_api_view(['GET'])
+async def ldap_get_attendance_summary(request):
+    """Сводка посещаемости (процент по курсам и в целом)"""
+    return await _summary(request, 'attendance', 'Не удалось получить данные о посещаемости')
+
+
+@async_api_view(['POST'])
+async def ldap_get_messages(request):
+    """Сообщения из LDAP"""
+    access_token = _bearer_token(request)
+    if not access_token:
+        return _token_required()
+
+    if getattr(settings, 'LDAP_INBOX_MIRROR', False):
+        # Копия сообщений в БД (см. inbox.py); в потоке запроса (thread_sensitive), где
+        # соединение с БД закрывается по request_finished - в потоках пула оно бы осталось открытым
+        data = _request_data(request)
+        success, ldap_response = await sync_to_async(message_inbox.read)(
+            access_token,
+            since=parse_cursor(request.GET.get('since', data.get('since'))),
+            before=parse_cursor(request.GET.get('before', data.get('before'))),
+            refresh=bypass_requested(request),
+        )
+    else:
+        success, ldap_response = await async_ldap_service.get_messages(
+            access_token, refresh=bypass_requested(request)
+        )
+    return _proxy_response(success, ldap_response, 'Не удалось получить сообщения')
+
+
+@async_api_view(['POST'])
+async def ldap_upload_image(request):
+    """Загрузка изображения в LDAP"""
+    access_token = _bearer_token(request)
+    if not access_token:
+        return _token_required()
+
+    if _upload_exceeds_limit(request):
+        return _json(_upload_too_large_error(), status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    if 'image' not in request.FILES:
+        return _json({
+            'success': False,
+            'error': 'Файл изображения обязателен'
+        }, status.HTTP_400_BAD_REQUEST)
+
+    files = {'image': request.FILES['image']}
+
+    success, ldap_response = await async_ldap_service.upload_image(access_token, files)
+    if not success and 'max_size' in ldap_response:
+        return _json(_upload_too_large_error(), status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    return _proxy_response(success, ldap_response, 'Не удалось загрузить изображение')
+
+
+@async_api_view(['GET'])
+async def search_students(request):
+    """Поиск студентов через LDAP (см. student_search.search_students)"""
+    access_token = _bearer_token(request)
+    if not access_token:
+        return _token_required()
+
+    try:
+        query = request.GET.get('q', '')
+        group = request.GET.get('group')
+        limit = int(request.GET.get('limit', 50))
+        offset = _search_offset(request, limit)
+    except ValueError:
+        return _json({
+            'success': False,
+            'error': 'Неверные параметры запроса'
+        }, status.HTTP_400_BAD_REQUEST)
+
+    if not query and not group:
+        return _json({
+            'success': False,
+            'error': 'Необходимо указать хотя бы один параметр поиска'
+        }, status.HTTP_400_BAD_REQUEST)
+
+    success, ldap_response = await async_ldap_service.search_students(
+        access_token,
+        query=query if query else None,
+        group=group if group else None,
+        limit=limit,
+        offset=offset,
+        typeahead=_typeahead_requested(request)
+    )
+
+    if not success:
+        unavailable = _unavailable_response(ldap_response)
+        if unavailable:
+            return unavailable
+
+        error_message = ldap_response.get('error', 'Не удалось найти студентов')
+
+        if 'timeout' in error_message.lower() or 'connection' in error_message.lower():
+            response_status = status.HTTP_503_SERVICE_UNAVAILABLE
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+
+        return _json({
+            'success': False,
+            'error': error_message
+        }, response_status)
+
+    students = ldap_response.get('students', [])
+    for student in students:
+        student['avatar'] = None
+
+    return _json({
+        'success': True,
+        'data': students,
+        'next_cursor': ldap_response.get('next_cursor')
+    })
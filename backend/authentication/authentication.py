@@ -0,0 +1,169 @@
+"""
+DRF аутентификация по LDAP Bearer токену
+
+Токен проверяется лениво: authenticate() не обращается к LDAP API, профиль
+запрашивается только при первом обращении к данным пользователя
+(request.user.username, is_authenticated и т.д.). Результат кэшируется по хэшу
+токена на время жизни токена, поэтому повторные запросы с тем же токеном
+обходятся без LDAP API.
+"""
+
+import base64
+import json
+import logging
+import time
+from typing import Dict, Optional
+
+from django.conf import settings
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from .cache import TTLCache, token_hash
+from .ldap_service import ldap_service
+
+logger = logging.getLogger(__name__)
+
+# Хэш токена -> данные пользователя (None - токен отклонен LDAP API)
+identity_cache = TTLCache(maxsize=getattr(settings, 'LDAP_IDENTITY_CACHE_MAXSIZE', 10000))
+
+_MISSING = object()
+
+
+def _token_lifetime(access_token: str) -> Optional[float]:
+    """
+    Сколько секунд токен еще действителен (по полю exp, если токен - JWT)
+    Подпись не проверяется: значение используется только как TTL кэша
+    """
+    parts = access_token.split('.')
+    if len(parts) != 3:
+        return None
+    try:
+        payload = parts[1] + '=' * (-len(parts[1]) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(exp, (int, float)):
+        return None
+    return exp - time.time()
+
+
+def identity_from_profile(profile: Dict) -> Dict:
+    """Данные пользователя из профиля LDAP"""
+    email = profile.get('email')
+    username = email.split('@')[0] if email else profile.get('uid', 'unknown')
+    return {
+        'username': username,
+        'email': profile.get('email', f'{username}@tiue.uz'),
+        'full_name': profile.get('full_name', ''),
+        'group': profile.get('group'),
+    }
+
+
+def resolve_identity(access_token: str) -> Optional[Dict]:
+    """
+    Данные пользователя по токену (None - токен недействителен или LDAP недоступен)
+    """
+    key = token_hash(access_token)
+    identity = identity_cache.get(key)
+    if identity is not None:
+        return identity or None
+
+    success, profile = ldap_service.get_user_profile(access_token)
+    if success:
+        identity = identity_from_profile(profile)
+        ttl = _token_lifetime(access_token)
+        if ttl is None:
+            ttl = getattr(settings, 'LDAP_IDENTITY_TTL', 3600)
+        ttl = min(ttl, getattr(settings, 'LDAP_IDENTITY_MAX_TTL', 86400))
+        if ttl > 0:
+            identity_cache.set(key, identity, ttl)
+        return identity
+
+    # Отказ LDAP API (timeout, circuit breaker) - не повод считать токен неверным
+    error = str(profile.get('error', '')).lower()
+    if 'retry_after' not in profile and 'timeout' not in error and 'connection' not in error:
+        # Пустой dict - "токен отклонен", ненадолго, чтобы не спрашивать LDAP на каждый запрос
+        identity_cache.set(key, {}, getattr(settings, 'LDAP_IDENTITY_NEGATIVE_TTL', 30))
+    return None
+
+
+class LDAPUser:
+    """
+    Пользователь LDAP (без записи в БД), определяется по Bearer токену
+    Профиль загружается при первом обращении к данным пользователя
+    """
+
+    is_active = True
+    is_staff = False
+    is_superuser = False
+    pk = None
+    id = None
+
+    def __init__(self, access_token: str):
+        self.token = access_token
+        self._identity = _MISSING
+
+    @property
+    def identity(self) -> Optional[Dict]:
+        if self._identity is _MISSING:
+            self._identity = resolve_identity(self.token)
+        return self._identity
+
+    @property
+    def is_authenticated(self) -> bool:
+        return self.identity is not None
+
+    @property
+    def is_anonymous(self) -> bool:
+        return not self.is_authenticated
+
+    def _field(self, name: str, default=''):
+        return (self.identity or {}).get(name, default)
+
+    @property
+    def username(self) -> str:
+        return self._field('username')
+
+    @property
+    def email(self) -> str:
+        return self._field('email')
+
+    @property
+    def full_name(self) -> str:
+        return self._field('full_name')
+
+    @property
+    def group(self) -> Optional[str]:
+        return self._field('group', None)
+
+    def get_username(self) -> str:
+        return self.username
+
+    def __str__(self):
+        return self.username or 'LDAP user'
+
+
+class LDAPBearerAuthentication(BaseAuthentication):
+    """
+    Authorization: Bearer <LDAP access token>
+
+    request.user - LDAPUser, request.auth - сам токен
+
+    Не подключается глобально (DEFAULT_AUTHENTICATION_CLASSES): LDAPUser не
+    является записью CustomUser, поэтому класс указывается только во views,
+    которые умеют с ним работать (authentication_classes)
+    """
+
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if len(auth) != 2 or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        try:
+            access_token = auth[1].decode()
+        except UnicodeError:
+            return None
+        return LDAPUser(access_token), access_token
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,303 @@
+"""
+Bulkhead: ограничение одновременных запросов к LDAP API в процессе воркера
+
+Не больше max_concurrent запросов выполняются одновременно, еще max_queue
+ждут свободного места не дольше queue_timeout. Остальные сразу получают
+отказ (503 + Retry-After), поэтому медленный LDAP API не занимает все потоки
+воркера и локальные endpoints (новости, media) продолжают отвечать.
+
+Приоритеты запросов (upstream_priority):
+- AUTH        - вход и обновление токена: может занять все места
+- INTERACTIVE - чтение данных для пользователя: не занимает auth_reserve мест
+- BACKGROUND  - фоновые обновления, прогрев, синхронизация: только свободная
+                емкость (не больше background_share от max_concurrent)
+Освободившееся место получает ожидающий запрос с наивысшим приоритетом,
+поэтому вход никогда не ждет за фоновой синхронизацией.
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict
+
+from django.conf import settings
+
+AUTH = 0
+INTERACTIVE = 1
+BACKGROUND = 2
+
+PRIORITY_NAMES = {AUTH: 'auth', INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+# Приоритет запросов к LDAP API текущего потока/корутины
+_priority = contextvars.ContextVar('upstream_priority', default=INTERACTIVE)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+@contextmanager
+def upstream_priority(priority: int):
+    """Запросы к LDAP API внутри блока выполняются с приоритетом priority"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class BulkheadFull(Exception):
+    """Нет свободного места для запроса к LDAP API"""
+
+    def __init__(self, retry_after: int):
+        super().__init__('LDAP bulkhead is full')
+        self.retry_after = retry_after
+
+
+class _BulkheadStats:
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float, retry_after: int,
+                 auth_reserve: int, background_share: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        # Сколько мест может занять каждый приоритет
+        self.limits = {
+            AUTH: max_concurrent,
+            INTERACTIVE: max(1, max_concurrent - auth_reserve),
+            BACKGROUND: max(1, int(max_concurrent * background_share)),
+        }
+        self.active = 0
+        self.peak_active = 0
+        self.waiting = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.accepted = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.queued = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.rejected = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.timed_out = dict.fromkeys(PRIORITY_NAMES, 0)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0
+
+    def _can_enter(self, priority: int) -> bool:
+        if self.active >= self.limits[priority]:
+            return False
+        # Место достается сначала ожидающим с более высоким приоритетом
+        return not any(self.waiting[p] for p in PRIORITY_NAMES if p < priority)
+
+    def _queue_full(self, priority: int) -> bool:
+        # Фоновые запросы стоят в своей очереди и не вытесняют пользовательские
+        if priority == BACKGROUND:
+            return self.waiting[BACKGROUND] >= self.max_queue
+        return self.waiting[AUTH] + self.waiting[INTERACTIVE] >= self.max_queue
+
+    def _try_leave_queue(self, priority: int) -> bool:
+        """Ожидающий запрос занимает место, если оно ему уже положено"""
+        self.waiting[priority] -= 1
+        if self._can_enter(priority):
+            return True
+        self.waiting[priority] += 1
+        return False
+
+    def _enter(self, priority: int):
+        self.active += 1
+        self.accepted[priority] += 1
+        self.peak_active = max(self.peak_active, self.active)
+
+    def _reject(self, priority: int) -> BulkheadFull:
+        self.rejected[priority] += 1
+        return BulkheadFull(self.retry_after)
+
+    def _snapshot(self) -> Dict[str, Any]:
+        def named(counters):
+            return {PRIORITY_NAMES[p]: value for p, value in counters.items()}
+
+        return {
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'limits': named(self.limits),
+            'active': self.active,
+            'peak_active': self.peak_active,
+            'waiting': named(self.waiting),
+            'accepted': named(self.accepted),
+            'queued': named(self.queued),
+            'rejected': named(self.rejected),
+            'timed_out': named(self.timed_out),
+        }
+
+
+class Bulkhead(_BulkheadStats):
+    """
+    Bulkhead для потоков воркера
+
+    Args:
+        max_concurrent: одновременных запросов (0 - без ограничения)
+        max_queue: сколько запросов может ждать места
+        queue_timeout: сколько ждать места (сек)
+        retry_after: Retry-After при отказе (сек)
+        auth_reserve: сколько мест доступны только входу/обновлению токена
+        background_share: доля мест, которую могут занять фоновые запросы
+    """
+
+    def __init__(self, max_concurrent: int = 20, max_queue: int = 20, queue_timeout: float = 2,
+                 retry_after: int = 2, auth_reserve: int = 2, background_share: float = 0.5):
+        super().__init__(max_concurrent, max_queue, queue_timeout, retry_after,
+                         auth_reserve, background_share)
+        self._cond = threading.Condition()
+
+    def acquire(self, priority: int = None):
+        """Занимает место (по умолчанию с текущим приоритетом) или выбрасывает BulkheadFull"""
+        if not self.enabled:
+            return
+        if priority is None:
+            priority = current_priority()
+        with self._cond:
+            if self._can_enter(priority):
+                self._enter(priority)
+                return
+            if self._queue_full(priority):
+                raise self._reject(priority)
+
+            self.waiting[priority] += 1
+            self.queued[priority] += 1
+            deadline = time.monotonic() + self.queue_timeout
+            while not self._try_leave_queue(priority):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.waiting[priority] -= 1
+                    self.timed_out[priority] += 1
+                    # Менее приоритетные запросы больше не ждут этот
+                    self._cond.notify_all()
+                    raise self._reject(priority)
+                self._cond.wait(remaining)
+            self._enter(priority)
+
+    def release(self):
+        if not self.enabled:
+            return
+        with self._cond:
+            self.active -= 1
+            # Все ожидающие перепроверяют очередь: место получит самый приоритетный
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: int = None):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return self._snapshot()
+
+
+class AsyncBulkhead(_BulkheadStats):
+    """
+    Bulkhead для корутин (async сервис); параметры как у Bulkhead
+
+    Счетчики общие для всех event loop'ов процесса (ASGI loop и loop'ы
+    async_to_sync в потоках) и защищены threading.Lock. Ожидающий запрос ждет
+    future своего loop'а; освободившееся место передается ему прямо в release.
+    """
+
+    def __init__(self, max_concurrent: int = 200, max_queue: int = 200, queue_timeout: float = 2,
+                 retry_after: int = 2, auth_reserve: int = 10, background_share: float = 0.5):
+        super().__init__(max_concurrent, max_queue, queue_timeout, retry_after,
+                         auth_reserve, background_share)
+        self._lock = threading.Lock()
+        self._waiters = {priority: deque() for priority in PRIORITY_NAMES}
+
+    def _wake(self):
+        """Отдает свободные места ожидающим, начиная с высшего приоритета (под self._lock)"""
+        for priority in sorted(PRIORITY_NAMES):
+            waiters = self._waiters[priority]
+            while waiters and self._try_leave_queue(priority):
+                waiter = waiters.popleft()
+                self._enter(priority)
+                try:
+                    waiter.get_loop().call_soon_threadsafe(_grant, waiter)
+                except RuntimeError:
+                    # Event loop ожидающего уже закрыт - место свободно
+                    self.active -= 1
+
+    async def acquire(self, priority: int = None):
+        if not self.enabled:
+            return
+        if priority is None:
+            priority = current_priority()
+        with self._lock:
+            if self._can_enter(priority):
+                self._enter(priority)
+                return
+            if self._queue_full(priority):
+                raise self._reject(priority)
+
+            self.waiting[priority] += 1
+            self.queued[priority] += 1
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            self._waiters[priority].append(waiter)
+
+        timer = loop.call_later(self.queue_timeout, _expire, waiter)
+        try:
+            await waiter
+        except BaseException as e:
+            # Таймаут или отмена: место могло быть выдано в release одновременно с ними,
+            # поэтому решение принимается под блокировкой
+            with self._lock:
+                granted = waiter not in self._waiters[priority]
+                if not granted:
+                    self._waiters[priority].remove(waiter)
+                    self.waiting[priority] -= 1
+                    # Менее приоритетные запросы больше не ждут этот
+                    self._wake()
+                    if isinstance(e, asyncio.TimeoutError):
+                        self.timed_out[priority] += 1
+                        raise self._reject(priority)
+            if not granted:
+                raise
+            if not isinstance(e, asyncio.TimeoutError):
+                # Отмененная корутина место не использует
+                await self.release()
+                raise
+        finally:
+            timer.cancel()
+
+    async def release(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.active = max(0, self.active - 1)
+            self._wake()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = None):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            await self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._snapshot()
+
+
+def _grant(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def _expire(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_exception(asyncio.TimeoutError())
+
+
+upstream_bulkhead = Bulkhead(**getattr(settings, 'LDAP_BULKHEAD', {}))
+async_upstream_bulkhead = AsyncBulkhead(**getattr(settings, 'LDAP_ASYNC_BULKHEAD', {}))
@@ -0,0 +1,137 @@
+"""
+Кэш ответов LDAP API
+LRU с ограничением размера и TTL на каждую запись; ключи содержат только хэш токена
+"""
+
+import contextvars
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from django.conf import settings
+
+
+def token_hash(token: str) -> str:
+    """Хэш токена для ключей кэша (сам токен в памяти кэша не хранится)"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
+
+
+def make_key(name: str, access_token: str, params: Optional[Dict] = None) -> tuple:
+    """Ключ кэша: endpoint + хэш токена + параметры запроса"""
+    return (name, token_hash(access_token), tuple(sorted((params or {}).items())))
+
+
+def bypass_requested(request) -> bool:
+    """
+    Клиент просит свежие данные (pull-to-refresh):
+    ?refresh=1 или заголовок Cache-Control: no-cache
+    """
+    if request.GET.get('refresh') in ('1', 'true', 'True'):
+        return True
+    return 'no-cache' in request.META.get('HTTP_CACHE_CONTROL', '')
+
+
+class TTLCache:
+    """
+    Потокобезопасный LRU кэш с TTL
+
+    Значения возвращаются как есть, без копирования - вызывающий код
+    не должен их изменять
+    """
+
+    def __init__(self, maxsize: int = 1000):
+        self.maxsize = maxsize
+        self._data: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# Общий кэш ответов для sync и async сервисов
+response_cache = TTLCache(maxsize=getattr(settings, 'LDAP_CACHE_MAXSIZE', 5000))
+
+# Последние успешные ответы (stale-while-revalidate): (время получения, ответ)
+stale_store = TTLCache(maxsize=getattr(settings, 'LDAP_STALE_MAXSIZE', 5000))
+
+# Хэши токенов, которые LDAP API отклонил (401/403): устаревшие ответы
+# под такими токенами больше не отдаются, даже для других endpoint'ов
+rejected_tokens = TTLCache(maxsize=getattr(settings, 'LDAP_STALE_MAXSIZE', 5000))
+
+# Результат обмена refresh token'а (по хэшу старого токена) на grace-период:
+# опоздавшие запросы со старым токеном получают ту же новую пару токенов
+refresh_results = TTLCache(maxsize=getattr(settings, 'LDAP_REFRESH_CACHE_MAXSIZE', 1000))
+
+# Отформатированные результаты поиска студентов (общие для всех пользователей):
+# (нормализованный запрос, группа, limit, offset) -> {'students', 'next_cursor', 'total'}
+search_cache = TTLCache(maxsize=getattr(settings, 'LDAP_SEARCH_CACHE_MAXSIZE', 2000))
+
+# Полные выдачи typeahead поиска: (запрос, группа) -> все найденные студенты;
+# выдачу более длинного запроса с тем же началом можно отфильтровать локально
+typeahead_cache = TTLCache(maxsize=getattr(settings, 'LDAP_SEARCH_CACHE_MAXSIZE', 2000))
+
+# Последние версии ответов оценок/посещаемости для ETag и дельт:
+# (endpoint, хэш токена) -> {версия: ответ}
+payload_versions = TTLCache(maxsize=getattr(settings, 'LDAP_VERSIONS_MAXSIZE', 5000))
+
+# Сводки оценок/посещаемости: (endpoint, хэш ответа) -> сводка
+summary_cache = TTLCache(maxsize=getattr(settings, 'LDAP_SUMMARY_CACHE_MAXSIZE', 5000))
+
+# Возраст (сек) устаревшего ответа, который только что вернул сервис в текущем
+# потоке/корутине; None - ответ свежий
+_response_age = contextvars.ContextVar('ldap_response_age', default=None)
+
+
+def set_response_age(age: Optional[int]):
+    _response_age.set(age)
+
+
+def response_age() -> Optional[int]:
+    """Возраст последнего ответа сервиса, если он был отдан из stale_store"""
+    return _response_age.get()
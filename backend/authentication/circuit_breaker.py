@@ -0,0 +1,137 @@
+"""
+Circuit breaker для LDAP API (отдельно по каждому endpoint'у)
+
+closed    - запросы идут как обычно, считается доля ошибок в скользящем окне
+open      - доля ошибок превысила порог: запросы сразу отклоняются
+half_open - после паузы пропускается несколько пробных запросов;
+            успех закрывает цепь, ошибка снова открывает
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Dict
+
+from django.conf import settings
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Args:
+        failure_rate: доля ошибок в окне, при которой цепь открывается
+        min_calls: минимум вызовов в окне для расчета доли ошибок
+        window: размер скользящего окна (последние N вызовов)
+        open_seconds: сколько держать цепь открытой до пробных запросов
+        half_open_calls: сколько пробных запросов пропускать одновременно
+    """
+
+    def __init__(self, failure_rate: float = 0.5, min_calls: int = 10, window: int = 20,
+                 open_seconds: float = 30, half_open_calls: int = 1):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)  # True - успех, False - ошибка
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос (каждый разрешенный вызов обязан закончиться record())"""
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self._state = HALF_OPEN
+                self._probes = 0
+
+            if self._state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self.rejected += 1
+                    return False
+                self._probes += 1
+
+            return True
+
+    def record(self, success: bool):
+        """Результат разрешенного запроса"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if success:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+
+            self._outcomes.append(success)
+            if self._state == CLOSED and len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.failure_rate:
+                    self._open()
+
+    def cancel(self):
+        """Разрешенный запрос так и не был отправлен (результат не учитывается)"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probes = 0
+        self.opened += 1
+
+    def retry_after(self) -> float:
+        """Через сколько секунд цепь пропустит пробный запрос"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = self._outcomes.count(False)
+            return {
+                'state': self._state,
+                'calls': calls,
+                'failure_rate': round(failures / calls, 3) if calls else 0.0,
+                'opened': self.opened,
+                'rejected': self.rejected,
+            }
+
+
+class CircuitBreakerRegistry:
+    """Circuit breaker на каждый endpoint LDAP API"""
+
+    def __init__(self, **options):
+        self.options = options
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, endpoint: str) -> CircuitBreaker:
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(endpoint)
+                if breaker is None:
+                    breaker = self._breakers[endpoint] = CircuitBreaker(**self.options)
+        return breaker
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {endpoint: breaker.snapshot() for endpoint, breaker in list(self._breakers.items())}
+
+
+# Общие для sync и async сервисов
+circuit_breakers = CircuitBreakerRegistry(**getattr(settings, 'LDAP_CIRCUIT_BREAKER', {}))
@@ -0,0 +1,207 @@
+"""
+Пул keep-alive соединений к LDAP API
+Одна requests.Session на процесс воркера + счетчики насыщения пула по хостам
+Соединения пула замеряют DNS/connect/TLS для трассы текущего запроса (tracing)
+"""
+
+import socket
+import threading
+import logging
+import time
+from typing import Dict, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+from .tracing import current_trace
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """
+    Счетчики использования пула соединений (по хостам)
+
+    - requests: сколько раз соединение бралось из пула
+    - new_connections: сколько TCP/TLS соединений было открыто
+    - in_use / peak_in_use: занятые соединения сейчас и максимум
+    - saturated: запросы, пришедшие когда все соединения хоста были заняты
+    - discarded: соединения, закрытые из-за переполнения пула
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, Dict[str, int]] = {}
+
+    def _host(self, host: str) -> Dict[str, int]:
+        counters = self._hosts.get(host)
+        if counters is None:
+            counters = self._hosts[host] = {
+                'requests': 0,
+                'new_connections': 0,
+                'in_use': 0,
+                'peak_in_use': 0,
+                'saturated': 0,
+                'discarded': 0,
+                'maxsize': 0,
+            }
+        return counters
+
+    def acquire(self, host: str, maxsize: int):
+        with self._lock:
+            counters = self._host(host)
+            counters['requests'] += 1
+            counters['in_use'] += 1
+            counters['maxsize'] = maxsize
+            if counters['in_use'] > counters['peak_in_use']:
+                counters['peak_in_use'] = counters['in_use']
+            if maxsize and counters['in_use'] > maxsize:
+                counters['saturated'] += 1
+
+    def release(self, host: str):
+        with self._lock:
+            counters = self._host(host)
+            counters['in_use'] = max(0, counters['in_use'] - 1)
+
+    def incr(self, host: str, counter: str):
+        with self._lock:
+            self._host(host)[counter] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {host: dict(counters) for host, counters in self._hosts.items()}
+
+    def reset(self):
+        with self._lock:
+            self._hosts.clear()
+
+
+# Счетчики текущего процесса
+pool_stats = PoolStats()
+
+
+class _TimedConnectionMixin:
+    """Замер фаз соединения для current_trace (если запрос трассируется)"""
+
+    def _new_conn(self):
+        trace = current_trace.get()
+        if trace is None:
+            return super()._new_conn()
+
+        host = self._dns_host
+        started = time.perf_counter()
+        try:
+            infos = socket.getaddrinfo(host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror:
+            # Ошибку в привычном виде (NameResolutionError) сформирует urllib3
+            return super()._new_conn()
+        resolved = time.perf_counter()
+        trace.add_phase('dns', resolved - started)
+
+        # Подключаемся к уже разрешенным адресам по очереди, как create_connection
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    sock = super()._new_conn()
+                    break
+                except (NewConnectionError, ConnectTimeoutError):
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+            trace.add_phase('connect', time.perf_counter() - resolved)
+        return sock
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.headers_received()
+        return response
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+
+    def connect(self):
+        trace = current_trace.get()
+        if trace is None:
+            return super().connect()
+        tcp_before = trace.dns + trace.connect
+        started = time.perf_counter()
+        super().connect()
+        # Все время connect(), кроме DNS и TCP - TLS handshake
+        tcp = trace.dns + trace.connect - tcp_before
+        trace.add_phase('tls', max(0.0, time.perf_counter() - started - tcp))
+
+
+class _CountingPoolMixin:
+    """Подсчитывает выдачу/возврат соединений urllib3 пула"""
+
+    def _get_conn(self, timeout=None):
+        maxsize = self.pool.maxsize if self.pool is not None else 0
+        pool_stats.acquire(self.host, maxsize)
+        try:
+            return super()._get_conn(timeout=timeout)
+        except Exception:
+            pool_stats.release(self.host)
+            raise
+
+    def _put_conn(self, conn):
+        pool_stats.release(self.host)
+        if conn is not None and self.pool is not None and self.pool.full():
+            pool_stats.incr(self.host, 'discarded')
+        super()._put_conn(conn)
+
+    def _new_conn(self):
+        pool_stats.incr(self.host, 'new_connections')
+        return super()._new_conn()
+
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter, использующий пулы соединений со счетчиками"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+def build_session(pool_connections: int, pool_maxsize: int, pool_block: bool) -> requests.Session:
+    """
+    Создает Session с keep-alive пулом
+
+    Args:
+        pool_connections: сколько хостов держать в пуле
+        pool_maxsize: максимальное число соединений на один хост
+        pool_block: ждать свободное соединение вместо открытия лишнего
+    """
+    session = requests.Session()
+    adapter = PooledHTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.verify = False  # Отключаем проверку SSL сертификата
+    return session
@@ -0,0 +1,288 @@
+"""
+Локальная копия сообщений LDAP (инкрементальный inbox)
+
+LDAP API отдает только полный список /mobile/messages-list. Список
+загружается в фоне не чаще раза в interval секунд на пользователя и
+сливается с таблицей MirroredMessage по ID сообщения: новые сообщения
+добавляются, измененные (прочитано) обновляются, исчезнувшие удаляются.
+Клиент читает копию (новые сообщения первыми): ?since=<cursor> возвращает
+только сообщения, появившиеся после курсора, ?before=<id> - следующую страницу
+более старых, и число непрочитанных. Если копия недоступна, ответ той же формы
+строится из списка LDAP API.
+
+Интервал соблюдается между всеми воркерами: обновление "занимается"
+условным UPDATE строки MessageMirrorState.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .authentication import resolve_identity
+from .ldap_service import ldap_service
+from .models import MessageMirrorState, MirroredMessage
+from .payload import RawPayload
+from .refresher import background_refresher
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_ID_FIELDS = ('id', 'message_id')
+READ_FIELDS = ('is_read', 'read', 'seen')
+# Курсоры ответа без копии (хэши ID сообщений) начинаются отсюда
+UPSTREAM_CURSOR_BASE = 1 << 52
+
+
+def _message_list(payload: Any) -> Optional[List[Dict]]:
+    """Сообщения ответа LDAP API ({"data": [...]} или [...]); None - формат неизвестен"""
+    try:
+        data = payload.data if isinstance(payload, RawPayload) else payload
+    except ValueError:
+        return None
+    if isinstance(data, dict):
+        data = data.get('data')
+    if not isinstance(data, list):
+        return None
+    return [message for message in data if isinstance(message, dict)]
+
+
+def message_id(message: Dict) -> str:
+    """ID сообщения; у сообщения без ID - хэш содержимого без отметки о прочтении"""
+    for field in MESSAGE_ID_FIELDS:
+        if message.get(field) is not None:
+            return str(message[field])[:128]
+    # Прочитанное сообщение - то же сообщение: его строка обновляется, а не заменяется
+    stable = {key: value for key, value in message.items() if key not in READ_FIELDS}
+    body = json.dumps(stable, sort_keys=True, ensure_ascii=False)
+    return 'sha:' + hashlib.blake2b(body.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _upstream_cursor(key: str) -> int:
+    """
+    Курсор сообщения без копии: хэш его ID в [2**52, 2**53)
+
+    Точно представим в JS Number и не пересекается с id строк копии.
+    """
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return UPSTREAM_CURSOR_BASE | int.from_bytes(digest, 'big') >> 13
+
+
+def _is_read(message: Dict) -> bool:
+    for field in READ_FIELDS:
+        if field in message:
+            return bool(message[field])
+    return False
+
+
+def parse_cursor(value) -> Optional[int]:
+    """Курсор since: неотрицательное целое или None"""
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        return None
+    return cursor if cursor >= 0 else None
+
+
+class MessageInbox:
+    """
+    Копия сообщений пользователей
+
+    Args:
+        interval: не чаще одного обновления из LDAP API на пользователя (сек)
+        page_size: максимум сообщений в одном ответе
+    """
+
+    def __init__(self, interval: int = 60, page_size: int = 200):
+        self.interval = interval
+        self.page_size = page_size
+
+    def _state(self, username: str) -> MessageMirrorState:
+        state, _ = MessageMirrorState.objects.get_or_create(
+            username=username, defaults={'requested_at': timezone.now()}
+        )
+        return state
+
+    def _claim(self, username: str) -> bool:
+        """Занимает фоновое обновление пользователя, если с прошлого прошло interval секунд"""
+        now = timezone.now()
+        # Условный UPDATE: из одновременных запросов (в т.ч. других воркеров) обновляет один
+        return MessageMirrorState.objects.filter(
+            username=username, requested_at__lte=now - datetime.timedelta(seconds=self.interval)
+        ).update(requested_at=now) == 1
+
+    def sync(self, username: str, access_token: str) -> Tuple[bool, Dict]:
+        """
+        Загружает список сообщений из LDAP API и сливает его с копией
+
+        Returns:
+            Tuple[bool, Dict]: (success, {'added', 'updated', 'removed'} | ошибка)
+        """
+        success, response = ldap_service.get_messages(access_token, refresh=True)
+        if not success:
+            return success, response
+        messages = _message_list(response)
+        if messages is None:
+            logger.warning(f"Inbox sync for {username}: unexpected messages payload")
+            return False, {'error': 'Unexpected messages payload'}
+
+        incoming = {}
+        for message in messages:
+            incoming.setdefault(message_id(message), message)
+
+        with transaction.atomic():
+            existing = {
+                row.message_id: row
+                for row in MirroredMessage.objects.filter(username=username)
+            }
+            # Новые сообщения в порядке списка LDAP API получают возрастающие id
+            added = [
+                MirroredMessage(username=username, message_id=key, data=message, is_read=_is_read(message))
+                for key, message in incoming.items() if key not in existing
+            ]
+            changed = []
+            now = timezone.now()
+            for key, row in existing.items():
+                message = incoming.get(key)
+                if message is not None and (row.data != message or row.is_read != _is_read(message)):
+                    row.data, row.is_read, row.updated_at = message, _is_read(message), now
+                    changed.append(row)
+            removed = [row.pk for key, row in existing.items() if key not in incoming]
+
+            MirroredMessage.objects.bulk_create(added, ignore_conflicts=True)
+            if changed:
+                MirroredMessage.objects.bulk_update(changed, ['data', 'is_read', 'updated_at'])
+            if removed:
+                MirroredMessage.objects.filter(pk__in=removed).delete()
+            MessageMirrorState.objects.filter(username=username).update(
+                requested_at=now, synced_at=now, messages=len(incoming)
+            )
+
+        logger.info(f"Inbox sync for {username}: +{len(added)} ~{len(changed)} -{len(removed)}")
+        return True, {'added': len(added), 'updated': len(changed), 'removed': len(removed)}
+
+    def _sync_in_background(self, username: str, access_token: str):
+        def run():
+            try:
+                success, response = self.sync(username, access_token)
+                if not success:
+                    logger.warning(f"Inbox background sync for {username} failed: {response.get('error')}")
+            finally:
+                # Поток пула не обслуживает запросы - соединение с БД закрываем сами
+                connection.close()
+        background_refresher.submit(('inbox', username), run)
+
+    def read(self, access_token: str, since: Optional[int] = None, before: Optional[int] = None,
+             refresh: bool = False) -> Tuple[bool, Dict]:
+        """
+        Сообщения пользователя из копии (новые первыми)
+
+        Первое обращение (копия пуста) и refresh загружают сообщения сразу,
+        иначе копия обновляется в фоне не чаще interval.
+
+        Args:
+            since: курсор - вернуть только сообщения, появившиеся после него
+            before: id - вернуть сообщения старше него (следующая страница)
+            refresh: обновить копию из LDAP API до ответа
+
+        Returns:
+            Tuple[bool, Dict]: (success, {'data', 'count', 'unread_count', 'cursor',
+            'has_more', 'next_before', 'synced_at'})
+        """
+        identity = resolve_identity(access_token)
+        username = identity.get('username') if identity else None
+        if not username or username == 'unknown':
+            # Токен отклонен или LDAP недоступен - ответ (и ошибку) дает LDAP API
+            return self._upstream(access_token, since, before, refresh)
+
+        try:
+            state = self._state(username)
+            if refresh or state.synced_at is None:
+                success, response = self.sync(username, access_token)
+                if not success and state.synced_at is None:
+                    return success, response
+            elif self._claim(username):
+                self._sync_in_background(username, access_token)
+            return True, self._page(username, since, before)
+        except DatabaseError as e:
+            logger.error(f"Inbox mirror unavailable: {e}")
+            return self._upstream(access_token, since, before, refresh)
+
+    def _page(self, username: str, since: Optional[int], before: Optional[int]) -> Dict[str, Any]:
+        # Курсор ответа без копии (копия была недоступна) не ограничивает страницу
+        if since is not None and since >= UPSTREAM_CURSOR_BASE:
+            since = None
+        if before is not None and before >= UPSTREAM_CURSOR_BASE:
+            before = None
+        messages = MirroredMessage.objects.filter(username=username)
+        page = messages
+        if since is not None:
+            page = page.filter(id__gt=since)
+        if before is not None:
+            page = page.filter(id__lt=before)
+        rows = list(page.order_by('-id').values_list('id', 'data')[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        latest = messages.aggregate(latest=Max('id'))['latest']
+        state = MessageMirrorState.objects.filter(username=username).values_list('synced_at', flat=True).first()
+        return {
+            'data': [data for _, data in rows],
+            'count': len(rows),
+            'unread_count': messages.filter(is_read=False).count(),
+            # Курсор - самое новое сообщение копии, а не страницы: страницы идут от новых к старым
+            'cursor': max(latest or 0, since or 0),
+            'has_more': has_more,
+            'next_before': rows[-1][0] if has_more else None,
+            'synced_at': state.isoformat() if state else None,
+        }
+
+    def _upstream(self, access_token: str, since: Optional[int], before: Optional[int],
+                  refresh: bool) -> Tuple[bool, Dict]:
+        """
+        Ответ той же формы из списка LDAP API (копия недоступна)
+
+        Без копии нет id строк, поэтому курсоры - хэши ID сообщений (message_id),
+        а порядок - порядок списка LDAP API (как и в копии, позже - новее).
+        since получает сообщения новее курсора, before - старше; курсор,
+        которого нет в списке (сообщение удалено или курсор копии), не
+        ограничивает страницу.
+        """
+        success, response = ldap_service.get_messages(access_token, refresh=refresh)
+        if not success:
+            return success, response
+        messages = _message_list(response)
+        if messages is None:
+            return False, {'error': 'Unexpected messages payload'}
+
+        unique = {}
+        for message in messages:
+            unique.setdefault(message_id(message), message)
+        keys = list(reversed(unique))
+        cursors = [_upstream_cursor(key) for key in keys]
+        start, end = 0, len(keys)
+        if since is not None and since in cursors:
+            end = cursors.index(since)
+        if before is not None and before in cursors:
+            start = cursors.index(before) + 1
+        has_more = end - start > self.page_size
+        page = keys[start:min(end, start + self.page_size)]
+        return True, {
+            'data': [unique[key] for key in page],
+            'count': len(page),
+            'unread_count': sum(1 for message in unique.values() if not _is_read(message)),
+            'cursor': cursors[0] if cursors else since or 0,
+            'has_more': has_more,
+            'next_before': _upstream_cursor(page[-1]) if has_more else None,
+            'synced_at': None,
+        }
+
+
+message_inbox = MessageInbox(
+    interval=getattr(settings, 'LDAP_INBOX_SYNC_INTERVAL', 60),
+    page_size=getattr(settings, 'LDAP_INBOX_PAGE_SIZE', 200),
+)
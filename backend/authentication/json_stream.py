@@ -0,0 +1,137 @@
+"""
+Потоковый разбор JSON ответов LDAP API
+
+Разбирает массив объектов по мере получения данных, не загружая весь ответ
+в память: в буфере одновременно находится только текущий элемент и
+непрочитанный остаток последнего чанка.
+
+Поддерживаемые формы ответа (как у /mobile/students):
+    [{...}, {...}]
+    {"count": 2, "data": [{...}, {...}]}
+"""
+
+import codecs
+import json
+from typing import Dict, Iterable, Iterator, Optional
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+class _Buffer:
+    """Текст из чанков с позицией чтения"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Дочитывает следующий чанк; False - данные кончились"""
+        if self.eof:
+            return False
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            # Прочитанную часть отбрасываем, чтобы буфер не рос
+            self.text = self.text[self.pos:] + self._utf8.decode(chunk)
+            self.pos = 0
+            return True
+        self.text = self.text[self.pos:] + self._utf8.decode(b'', final=True)
+        self.pos = 0
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """Следующий значимый символ ('' - конец данных)"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f'Expected {char!r} at stream position {self.pos}')
+        self.pos += 1
+
+    def value(self):
+        """Следующее JSON значение целиком"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # Число на границе чанка могло быть прочитано не полностью
+            if end == len(self.text) and not self.eof and not isinstance(value, (dict, list, str)):
+                if self.fill():
+                    continue
+            self.pos = end
+            return value
+
+
+def _iter_array(buffer: _Buffer) -> Iterator:
+    buffer.expect('[')
+    if buffer.peek() == ']':
+        buffer.pos += 1
+        return
+    while True:
+        yield buffer.value()
+        char = buffer.peek()
+        buffer.pos += 1
+        if char == ']':
+            return
+        if char != ',':
+            raise ValueError(f'Expected "," or "]" at stream position {buffer.pos}')
+
+
+def iter_json_array(chunks: Iterable[bytes], key: str = 'data',
+                    meta: Optional[Dict] = None) -> Iterator:
+    """
+    Элементы JSON массива из потока байтов
+
+    Args:
+        chunks: байты ответа (например, response.iter_content())
+        key: ключ массива, если ответ - объект
+        meta: сюда попадают остальные ключи объекта (count и т.п.);
+              ключи после массива доступны только после окончания итерации
+
+    Raises:
+        ValueError: некорректный JSON или неожиданная структура ответа
+    """
+    buffer = _Buffer(chunks)
+    char = buffer.peek()
+
+    if char == '[':
+        yield from _iter_array(buffer)
+        return
+
+    if char != '{':
+        raise ValueError('Expected JSON array or object')
+
+    buffer.pos += 1
+    if buffer.peek() == '}':
+        return
+    while True:
+        name = buffer.value()
+        buffer.expect(':')
+        if name == key and buffer.peek() == '[':
+            yield from _iter_array(buffer)
+        else:
+            value = buffer.value()
+            if meta is not None:
+                meta[name] = value
+
+        char = buffer.peek()
+        buffer.pos += 1
+        if char == '}':
+            return
+        if char != ',':
+            raise ValueError(f'Expected "," or "}}" at stream position {buffer.pos}')
@@ -0,0 +1,134 @@
+"""
+Задержки LDAP API по endpoint'ам и адаптивные таймауты
+
+По последним N ответам каждого endpoint'а считаются перцентили:
+- read timeout = p99 * multiplier (в пределах [min_read, max_read])
+- задержка hedged запроса = p95
+
+Connect timeout общий для всех endpoint'ов (один хост LDAP API): p99 времени
+установки новых соединений (TCP + TLS) * multiplier, в пределах [min_connect, connect].
+
+Пока замеров меньше min_samples, используются консервативные значения
+(max_read, без hedging).
+"""
+
+import threading
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+
+
+class LatencyWindow:
+    """Скользящее окно длительностей запросов (сек)"""
+
+    def __init__(self, size: int = 200):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class AdaptiveTimeouts:
+    """
+    Args:
+        connect: connect timeout (сек), пока замеров мало, и его верхняя граница
+        min_connect: нижняя граница connect timeout (сек)
+        min_read / max_read: границы read timeout (сек)
+        multiplier: запас над p99
+        min_samples: сколько замеров нужно, чтобы доверять перцентилям
+        window: размер окна замеров на endpoint
+    """
+
+    def __init__(self, connect: float = 5, min_connect: float = 0.5, min_read: float = 2,
+                 max_read: float = 30, multiplier: float = 3, min_samples: int = 20,
+                 window: int = 200):
+        self.connect = connect
+        self.min_connect = min_connect
+        self.min_read = min_read
+        self.max_read = max_read
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.window = window
+        self._lock = threading.Lock()
+        self._windows: Dict[str, LatencyWindow] = {}
+        self._connects = LatencyWindow(window)
+
+    def _window(self, endpoint: str) -> LatencyWindow:
+        window = self._windows.get(endpoint)
+        if window is None:
+            with self._lock:
+                window = self._windows.setdefault(endpoint, LatencyWindow(self.window))
+        return window
+
+    def record(self, endpoint: str, seconds: float):
+        """
+        Длительность запроса; для таймаута передается сам таймаут, чтобы при
+        замедлении LDAP API окно "подтягивало" таймаут вверх
+        """
+        self._window(endpoint).add(seconds)
+
+    def record_connect(self, seconds: float):
+        """
+        Время установки нового соединения (TCP + TLS); для таймаута соединения
+        передается сам connect timeout (как в record)
+        """
+        self._connects.add(seconds)
+
+    def connect_timeout(self) -> float:
+        """Connect timeout для очередного запроса"""
+        if len(self._connects) < self.min_samples:
+            return self.connect
+        p99 = self._connects.percentile(99)
+        return min(self.connect, max(self.min_connect, p99 * self.multiplier))
+
+    def _percentile(self, endpoint: str, p: float) -> Optional[float]:
+        window = self._window(endpoint)
+        if len(window) < self.min_samples:
+            return None
+        return window.percentile(p)
+
+    def timeout(self, endpoint: str) -> Tuple[float, float]:
+        """(connect, read) для очередного запроса"""
+        connect = self.connect_timeout()
+        p99 = self._percentile(endpoint, 99)
+        if p99 is None:
+            return connect, self.max_read
+        read = min(self.max_read, max(self.min_read, p99 * self.multiplier))
+        return connect, read
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        """Через сколько секунд отправлять hedged запрос (None - данных мало)"""
+        return self._percentile(endpoint, 95)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for endpoint, window in list(self._windows.items()):
+            connect, read = self.timeout(endpoint)
+            result[endpoint] = {
+                'samples': window.count,
+                'p50': window.percentile(50),
+                'p95': window.percentile(95),
+                'p99': window.percentile(99),
+                'connect_timeout': connect,
+                'read_timeout': read,
+            }
+        return result
+
+
+upstream_timeouts = AdaptiveTimeouts(**getattr(settings, 'LDAP_ADAPTIVE_TIMEOUTS', {}))
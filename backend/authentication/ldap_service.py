@@ -1,9 +1,34 @@
 import requests
 import json
 import logging
+import math
+import os
+import threading
+import time
 from django.conf import settings
 from typing import Dict, Any, Optional, Tuple
 import urllib3
+import random
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import closing
+from .http_pool import build_session, pool_stats
+from .cache import (make_key, refresh_results, rejected_tokens, response_cache, search_cache,
+                    set_response_age, stale_store, token_hash, typeahead_cache)
+from .refresher import background_refresher
+from .singleflight import SingleFlight
+from .circuit_breaker import circuit_breakers
+from .student_directory import student_directory
+from .json_stream import iter_json_array
+from .multipart import MultipartStream
+from .payload import RawPayload, looks_like_json
+from .versions import versions
+from .summaries import summarize, summary_stats
+from .prefetch import active_tokens, prefetch_scheduler
+from .latency import upstream_timeouts
+from .retry_budget import retry_budget
+from .tracing import get_request_id, propagate, upstream_tracer
+from .bulkhead import AUTH, BulkheadFull, async_upstream_bulkhead, upstream_bulkhead, upstream_priority
 
 # Отключаем предупреждения о SSL сертификатах
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -33,80 +58,398 @@ class LDAPService:
             'search_students': '/mobile/students',  # Реальный LDAP endpoint для поиска студентов
         }
         
-        # Таймаут для запросов
+        # Таймаут для запросов без адаптивного таймаута (загрузка файлов, выгрузка справочника);
+        # для остальных - upstream_timeouts по перцентилям задержек endpoint'а
         self.timeout = 30
+        
+        # Повторы идемпотентных запросов (в пределах retry_budget) и hedged GET
+        self.idempotent_endpoints = {self.endpoints['profile'], self.endpoints['messages']}
+        self.max_retries = getattr(settings, 'LDAP_MAX_RETRIES', 1)
+        self.retry_backoff = getattr(settings, 'LDAP_RETRY_BACKOFF', 0.1)
+        self.hedge_requests = getattr(settings, 'LDAP_HEDGE_REQUESTS', False)
+        self.hedge_workers = getattr(settings, 'LDAP_HEDGE_WORKERS', 32)
+        self._hedge_executor = None
+        self.hedged = 0
+        self._stats_lock = threading.Lock()
+        
+        # Пул keep-alive соединений (одна сессия на процесс воркера)
+        self.pool_connections = getattr(settings, 'LDAP_POOL_CONNECTIONS', 4)
+        self.pool_maxsize = getattr(settings, 'LDAP_POOL_MAXSIZE', 20)
+        self.pool_block = getattr(settings, 'LDAP_POOL_BLOCK', False)
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+        
+        # Endpoints, ответ которых отдается клиенту как есть (байты без разбора JSON)
+        self.raw_endpoints = {'courses', 'grades', 'attendance', 'messages'}
+        
+        # TTL кэша ответов по endpoint'ам (0 - не кэшировать)
+        self.cache_ttl = getattr(settings, 'LDAP_CACHE_TTL', {})
+        
+        # Сколько хранить последний успешный ответ для stale-while-revalidate (0 - выключено)
+        self.stale_ttl = getattr(settings, 'LDAP_STALE_TTL', 0)
+        
+        # Endpoints без stale-while-revalidate: профиль - проверка действительности
+        # токена (resolve_identity, поиск), устаревший ответ пропустил бы отозванный токен
+        self.stale_exempt = {'profile'}
+        
+        # Прогрев кэша данными студента сразу после входа
+        self.login_warmup = getattr(settings, 'LDAP_LOGIN_WARMUP', False)
+        
+        # Объединение одинаковых одновременных запросов чтения
+        self._inflight = SingleFlight()
+        
+        # Сколько секунд отдавать результат обмена refresh token'а повторно (0 - не хранить)
+        self.refresh_grace = getattr(settings, 'LDAP_REFRESH_GRACE_SECONDS', 30)
+        
+        # Поиск студентов по локальной копии справочника (если она синхронизирована)
+        self.directory_mirror = getattr(settings, 'LDAP_DIRECTORY_MIRROR', True)
+        self.directory_page_size = getattr(settings, 'LDAP_DIRECTORY_PAGE_SIZE', 1000)
+        self.stream_chunk_size = getattr(settings, 'LDAP_STREAM_CHUNK_SIZE', 64 * 1024)
+        
+        # Максимальный размер загружаемого изображения
+        self.upload_max_size = getattr(settings, 'LDAP_UPLOAD_MAX_SIZE', 10 * 1024 * 1024)
+        
+        # Постраничный поиск студентов в LDAP API
+        self.search_page_size = getattr(settings, 'LDAP_SEARCH_PAGE_SIZE', 100)
+        self.search_max_limit = getattr(settings, 'LDAP_SEARCH_MAX_LIMIT', 500)
+        self.search_parallel_pages = getattr(settings, 'LDAP_SEARCH_PARALLEL_PAGES', 4)
+        self._search_executor = None
+        
+        # Кэш результатов поиска студентов (0 - не кэшировать)
+        self.search_cache_ttl = getattr(settings, 'LDAP_SEARCH_CACHE_TTL', 300)
+        
+        # Typeahead: сколько результатов запрашивать, чтобы получить полную выдачу,
+        # и с какой длины запроса выдачу можно уточнять локально
+        self.typeahead_limit = getattr(settings, 'LDAP_SEARCH_TYPEAHEAD_LIMIT', 200)
+        self.typeahead_min_chars = getattr(settings, 'LDAP_SEARCH_TYPEAHEAD_MIN_CHARS', 2)
 
-    def _make_request(self, endpoint: str, method: str = 'GET', data: Dict = None, 
-                     headers: Dict = None, params: Dict = None) -> Tuple[bool, Dict]:
+    @property
+    def session(self) -> requests.Session:
         """
-        Выполняет запрос к LDAP API
-        
-        Returns:
-            Tuple[bool, Dict]: (success, response_data)
+        Сессия с пулом соединений текущего процесса
+        После fork воркер создает свою сессию, чтобы не делить сокеты с мастером
         """
-        url = f"{self.base_url}{endpoint}"
-        
-        # Базовые заголовки
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._session_lock:
+                if self._session is None or self._session_pid != pid:
+                    if self._session_pid is not None and self._session_pid != pid:
+                        pool_stats.reset()
+                    self._session = build_session(
+                        self.pool_connections, self.pool_maxsize, self.pool_block
+                    )
+                    self._session_pid = pid
+        return self._session
+
+    def warm_up(self, connections: int = 1):
+        """
+        Заранее открывает TCP/TLS соединения к LDAP API,
+        чтобы первые запросы воркера не платили за handshake
+        """
+        def _open():
+            try:
+                self.session.head(self.base_url, timeout=self.timeout).close()
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"LDAP pool warm-up failed: {e}")
+
+        # Параллельные запросы - чтобы в пуле осталось несколько соединений
+        threads = [threading.Thread(target=_open, daemon=True) for _ in range(max(1, connections))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def warm_up_async(self):
+        """Запускает warm_up в фоне, не задерживая старт воркера"""
+        connections = getattr(settings, 'LDAP_POOL_WARMUP_CONNECTIONS', 2)
+        threading.Thread(
+            target=self.warm_up, args=(connections,), name='ldap-pool-warmup', daemon=True
+        ).start()
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Счетчики кэша ответов и объединения запросов текущего процесса"""
+        stats = response_cache.stats()
+        stats['ttl'] = dict(self.cache_ttl)
+        stats['coalesced'] = self._inflight.stats()
+        stats['stale'] = stale_store.stats()
+        stats['refresh'] = refresh_results.stats()
+        stats['search'] = search_cache.stats()
+        stats['typeahead'] = typeahead_cache.stats()
+        stats['versions'] = versions.stats()
+        stats['summaries'] = summary_stats.snapshot()
+        stats['background_refresh'] = background_refresher.stats()
+        stats['prefetch'] = prefetch_scheduler.stats()
+        return stats
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Счетчики пула соединений текущего процесса"""
+        return {
+            'pid': os.getpid(),
+            'pool_maxsize': self.pool_maxsize,
+            'pool_block': self.pool_block,
+            'hosts': pool_stats.snapshot(),
+            'bulkhead': upstream_bulkhead.stats(),
+            'async_bulkhead': async_upstream_bulkhead.stats(),
+        }
+
+    def get_latency_stats(self) -> Dict[str, Any]:
+        """Перцентили задержек, адаптивные таймауты и бюджет повторов"""
+        return {
+            'endpoints': upstream_timeouts.snapshot(),
+            'retry_budget': retry_budget.stats(),
+            'hedged': self.hedged,
+        }
+
+    def _build_headers(self, headers: Dict = None) -> Dict:
+        """Базовые заголовки запроса к LDAP API"""
         default_headers = {
             'Content-Type': 'application/json',
             'User-Agent': 'TIUE-Mobile-Backend/1.0',
         }
         
+        # Сквозной ID входящего запроса - для сопоставления с логами LDAP API
+        request_id = get_request_id()
+        if request_id:
+            default_headers['X-Request-ID'] = request_id
+        
         if headers:
             default_headers.update(headers)
         
-        try:
-            # Логирование только в режиме отладки
-            if logger.isEnabledFor(logging.DEBUG):
-                logger.debug(f"LDAP API Request: {method} {url}")
-            
-            if method.upper() == 'GET':
-                response = requests.get(
-                    url, 
-                    headers=default_headers, 
-                    params=params, 
-                    timeout=self.timeout,
-                    verify=False  # Отключаем проверку SSL сертификата
-                )
-            elif method.upper() == 'POST':
-                response = requests.post(
-                    url, 
-                    headers=default_headers, 
-                    json=data, 
-                    params=params, 
-                    timeout=self.timeout,
-                    verify=False  # Отключаем проверку SSL сертификата
-                )
-            else:
-                logger.error(f"Unsupported HTTP method: {method}")
-                return False, {'error': 'Unsupported HTTP method'}
-            
-            # Проверяем статус ответа
-            if response.status_code == 200:
-                try:
-                    response_data = response.json()
-                    return True, response_data
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to decode JSON response: {e}")
-                    return False, {'error': 'Invalid JSON response from LDAP server'}
-            else:
-                try:
-                    error_data = response.json()
-                    logger.warning(f"LDAP API Error {response.status_code}: {error_data}")
-                    return False, error_data
-                except json.JSONDecodeError:
-                    logger.error(f"LDAP API Error {response.status_code}: {response.text}")
-                    return False, {'error': f'HTTP {response.status_code}', 'details': response.text}
-                    
-        except requests.exceptions.Timeout:
+        return default_headers
+
+    def _handle_response(self, response, raw: bool = False) -> Tuple[bool, Dict]:
+        """
+        Разбирает ответ LDAP API (requests.Response или httpx.Response)
+        
+        Args:
+            raw: успешный ответ вернуть как RawPayload - без разбора JSON
+        
+        Returns:
+            Tuple[bool, Dict]: (success, response_data)
+        """
+        # Проверка границ без разбора; обрезанное или не-JSON тело разбирается
+        # ниже и возвращается как ошибка, не попадая в кэш
+        if raw and response.status_code == 200 and looks_like_json(response.content):
+            return True, RawPayload(response.content)
+        
+        # Проверяем статус ответа
+        if response.status_code == 200:
+            try:
+                response_data = response.json()
+                return True, response_data
+            except json.JSONDecodeError as e:
+                logger.error(f"Failed to decode JSON response: {e}")
+                return False, {'error': 'Invalid JSON response from LDAP server'}
+        else:
+            try:
+                error_data = response.json()
+                logger.warning(f"LDAP API Error {response.status_code}: {error_data}")
+                if isinstance(error_data, dict):
+                    error_data.setdefault('status_code', response.status_code)
+                return False, error_data
+            except json.JSONDecodeError:
+                logger.error(f"LDAP API Error {response.status_code}: {response.text}")
+                return False, {
+                    'error': f'HTTP {response.status_code}',
+                    'details': response.text,
+                    'status_code': response.status_code,
+                }
+
+    def _unavailable_error(self, endpoint: str, breaker) -> Dict:
+        """Ответ без обращения к LDAP API, пока circuit breaker endpoint'а открыт"""
+        logger.warning(f"LDAP API circuit open, request rejected: {endpoint}")
+        return {
+            'error': 'LDAP service temporarily unavailable',
+            'retry_after': max(1, math.ceil(breaker.retry_after())),
+        }
+
+    def _busy_error(self, endpoint: str, breaker, error: BulkheadFull) -> Dict:
+        """Ответ без обращения к LDAP API: занят весь bulkhead воркера"""
+        breaker.cancel()
+        logger.warning(f"LDAP API bulkhead full, request rejected: {endpoint}")
+        return {
+            'error': 'LDAP service busy',
+            'retry_after': error.retry_after,
+        }
+
+    def _is_idempotent(self, endpoint: str, method: str) -> bool:
+        """Запрос можно безопасно повторить (GET или POST-чтение)"""
+        return method.upper() == 'GET' or endpoint in self.idempotent_endpoints
+
+    def _retry_delay(self, attempt: int) -> float:
+        """Пауза перед повтором: экспонента с jitter"""
+        return random.uniform(0.5, 1.0) * self.retry_backoff * (2 ** (attempt - 1))
+
+    def _request_error(self, error: Exception) -> Dict:
+        """Ответ сервиса на исключение requests"""
+        if isinstance(error, requests.exceptions.Timeout):
             logger.error("LDAP API request timeout")
-            return False, {'error': 'Request timeout'}
-        except requests.exceptions.ConnectionError:
+            return {'error': 'Request timeout'}
+        if isinstance(error, requests.exceptions.ConnectionError):
             logger.error("LDAP API connection error")
-            return False, {'error': 'Connection error'}
-        except requests.exceptions.RequestException as e:
-            logger.error(f"LDAP API request error: {e}")
-            return False, {'error': 'Request failed'}
+            return {'error': 'Connection error'}
+        logger.error(f"LDAP API request error: {error}")
+        return {'error': 'Request failed'}
+
+    def _send(self, endpoint: str, method: str, url: str, headers: Dict,
+              data: Dict = None, params: Dict = None) -> requests.Response:
+        """
+        Одна попытка запроса с адаптивным таймаутом
+        (длительность учитывается в upstream_timeouts, попытка - в upstream_tracer)
+        
+        Raises:
+            BulkheadFull: в процессе уже выполняется максимум запросов к LDAP API
+        """
+        with upstream_bulkhead.slot():
+            return self._send_traced(endpoint, method, url, headers, data, params)
+
+    def _send_traced(self, endpoint: str, method: str, url: str, headers: Dict,
+                     data: Dict = None, params: Dict = None) -> requests.Response:
+        timeout = upstream_timeouts.timeout(endpoint)
+        started = time.monotonic()
+        with upstream_tracer.trace(endpoint, method) as trace:
+            try:
+                if method == 'GET':
+                    response = self.session.get(
+                        url, 
+                        headers=headers, 
+                        params=params, 
+                        timeout=timeout,
+                        verify=False  # Отключаем проверку SSL сертификата
+                    )
+                else:
+                    response = self.session.post(
+                        url, 
+                        headers=headers, 
+                        json=data, 
+                        params=params, 
+                        timeout=timeout,
+                        verify=False  # Отключаем проверку SSL сертификата
+                    )
+            except requests.exceptions.ConnectTimeout:
+                upstream_timeouts.record_connect(timeout[0])
+                raise
+            except requests.exceptions.ReadTimeout:
+                upstream_timeouts.record(endpoint, timeout[1])
+                raise
+            trace.set_response(response.status_code, len(response.content))
+        if trace.connect:
+            upstream_timeouts.record_connect(trace.connect + trace.tls)
+        if response.status_code < 500:
+            upstream_timeouts.record(endpoint, time.monotonic() - started)
+        return response
+
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        if self._hedge_executor is None:
+            with self._session_lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(
+                        max_workers=self.hedge_workers, thread_name_prefix='ldap-hedge'
+                    )
+        return self._hedge_executor
+
+    def _send_hedged(self, endpoint: str, send) -> requests.Response:
+        """
+        Hedged GET: если ответа нет дольше p95 endpoint'а, отправляется второй
+        такой же запрос; возвращается первый удачный ответ
+        """
+        delay = upstream_timeouts.hedge_delay(endpoint)
+        if delay is None:
+            return send()
+        
+        executor = self._get_hedge_executor()
+        # propagate: request ID попадает и в запросы из потоков executor'а
+        primary = executor.submit(propagate(send))
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        
+        # Hedged запрос тратит тот же бюджет, что и retry
+        if not retry_budget.try_retry():
+            return primary.result()
+        # Счетчик обновляют потоки воркера
+        with self._stats_lock:
+            self.hedged += 1
+        
+        pending = {primary, executor.submit(propagate(send))}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result().status_code < 500:
+                    # Проигравший запрос завершится в фоне, соединение вернется в пул
+                    return future.result()
+            if not pending:
+                return future.result()
+
+    def _make_request(self, endpoint: str, method: str = 'GET', data: Dict = None, 
+                     headers: Dict = None, params: Dict = None,
+                     raw: bool = False) -> Tuple[bool, Dict]:
+        """
+        Выполняет запрос к LDAP API
+        
+        Идемпотентные запросы повторяются при сетевых ошибках и 5xx
+        (в пределах общего retry_budget), GET запросы могут быть hedged.
+        raw=True - успешный ответ возвращается как RawPayload (см. payload.py)
+        
+        Returns:
+            Tuple[bool, Dict]: (success, response_data)
+        """
+        url = f"{self.base_url}{endpoint}"
+        default_headers = self._build_headers(headers)
+        method = method.upper()
+        
+        if method not in ('GET', 'POST'):
+            logger.error(f"Unsupported HTTP method: {method}")
+            return False, {'error': 'Unsupported HTTP method'}
+        
+        # Пока LDAP API не отвечает, не ждем таймаут, а сразу отклоняем запрос
+        breaker = circuit_breakers.get(endpoint)
+        if not breaker.allow():
+            return False, self._unavailable_error(endpoint, breaker)
+        
+        # Логирование только в режиме отладки
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"LDAP API Request: {method} {url}")
+        
+        def send():
+            return self._send(endpoint, method, url, default_headers, data, params)
+        
+        idempotent = self._is_idempotent(endpoint, method)
+        retry_budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                if method == 'GET' and self.hedge_requests:
+                    response = self._send_hedged(endpoint, send)
+                else:
+                    response = send()
+            except BulkheadFull as e:
+                return False, self._busy_error(endpoint, breaker, e)
+            except requests.exceptions.RequestException as e:
+                # Неидемпотентный запрос повторяем, только если он точно не дошел
+                retryable = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+                if retryable and attempt < self.max_retries and retry_budget.try_retry():
+                    attempt += 1
+                    time.sleep(self._retry_delay(attempt))
+                    continue
+                breaker.record(False)
+                return False, self._request_error(e)
+            except Exception:
+                breaker.record(False)
+                raise
+            
+            if (response.status_code >= 500 and idempotent and attempt < self.max_retries
+                    and retry_budget.try_retry()):
+                attempt += 1
+                time.sleep(self._retry_delay(attempt))
+                continue
+            break
+        
+        # 4xx (неверный токен/пароль) - ответ сервиса, а не его отказ
+        breaker.record(response.status_code < 500)
+        return self._handle_response(response, raw)
 
     def login(self, username: str, password: str) -> Tuple[bool, Dict]:
         """
@@ -124,11 +467,13 @@ class LDAPService:
             'password': password
         }
         
-        success, response = self._make_request(
-            self.endpoints['login'], 
-            method='POST', 
-            data=data
-        )
+        # Вход - высший приоритет в bulkhead
+        with upstream_priority(AUTH):
+            success, response = self._make_request(
+                self.endpoints['login'], 
+                method='POST', 
+                data=data
+            )
         
         if success:
             logger.info(f"LDAP login successful for user: {username}")
@@ -137,191 +482,369 @@ class LDAPService:
             
         return success, response
 
+    def _refresh_key(self, refresh_token: str) -> tuple:
+        return ('refresh', token_hash(refresh_token))
+
+    def _refresh_store(self, key: tuple, success: bool, response: Dict):
+        # Кэшируется только новая пара токенов; отказ следующий запрос повторит
+        if success and self.refresh_grace > 0:
+            refresh_results.set(key, response, self.refresh_grace)
+
     def refresh_token(self, refresh_token: str) -> Tuple[bool, Dict]:
         """
         Обновление access токена
         
+        Одновременные обновления одного refresh token'а (несколько экранов
+        приложения сразу) выполняют один запрос к LDAP API; результат еще
+        refresh_grace секунд возвращается запросам со старым токеном - после
+        ротации LDAP API их бы уже отклонил
+        
         Args:
             refresh_token: Refresh token
             
         Returns:
             Tuple[bool, Dict]: (success, response_data)
         """
-        data = {
-            'refresh_token': refresh_token
-        }
+        key = self._refresh_key(refresh_token)
+        cached = refresh_results.get(key)
+        if cached is not None:
+            logger.info("LDAP token refresh reused")
+            return True, dict(cached)
         
-        success, response = self._make_request(
-            self.endpoints['refresh'], 
-            method='POST', 
-            data=data
-        )
+        def exchange():
+            data = {
+                'refresh_token': refresh_token
+            }
+            
+            with upstream_priority(AUTH):
+                success, response = self._make_request(
+                    self.endpoints['refresh'], 
+                    method='POST', 
+                    data=data
+                )
+            self._refresh_store(key, success, response)
+            return success, response
+        
+        success, response = self._inflight.do(key, exchange)
         
         if success:
             logger.info("LDAP token refresh successful")
         else:
             logger.warning("LDAP token refresh failed")
             
-        return success, response
+        return success, dict(response)
 
-    def get_user_profile(self, access_token: str) -> Tuple[bool, Dict]:
+    def _cache_lookup(self, name: str, access_token: str, params: Dict = None,
+                      refresh: bool = False) -> Tuple[tuple, Optional[Dict]]:
         """
-        Получение профиля пользователя
+        Ищет ответ endpoint'а в кэше
         
-        Args:
-            access_token: Access token
-            
         Returns:
-            Tuple[bool, Dict]: (success, response_data)
+            Tuple: (ключ запроса, закэшированный ответ или None)
+        """
+        set_response_age(None)
+        key = make_key(name, access_token, params)
+        if refresh or not self.cache_ttl.get(name):
+            return key, None
+        return key, response_cache.get(key)
+
+    def _stale_lookup(self, name: str, key: tuple) -> Optional[Tuple[Dict, int]]:
+        """
+        Последний успешный ответ с истекшим TTL (stale-while-revalidate)
+        
+        Returns:
+            Tuple: (ответ, возраст в секундах) или None
+        """
+        if not self.stale_ttl or not self.cache_ttl.get(name) or name in self.stale_exempt:
+            return None
+        if rejected_tokens.get(key[1]):
+            return None
+        item = stale_store.get(key)
+        if item is None:
+            return None
+        stored_at, response = item
+        return response, int(time.time() - stored_at)
+
+    def _cache_store(self, name: str, key: tuple, success: bool, response: Dict):
+        """
+        Кэширует только успешные ответы
+        Если LDAP API отклонил токен (401/403), закэшированные и устаревшие
+        ответы под этим ключом удаляются, а токен помечается отклоненным:
+        устаревшие ответы других endpoint'ов под ним тоже больше не отдаются
+        """
+        ttl = self.cache_ttl.get(name)
+        if ttl and success:
+            response_cache.set(key, response, ttl)
+            if self.stale_ttl and name not in self.stale_exempt:
+                stale_store.set(key, (time.time(), response), self.stale_ttl)
+        elif not success and isinstance(response, dict) and response.get('status_code') in (401, 403):
+            response_cache.delete(key)
+            stale_store.delete(key)
+            if self.stale_ttl:
+                rejected_tokens.set(key[1], True, self.stale_ttl)
+
+    def _serve_stale(self, name: str, key: tuple, access_token: str, method: str,
+                     params: Dict = None) -> Optional[Dict]:
+        """
+        Отдает последний успешный ответ и ставит обновление в фон
+        
+        Returns:
+            Устаревший ответ или None, если его нет
+        """
+        stale = self._stale_lookup(name, key)
+        if stale is None:
+            return None
+        
+        response, age = stale
+        background_refresher.submit(
+            key, lambda: self._read_request(name, access_token, method, params, refresh=True)
+        )
+        set_response_age(age)
+        return response
+
+    def _read_request(self, name: str, access_token: str, method: str = 'GET',
+                      params: Dict = None, refresh: bool = False) -> Tuple[bool, Dict]:
+        """
+        Запрос к endpoint'у чтения: кэш по токену и параметрам +
+        одинаковые одновременные запросы разделяют один поход в LDAP API.
+        Если TTL истек, но есть последний успешный ответ - он отдается сразу,
+        а обновление выполняется в фоне (возраст ответа - cache.response_age())
+        
+        Args:
+            name: ключ endpoint'а в self.endpoints
+            refresh: не брать ответ из кэша (pull-to-refresh), но обновить кэш
         """
+        active_tokens.touch(access_token)
+        key, cached = self._cache_lookup(name, access_token, params, refresh)
+        if cached is not None:
+            return True, cached
+        
+        if not refresh:
+            stale = self._serve_stale(name, key, access_token, method, params)
+            if stale is not None:
+                return True, stale
+        
         headers = {
             'Authorization': f'Bearer {access_token}'
         }
         
-        success, response = self._make_request(
-            self.endpoints['profile'], 
-            method='POST',  # Согласно документации это POST
-            headers=headers
-        )
+        success, response = self._inflight.do(key, lambda: self._make_request(
+            self.endpoints[name],
+            method=method,
+            headers=headers,
+            params=params,
+            raw=name in self.raw_endpoints
+        ))
         
+        self._cache_store(name, key, success, response)
         return success, response
 
-    def get_active_courses(self, access_token: str, lang: str = 'en', 
-                          page: int = 1, page_size: int = 100) -> Tuple[bool, Dict]:
+    def get_user_profile(self, access_token: str, refresh: bool = False) -> Tuple[bool, Dict]:
         """
-        Получение активных курсов
+        Получение профиля пользователя
         
         Args:
             access_token: Access token
-            lang: Язык (en/ru)
-            page: Номер страницы
-            page_size: Размер страницы (увеличено до 100 для получения всех курсов)
+            refresh: Не использовать кэш
             
         Returns:
             Tuple[bool, Dict]: (success, response_data)
         """
-        headers = {
-            'Authorization': f'Bearer {access_token}'
-        }
-        
-        params = {
+        return self._read_request(
+            'profile',
+            access_token,
+            method='POST',  # Согласно документации это POST
+            refresh=refresh
+        )
+
+    def _courses_params(self, lang: str, page: int, page_size: int) -> Dict:
+        """Параметры пагинации списка курсов"""
+        return {
             'lang': lang,
             'page': page,
             'pageSize': page_size,
             'skip': (page - 1) * page_size,
             'take': page_size,
         }
+
+    def get_active_courses(self, access_token: str, lang: str = 'en', 
+                          page: int = 1, page_size: int = 100,
+                          refresh: bool = False) -> Tuple[bool, Dict]:
+        """
+        Получение активных курсов
         
-        success, response = self._make_request(
-            self.endpoints['courses'], 
+        Args:
+            access_token: Access token
+            lang: Язык (en/ru)
+            page: Номер страницы
+            page_size: Размер страницы (увеличено до 100 для получения всех курсов)
+            refresh: Не использовать кэш
+            
+        Returns:
+            Tuple[bool, Dict]: (success, response_data)
+        """
+        return self._read_request(
+            'courses',
+            access_token,
             method='GET',
-            headers=headers,
-            params=params
+            params=self._courses_params(lang, page, page_size),
+            refresh=refresh
         )
-        
-        return success, response
 
-    def get_course_grades(self, access_token: str) -> Tuple[bool, Dict]:
+    def get_course_grades(self, access_token: str, refresh: bool = False) -> Tuple[bool, Dict]:
         """
         Получение оценок по курсам
         
         Args:
             access_token: Access token
+            refresh: Не использовать кэш
             
         Returns:
             Tuple[bool, Dict]: (success, response_data)
         """
-        headers = {
-            'Authorization': f'Bearer {access_token}'
-        }
-        
-        success, response = self._make_request(
-            self.endpoints['grades'], 
-            method='GET',
-            headers=headers
-        )
-        
-        return success, response
+        return self._read_request('grades', access_token, method='GET', refresh=refresh)
 
-    def get_course_attendance(self, access_token: str) -> Tuple[bool, Dict]:
+    def get_course_attendance(self, access_token: str, refresh: bool = False) -> Tuple[bool, Dict]:
         """
         Получение данных о посещаемости
         
         Args:
             access_token: Access token
+            refresh: Не использовать кэш
             
         Returns:
             Tuple[bool, Dict]: (success, response_data)
         """
-        headers = {
-            'Authorization': f'Bearer {access_token}'
-        }
-        
-        success, response = self._make_request(
-            self.endpoints['attendance'], 
-            method='GET',
-            headers=headers
-        )
+        return self._read_request('attendance', access_token, method='GET', refresh=refresh)
+
+    def get_summary(self, name: str, access_token: str, refresh: bool = False) -> Tuple[bool, Dict]:
+        """
+        Сводка оценок или посещаемости (см. summaries.py)
         
-        return success, response
+        Args:
+            name: 'grades' | 'attendance'
+            access_token: Access token
+            refresh: Не использовать кэш
+            
+        Returns:
+            Tuple[bool, Dict]: (success, сводка | ошибка)
+        """
+        method = self.get_course_grades if name == 'grades' else self.get_course_attendance
+        success, response = method(access_token, refresh=refresh)
+        if not success:
+            return success, response
+        return True, summarize(name, response)
 
-    def get_messages(self, access_token: str) -> Tuple[bool, Dict]:
+    def get_messages(self, access_token: str, refresh: bool = False) -> Tuple[bool, Dict]:
         """
         Получение сообщений
         
         Args:
             access_token: Access token
+            refresh: Не использовать кэш
             
         Returns:
             Tuple[bool, Dict]: (success, response_data)
         """
-        headers = {
-            'Authorization': f'Bearer {access_token}'
-        }
-        
         logger.info("LDAP get messages")
-        success, response = self._make_request(
-            self.endpoints['messages'], 
+        return self._read_request(
+            'messages',
+            access_token,
             method='POST',  # Согласно документации это POST
-            headers=headers
+            refresh=refresh
         )
+
+    def warm_up_user(self, access_token: str):
+        """
+        Фоновая загрузка основных данных студента сразу после входа:
+        курсы, оценки, посещаемость и сообщения кэшируются под новым токеном,
+        и первый экран приложения отдается из кэша.
+        Запросы выполняются параллельно в пуле фонового обновления.
+        """
+        jobs = {
+            'courses': lambda: self.get_active_courses(access_token),
+            'grades': lambda: self.get_course_grades(access_token),
+            'attendance': lambda: self.get_course_attendance(access_token),
+            'messages': lambda: self.get_messages(access_token),
+        }
         
-        return success, response
+        for name, fetch in jobs.items():
+            if self.cache_ttl.get(name):
+                background_refresher.submit(make_key(f'warmup:{name}', access_token), fetch)
+
+    def _upload_stream(self, image_data) -> Tuple[Optional[MultipartStream], Optional[Dict]]:
+        """Потоковое тело загрузки или ошибка, если файл больше лимита"""
+        stream = MultipartStream(image_data, chunk_size=self.stream_chunk_size)
+        if stream.size > self.upload_max_size:
+            logger.warning(f"LDAP image upload rejected: {stream.size} bytes")
+            return None, {'error': 'File too large', 'max_size': self.upload_max_size}
+        return stream, None
+
+    def _upload_result(self, success: bool, response_data, stream: MultipartStream) -> Tuple[bool, Dict]:
+        if success and isinstance(response_data, dict):
+            response_data['upload_sha256'] = stream.digests
+        logger.info(f"LDAP upload image sha256: {stream.digests}")
+        return success, response_data
 
     def upload_image(self, access_token: str, image_data) -> Tuple[bool, Dict]:
         """
         Загрузка изображения
         
+        Файл отправляется потоково (см. MultipartStream): тело multipart
+        не собирается в памяти воркера
+        
         Args:
             access_token: Access token
-            image_data: Данные изображения
+            image_data: {имя поля: файл} (UploadedFile)
             
         Returns:
             Tuple[bool, Dict]: (success, response_data)
         """
-        headers = {
-            'Authorization': f'Bearer {access_token}'
-            # Content-Type будет установлен автоматически для multipart
-        }
+        stream, error = self._upload_stream(image_data)
+        if error:
+            return False, error
+        
+        headers = self._build_headers({
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': stream.content_type
+        })
         
         logger.info("LDAP upload image")
         
         # Для загрузки файлов используем отдельный метод
         url = f"{self.base_url}{self.endpoints['image']}"
         
+        breaker = circuit_breakers.get(self.endpoints['image'])
+        if not breaker.allow():
+            return False, self._unavailable_error(self.endpoints['image'], breaker)
+        
         try:
-            response = requests.post(
-                url,
-                headers=headers,
-                files=image_data,  # Для multipart/form-data
-                timeout=self.timeout,
-                verify=False  # Отключаем проверку SSL сертификата
-            )
+            try:
+                with upstream_bulkhead.slot(), upstream_tracer.trace(self.endpoints['image'], 'POST') as trace:
+                    response = self.session.post(
+                        url,
+                        headers=headers,
+                        data=stream,  # Итерируемое тело с __len__ - отправляется чанками
+                        timeout=self.timeout,
+                        verify=False  # Отключаем проверку SSL сертификата
+                    )
+                    trace.set_response(response.status_code, len(response.content))
+            except BulkheadFull as e:
+                return False, self._busy_error(self.endpoints['image'], breaker, e)
+            except ValueError as e:
+                # Файл изменился во время чтения - LDAP API тут ни при чем
+                breaker.record(True)
+                logger.error(f"LDAP image upload error: {e}")
+                return False, {'error': 'Upload failed'}
+            except Exception:
+                breaker.record(False)
+                raise
+            breaker.record(response.status_code < 500)
             
             if response.status_code == 200:
                 try:
                     response_data = response.json()
-                    return True, response_data
+                    return self._upload_result(True, response_data, stream)
                 except json.JSONDecodeError:
                     return False, {'error': 'Invalid JSON response'}
             else:
@@ -335,107 +858,479 @@ class LDAPService:
             logger.error(f"LDAP image upload error: {e}")
             return False, {'error': 'Upload failed'}
 
-    def search_students(self, access_token: str, query: Optional[str] = None, 
-                       group: Optional[str] = None, limit: int = 50) -> Tuple[bool, Dict]:
+    def _search_params(self, query: Optional[str] = None, group: Optional[str] = None,
+                       skip: int = 0, take: int = 100) -> Dict:
         """
-        Поиск студентов через LDAP API
+        Параметры запроса поиска студентов (Kendo-style filter)
         
-        Args:
-            access_token: Access token для авторизации
-            query: поисковый запрос (имя, фамилия, username)
-            group: группа/department (например, BM_01 EN Year1)
-            limit: максимальное количество результатов
-            
-        Returns:
-            Tuple[bool, Dict]: (success, response_data)
+        LDAP API может читать как page/pageSize, так и skip/take - skip должен
+        быть кратен take (см. _search_chunks), чтобы они указывали на одни записи
         """
-        headers = {
-            'Authorization': f'Bearer {access_token}'
-        }
-        
         params = {
-            'page': 1,
-            'pageSize': 100, 
-            'skip': 0,
-            'take': 100
+            'page': skip // take + 1,
+            'pageSize': take, 
+            'skip': skip,
+            'take': take
         }
         
+        filters = []
         if query:
-            filters = [
+            filters.append({"logic": "or", "filters": [
                 {"field": "display_name", "operator": "contains", "value": query}, 
                 {"field": "uid", "operator": "contains", "value": query},
                 {"field": "mail", "operator": "contains", "value": query}
-            ]
-            params['filter'] = json.dumps({"logic": "or", "filters": filters})
+            ]})
+        if group:
+            # Фильтр по группе выполняет сервер - иначе теряются студенты за первой страницей
+            filters.append({"field": "department", "operator": "eq", "value": group})
+        
+        if len(filters) == 1 and query:
+            params['filter'] = json.dumps(filters[0])
+        elif filters:
+            params['filter'] = json.dumps({"logic": "and", "filters": filters})
+        
+        return params
+
+    def _search_chunks(self, offset: int, limit: int) -> list:
+        """
+        Страницы запроса (skip, take), покрывающие [offset, offset + limit)
+        
+        Страницы выровнены: skip кратен take, поэтому page = skip // take + 1
+        точно соответствует skip. Если offset не кратен take, лишние записи
+        первой и последней страниц отбрасывает _search_result.
+        """
+        take = min(self.search_page_size, limit)
+        return [(skip, take) for skip in range(offset - offset % take, offset + limit, take)]
+
+    def _search_error(self, response: Dict) -> Tuple[bool, Dict]:
+        error = {'error': 'Failed to search students', 'students': []}
+        if 'retry_after' in response:
+            error['retry_after'] = response['retry_after']
+        return False, error
+
+    def _remaining_chunks(self, chunks: list, first_response) -> list:
+        """Остальные страницы нужны, только если первая заполнена и данные не кончились"""
+        skip, take = chunks[0]
+        if len(self._students_data(first_response)) < take:
+            return []
+        total = first_response.get('count') if isinstance(first_response, dict) else None
+        if isinstance(total, int):
+            return [chunk for chunk in chunks[1:] if chunk[0] < total]
+        return chunks[1:]
+
+    def _search_result(self, chunks: list, pages: list, offset: int, limit: int,
+                       total: Optional[int]) -> Tuple[bool, Dict]:
+        """
+        Склеивает страницы поиска (в порядке chunks) в выдачу [offset, offset + limit)
+        
+        Неудачная или неполная страница завершает выдачу; next_cursor указывает,
+        откуда продолжить (None - результатов больше нет)
+        """
+        end = offset + limit
+        students = []
+        next_cursor = None
+        for (skip, take), (success, response) in zip(chunks, pages):
+            if not success:
+                if not students:
+                    return self._search_error(response)
+                next_cursor = max(skip, offset)
+                break
+            
+            records = self._students_data(response)
+            students.extend(self._format_students(records[max(offset - skip, 0):end - skip]))
+            if len(records) < take:
+                # Неполная страница - последняя; за end могли остаться ее записи
+                next_cursor = end if skip + len(records) > end else None
+                break
+            next_cursor = min(skip + take, end)
+        
+        if next_cursor is not None and isinstance(total, int) and next_cursor >= total:
+            next_cursor = None
+        
+        return True, {'students': students, 'next_cursor': next_cursor, 'total': total}
+
+    def _format_student(self, student: Dict) -> Dict:
+        """Преобразует запись студента из LDAP в формат фронтенда"""
+        department = student.get('department', 'no info')
+        
+        # Обрабатываем имя
+        display_name = student.get('display_name', '')
+        name_parts = [p for p in display_name.strip().split() if p]
+        
+        # В LDAP формат: "ИМЯ ФАМИЛИЯ" (например, "SABINA SULAYMONOVA")
+        if len(name_parts) >= 2:
+            first_name = name_parts[0].title()
+            last_name = ' '.join(name_parts[1:]).title()
+        elif len(name_parts) == 1:
+            first_name = name_parts[0].title()
+            last_name = ''
+        else:
+            first_name = ''
+            last_name = ''
+        
+        return {
+            'id': student.get('uid', ''),
+            'username': student.get('uid', ''),
+            'email': student.get('mail', ''),
+            'first_name': first_name,
+            'last_name': last_name,
+            'full_name': display_name,
+            'student': {
+                'group': {
+                    'name': department
+                },
+                'department': department,
+                'status': student.get('status', 'Students'),
+                'student_id': student.get('student_id', 0)
+            }
+        }
+
+    def _students_data(self, response) -> list:
+        """Записи студентов из ответа /mobile/students"""
+        if isinstance(response, list):
+            return response
+        if isinstance(response, dict):
+            return response.get('data', [])
+        return []
+
+    def _format_students(self, response) -> list:
+        """
+        Форматирует ответ /mobile/students
+        
+        Группу фильтрует LDAP API (см. _search_params): повторный фильтр здесь
+        сократил бы страницу, и next_cursor разошелся бы с выдачей
+        """
+        return [self._format_student(student) for student in self._students_data(response)]
 
+    def _stream_records(self, access_token: str, params: Dict, meta: Dict = None):
+        """
+        Потоково читает массив записей /mobile/students, не загружая ответ целиком
+        
+        Yields:
+            dict: запись студента в формате LDAP
+            
+        Raises:
+            RuntimeError: ошибка запроса или некорректный ответ LDAP API
+        """
+        endpoint = self.endpoints['search_students']
+        breaker = circuit_breakers.get(endpoint)
+        if not breaker.allow():
+            raise RuntimeError(self._unavailable_error(endpoint, breaker)['error'])
+        
+        try:
+            upstream_bulkhead.acquire()
+        except BulkheadFull as e:
+            raise RuntimeError(self._busy_error(endpoint, breaker, e)['error']) from e
+        
+        # Трасса и место в bulkhead освобождаются после чтения всего ответа, а не между yield
+        trace = upstream_tracer.start(endpoint, 'GET')
+        try:
+            with trace.active():
+                response = self.session.get(
+                    f"{self.base_url}{endpoint}",
+                    headers=self._build_headers({'Authorization': f'Bearer {access_token}'}),
+                    params=params,
+                    timeout=self.timeout,
+                    verify=False,
+                    stream=True
+                )
+        except requests.exceptions.RequestException as e:
+            breaker.record(False)
+            trace.fail(e)
+            upstream_tracer.record(trace)
+            upstream_bulkhead.release()
+            logger.error(f"LDAP API stream request error: {e}")
+            raise RuntimeError('Request failed') from e
+        
+        trace.set_response(response.status_code)
+        
+        def chunks():
+            for chunk in response.iter_content(chunk_size=self.stream_chunk_size):
+                trace.bytes += len(chunk)
+                yield chunk
+        
+        healthy = True
         try:
+            if response.status_code != 200:
+                healthy = response.status_code < 500
+                logger.warning(f"LDAP API Error {response.status_code} on {endpoint}")
+                raise RuntimeError(f'HTTP {response.status_code}')
             
-            success, response = self._make_request(
-                self.endpoints['search_students'],
-                method='GET',
-                headers=headers,
-                params=params
-            )
+            yield from iter_json_array(chunks(), meta=meta)
+        except requests.exceptions.RequestException as e:
+            healthy = False
+            trace.fail(e)
+            logger.error(f"LDAP API stream read error: {e}")
+            raise RuntimeError('Request failed') from e
+        except ValueError as e:
+            logger.error(f"Failed to decode JSON stream: {e}")
+            raise RuntimeError('Invalid JSON response from LDAP server') from e
+        finally:
+            breaker.record(healthy)
+            response.close()
+            upstream_tracer.record(trace)
+            upstream_bulkhead.release()
+
+    def iter_student_records(self, access_token: str, query: Optional[str] = None,
+                             group: Optional[str] = None):
+        """
+        Все записи /mobile/students по фильтру: страницы запрашиваются по очереди,
+        каждая разбирается потоково - память не зависит от размера справочника
+        
+        Yields:
+            dict: запись студента в формате LDAP
             
-            if not success:
-                return False, {'error': 'Failed to search students', 'students': []}
+        Raises:
+            RuntimeError: LDAP API вернул ошибку - выгрузка неполная
+        """
+        page_size = self.directory_page_size
+        skip = 0
+        previous_first = None
+        while True:
+            meta = {}
+            fetched = 0
+            params = self._search_params(query, group, skip, page_size)
+            with closing(self._stream_records(access_token, params, meta)) as records:
+                for record in records:
+                    if not fetched:
+                        # Сервер мог проигнорировать параметры пагинации и вернуть ту же страницу
+                        if skip and record.get('uid') == previous_first:
+                            return
+                        previous_first = record.get('uid')
+                    fetched += 1
+                    yield record
             
-            # Обрабатываем ответ от LDAP
-            if isinstance(response, list):
-                students_data = response
-            elif isinstance(response, dict):
-                students_data = response.get('data', [])
-            else:
-                students_data = []
+            skip += fetched
+            total = meta.get('count')
+            if fetched < page_size or (isinstance(total, int) and skip >= total):
+                return
+
+    def iter_student_directory(self, access_token: str):
+        """Весь справочник /mobile/students для синхронизации (см. iter_student_records)"""
+        return self.iter_student_records(access_token)
+
+    def _directory_result(self, profile_success: bool, profile: Dict, records,
+                          offset: int, limit: int) -> Tuple[bool, Dict]:
+        """Ответ поиска по локальному справочнику после проверки токена"""
+        if not profile_success:
+            return self._search_error(profile)
+        return True, {
+            'students': [self._format_student(record) for record in records],
+            'next_cursor': offset + limit if len(records) == limit else None,
+            'total': None
+        }
+
+    def _search_directory(self, access_token: str, query: Optional[str],
+                          group: Optional[str], limit: int,
+                          offset: int = 0) -> Optional[Tuple[bool, Dict]]:
+        """Поиск по локальному справочнику (None - справочник не синхронизирован)"""
+        if not self.directory_mirror:
+            return None
+        index = student_directory.get_index()
+        if index is None:
+            return None
+        
+        # Справочник локальный, но отдаем его только владельцу действующего токена
+        # (профиль обычно уже в кэше)
+        success, profile = self.get_user_profile(access_token)
+        records = index.search(query, group, limit, offset)
+        return self._directory_result(success, profile, records, offset, limit)
+
+    def _normalize_query(self, value: Optional[str]) -> Optional[str]:
+        """Регистр и лишние пробелы запроса не важны (как и для contains в LDAP API)"""
+        return ' '.join(value.split()).casefold() if value else None
+
+    def _search_key(self, query: Optional[str], group: Optional[str], limit: int,
+                    offset: int) -> tuple:
+        """Ключ кэша поиска"""
+        return ('search', self._normalize_query(query), self._normalize_query(group), limit, offset)
+
+    def _typeahead_lookup(self, query: str, group: Optional[str]) -> Optional[list]:
+        """
+        Студенты по запросу из полной выдачи запроса-префикса (или самого запроса)
+        
+        Каждый студент, подходящий под "karim", есть в полной выдаче "kar",
+        поэтому она фильтруется локально теми же contains по uid, mail и имени
+        
+        Returns:
+            list или None - подходящей полной выдачи в кэше нет
+        """
+        query = self._normalize_query(query)
+        group = self._normalize_query(group)
+        for length in range(len(query), self.typeahead_min_chars - 1, -1):
+            students = typeahead_cache.get((query[:length], group))
+            if students is None:
+                continue
+            if length == len(query):
+                return students
+            return [
+                student for student in students
+                if any(query in (self._normalize_query(student.get(field)) or '')
+                       for field in ('username', 'email', 'full_name'))
+            ]
+        return None
+
+    def _typeahead_store(self, query: str, group: Optional[str], result: Dict):
+        """Запоминает выдачу, только если она полная (next_cursor = None)"""
+        if not self.search_cache_ttl or result.get('next_cursor') is not None:
+            return
+        key = (self._normalize_query(query), self._normalize_query(group))
+        if len(key[0]) >= self.typeahead_min_chars:
+            typeahead_cache.set(key, [dict(student) for student in result['students']],
+                                self.search_cache_ttl)
+
+    def _typeahead_page(self, students: list, offset: int, limit: int,
+                        complete: bool) -> Optional[Dict]:
+        """
+        Страница выдачи из списка студентов
+        (None - неполный список не покрывает страницу, нужен обычный поиск)
+        """
+        page = students[offset:offset + limit]
+        end = offset + len(page)
+        if not complete and end < offset + limit:
+            return None
+        more = end < len(students) or not complete
+        return {
+            'students': [dict(student) for student in page],
+            'next_cursor': end if more else None,
+            'total': len(students) if complete else None
+        }
+
+    def _typeahead_fetch_limit(self, offset: int, limit: int) -> int:
+        return min(self.search_max_limit, max(self.typeahead_limit, offset + limit))
+
+    def _copy_search_result(self, result: Dict) -> Dict:
+        # Views меняют записи студентов (avatar) - кэш отдает и хранит копии
+        copy = dict(result)
+        copy['students'] = [dict(student) for student in result['students']]
+        return copy
+
+    def _search_cache_store(self, key: tuple, pages: list, result: Tuple[bool, Dict]):
+        """Кэширует только полную выдачу: все страницы получены успешно"""
+        success, response = result
+        if self.search_cache_ttl and success and all(page[0] for page in pages):
+            search_cache.set(key, self._copy_search_result(response), self.search_cache_ttl)
+
+    def _cached_search_result(self, profile_success: bool, profile: Dict,
+                              cached: Dict) -> Tuple[bool, Dict]:
+        """Результат из кэша поиска после проверки токена"""
+        if not profile_success:
+            return self._search_error(profile)
+        return True, self._copy_search_result(cached)
+
+    def _search_page(self, access_token: str, query: Optional[str], group: Optional[str],
+                     chunk: tuple) -> Tuple[bool, Dict]:
+        skip, take = chunk
+        return self._read_request(
+            'search_students',
+            access_token,
+            method='GET',
+            params=self._search_params(query, group, skip, take)
+        )
+
+    def _get_search_executor(self) -> ThreadPoolExecutor:
+        if self._search_executor is None:
+            with self._session_lock:
+                if self._search_executor is None:
+                    self._search_executor = ThreadPoolExecutor(
+                        max_workers=self.search_parallel_pages, thread_name_prefix='ldap-search'
+                    )
+        return self._search_executor
+
+    def search_students(self, access_token: str, query: Optional[str] = None, 
+                       group: Optional[str] = None, limit: int = 50,
+                       offset: int = 0, typeahead: bool = False) -> Tuple[bool, Dict]:
+        """
+        Поиск студентов через LDAP API
+        
+        Результаты LDAP API кэшируются на search_cache_ttl для всех пользователей
+        (ключ - нормализованный запрос, группа, limit, offset); из кэша они
+        отдаются только владельцу действующего токена
+        
+        Args:
+            access_token: Access token для авторизации
+            query: поисковый запрос (имя, фамилия, username)
+            group: группа/department (например, BM_01 EN Year1)
+            limit: максимальное количество результатов
+            offset: курсор - сколько результатов пропустить (next_cursor прошлого ответа)
+            typeahead: запрос набирается по буквам - уточнять выдачу короткого
+                       запроса локально (см. _typeahead_search)
             
-            # Преобразуем формат данных для фронтенда с фильтрацией по группе
-            formatted_students = []
-            for student in students_data:
-                department = student.get('department', 'no info')
-                
-                # Фильтруем по группе/department (если указан)
-                if group and department != group:
-                    continue
-                
-                # Обрабатываем имя
-                display_name = student.get('display_name', '')
-                name_parts = [p for p in display_name.strip().split() if p]
-                
-                # В LDAP формат: "ИМЯ ФАМИЛИЯ" (например, "SABINA SULAYMONOVA")
-                if len(name_parts) >= 2:
-                    first_name = name_parts[0].title()
-                    last_name = ' '.join(name_parts[1:]).title()
-                elif len(name_parts) == 1:
-                    first_name = name_parts[0].title()
-                    last_name = ''
-                else:
-                    first_name = ''
-                    last_name = ''
-                
-                formatted_student = {
-                    'id': student.get('uid', ''),
-                    'username': student.get('uid', ''),
-                    'email': student.get('mail', ''),
-                    'first_name': first_name,
-                    'last_name': last_name,
-                    'full_name': display_name,
-                    'student': {
-                        'group': {
-                            'name': department
-                        },
-                        'department': department,
-                        'status': student.get('status', 'Students'),
-                        'student_id': student.get('student_id', 0)
-                    }
-                }
-                formatted_students.append(formatted_student)
+        Returns:
+            Tuple[bool, Dict]: (success, {'students', 'next_cursor', 'total'})
+        """
+        limit = max(1, min(limit, self.search_max_limit))
+        offset = max(0, offset)
+
+        try:
+            result = self._search_directory(access_token, query, group, limit, offset)
+            if result is not None:
+                return result
             
-            return True, {'students': formatted_students}
+            if typeahead and self._normalize_query(query):
+                return self._typeahead_search(access_token, query, group, limit, offset)
+            return self._search_upstream(access_token, query, group, limit, offset)
             
         except Exception as e:
             logger.error(f"LDAP student search error: {e}")
             return False, {'error': str(e), 'students': []}
 
+    def _typeahead_search(self, access_token: str, query: str, group: Optional[str],
+                          limit: int, offset: int) -> Tuple[bool, Dict]:
+        """
+        Поиск при наборе запроса: если в кэше есть полная выдача запроса-префикса
+        ("kar" для "karim"), она фильтруется локально без LDAP API. Иначе из LDAP
+        API берется до typeahead_limit результатов; полная выдача запоминается
+        для следующих букв, неполная - нет (LDAP API спрашивается снова)
+        """
+        students = self._typeahead_lookup(query, group)
+        if students is not None:
+            success, profile = self.get_user_profile(access_token)
+            if not success:
+                return self._search_error(profile)
+            return True, self._typeahead_page(students, offset, limit, complete=True)
+        
+        success, response = self._search_upstream(
+            access_token, query, group, self._typeahead_fetch_limit(offset, limit), 0
+        )
+        if not success:
+            return success, response
+        self._typeahead_store(query, group, response)
+        
+        page = self._typeahead_page(response['students'], offset, limit,
+                                    complete=response['next_cursor'] is None)
+        if page is None:
+            return self._search_upstream(access_token, query, group, limit, offset)
+        return True, page
+
+    def _search_upstream(self, access_token: str, query: Optional[str], group: Optional[str],
+                         limit: int, offset: int) -> Tuple[bool, Dict]:
+        """Поиск в LDAP API (с кэшем результатов)"""
+        key = self._search_key(query, group, limit, offset)
+        cached = search_cache.get(key) if self.search_cache_ttl else None
+        if cached is not None:
+            # Профиль обычно уже в кэше - проверка токена без LDAP API
+            success, profile = self.get_user_profile(access_token)
+            return self._cached_search_result(success, profile, cached)
+        
+        chunks = self._search_chunks(offset, limit)
+        first = self._search_page(access_token, query, group, chunks[0])
+        if not first[0]:
+            return self._search_error(first[1])
+        
+        # Следующие страницы запрашиваем параллельно
+        rest = self._remaining_chunks(chunks, first[1])
+        pages = [first]
+        if rest:
+            pages.extend(self._get_search_executor().map(
+                propagate(lambda chunk: self._search_page(access_token, query, group, chunk)), rest
+            ))
+        
+        total = first[1].get('count') if isinstance(first[1], dict) else None
+        result = self._search_result(chunks, pages, offset, limit, total)
+        self._search_cache_store(key, pages, result)
+        return result
+
     def _search_students_mock(self, query: Optional[str] = None, 
                              group: Optional[str] = None, limit: int = 50) -> Tuple[bool, Dict]:
         """
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from authentication.bulkhead import BACKGROUND, upstream_priority
+from authentication.ldap_service import ldap_service
+from authentication.student_directory import student_directory
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Синхронизирует локальную копию справочника студентов LDAP (для поиска)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--token', help='Access token LDAP (вместо логина и пароля)')
+        parser.add_argument('--username', default=getattr(settings, 'LDAP_DIRECTORY_USERNAME', ''))
+        parser.add_argument('--password', default=getattr(settings, 'LDAP_DIRECTORY_PASSWORD', ''))
+
+    def handle(self, *args, **options):
+        # Выгрузка справочника не должна мешать пользовательским запросам
+        with upstream_priority(BACKGROUND):
+            self._sync(options)
+
+    def _sync(self, options):
+        access_token = options['token']
+        if not access_token:
+            if not options['username'] or not options['password']:
+                raise CommandError('Укажите --token или --username/--password (LDAP_DIRECTORY_USERNAME/PASSWORD)')
+
+            success, response = ldap_service.login(options['username'], options['password'])
+            if not success or not response.get('access_token'):
+                raise CommandError(f"Не удалось войти в LDAP: {response.get('error', response)}")
+            access_token = response['access_token']
+
+        synced_at = timezone.now()
+        total = 0
+        batch = []
+        try:
+            # Ответ разбирается потоково и сохраняется пачками - память не растет
+            for record in ldap_service.iter_student_directory(access_token):
+                batch.append(record)
+                if len(batch) >= BATCH_SIZE:
+                    total += student_directory.store(batch, synced_at)
+                    batch = []
+                    self.stdout.write(f'Загружено записей: {total}')
+            if batch:
+                total += student_directory.store(batch, synced_at)
+        except RuntimeError as e:
+            # Неполная выгрузка: старые записи не удаляем
+            raise CommandError(f'Ошибка выгрузки справочника: {e}')
+
+        if not total:
+            raise CommandError('LDAP вернул пустой справочник, синхронизация отменена')
+
+        removed = student_directory.prune(synced_at)
+        self.stdout.write(
+            self.style.SUCCESS(f'Справочник синхронизирован: {total} студентов, удалено {removed}')
+        )
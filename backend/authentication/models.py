@@ -1,3 +1,65 @@
 from django.db import models
 
-# Create your models here.
+
+class DirectoryStudent(models.Model):
+    """
+    Локальная копия справочника студентов LDAP (/mobile/students)
+    Заполняется командой sync_student_directory, используется для поиска
+    """
+    uid = models.CharField(max_length=64, unique=True, verbose_name='UID')
+    display_name = models.CharField(max_length=255, blank=True, verbose_name='ФИО')
+    mail = models.CharField(max_length=255, blank=True, verbose_name='Email')
+    department = models.CharField(max_length=255, blank=True, db_index=True, verbose_name='Группа')
+    data = models.JSONField(default=dict, verbose_name='Запись LDAP')
+    synced_at = models.DateTimeField(db_index=True, verbose_name='Синхронизировано')
+
+    class Meta:
+        verbose_name = 'Студент (справочник LDAP)'
+        verbose_name_plural = 'Справочник студентов LDAP'
+        ordering = ['display_name']
+
+    def __str__(self):
+        return f"{self.display_name} ({self.uid})"
+
+
+class MirroredMessage(models.Model):
+    """
+    Локальная копия сообщения LDAP (/mobile/messages-list) пользователя
+    Заполняется инкрементально (см. inbox.py); id записи растет с появлением
+    новых сообщений и служит курсором since
+    """
+    username = models.CharField(max_length=64, verbose_name='Пользователь')
+    message_id = models.CharField(max_length=128, verbose_name='ID сообщения')
+    data = models.JSONField(default=dict, verbose_name='Запись LDAP')
+    is_read = models.BooleanField(default=False, verbose_name='Прочитано')
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name='Получено')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+
+    class Meta:
+        verbose_name = 'Сообщение (копия LDAP)'
+        verbose_name_plural = 'Сообщения (копия LDAP)'
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['username', 'message_id'], name='mirrored_message_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['username', 'is_read'], name='mirrored_message_unread'),
+        ]
+
+    def __str__(self):
+        return f"{self.username}: {self.message_id}"
+
+
+class MessageMirrorState(models.Model):
+    """Состояние копии сообщений пользователя: когда запрошено и выполнено обновление из LDAP"""
+    username = models.CharField(max_length=64, unique=True, verbose_name='Пользователь')
+    requested_at = models.DateTimeField(verbose_name='Обновление запрошено')
+    synced_at = models.DateTimeField(null=True, blank=True, verbose_name='Обновлено из LDAP')
+    messages = models.PositiveIntegerField(default=0, verbose_name='Сообщений')
+
+    class Meta:
+        verbose_name = 'Копия сообщений пользователя'
+        verbose_name_plural = 'Копии сообщений пользователей'
+
+    def __str__(self):
+        return f"{self.username} ({self.synced_at})"
@@ -0,0 +1,110 @@
+"""
+Потоковый multipart/form-data для загрузки файлов в LDAP API
+
+Тело запроса не собирается в памяти: файл читается чанками прямо во время
+отправки, sha256 считается по ходу чтения. Длина тела известна заранее,
+поэтому запрос уходит с Content-Length, а не chunked.
+"""
+
+import asyncio
+import hashlib
+import mimetypes
+import os
+import uuid
+from typing import Any, Dict, Iterator
+
+
+def _file_size(file) -> int:
+    size = getattr(file, 'size', None)
+    if size is not None:
+        return size
+    position = file.tell()
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(position)
+    return size
+
+
+def _iter_file(file, chunk_size: int) -> Iterator[bytes]:
+    # UploadedFile.chunks() сам перематывает файл в начало
+    if hasattr(file, 'chunks'):
+        yield from file.chunks(chunk_size)
+        return
+    file.seek(0)
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _quote(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+
+
+class MultipartStream:
+    """
+    Тело multipart/form-data из файлов {имя поля: файл}
+
+    Args:
+        files: UploadedFile или бинарные файловые объекты
+        chunk_size: размер чанка чтения файла
+
+    После отправки digests содержит sha256 каждого файла.
+    """
+
+    def __init__(self, files: Dict[str, Any], chunk_size: int = 64 * 1024):
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self.digests: Dict[str, str] = {}
+
+        self._parts = []
+        for name, file in files.items():
+            filename = os.path.basename(getattr(file, 'name', None) or name)
+            content_type = (
+                getattr(file, 'content_type', None)
+                or mimetypes.guess_type(filename)[0]
+                or 'application/octet-stream'
+            )
+            header = (
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{_quote(name)}"; filename="{_quote(filename)}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n'
+            ).encode('utf-8')
+            self._parts.append((name, header, file, _file_size(file)))
+
+        self._closing = f'--{self.boundary}--\r\n'.encode('ascii')
+
+        # Суммарный размер файлов (для проверки лимита до отправки)
+        self.size = sum(size for _, _, _, size in self._parts)
+        self._length = sum(len(header) + size + 2 for _, header, _, size in self._parts) + len(self._closing)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self) -> Iterator[bytes]:
+        for name, header, file, size in self._parts:
+            yield header
+            sha256 = hashlib.sha256()
+            read = 0
+            for chunk in _iter_file(file, self.chunk_size):
+                read += len(chunk)
+                if read > size:
+                    raise ValueError(f'File {name} changed during upload')
+                sha256.update(chunk)
+                yield chunk
+            if read != size:
+                raise ValueError(f'File {name} changed during upload')
+            self.digests[name] = sha256.hexdigest()
+            yield b'\r\n'
+        yield self._closing
+
+    async def aiter_chunks(self):
+        """Async-итератор тела для httpx.AsyncClient (файл читается в потоке, не в event loop)"""
+        chunks = iter(self)
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
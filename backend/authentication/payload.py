@@ -0,0 +1,94 @@
+"""
+Тело ответа LDAP API без разбора JSON
+
+Для прокси endpoints (курсы, оценки, посещаемость, сообщения) ответ LDAP API
+отдается клиенту как есть: байты вставляются в конверт {"success": true,
+"data": ...} без json.loads/json.dumps. При получении тело проверяется только
+по границам (looks_like_json), JSON разбирается лениво - только если данные
+понадобились коду (RawPayload.data или доступ как к dict). Такой код должен
+обрабатывать ValueError: границы не гарантируют корректный JSON внутри.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict
+
+_BOM = b'\xef\xbb\xbf'
+_WHITESPACE = b' \t\r\n'
+
+
+def looks_like_json(body: bytes) -> bool:
+    """
+    Быстрая проверка без разбора: тело - JSON объект или массив целиком
+    (первый и последний значимые символы; обрезанное тело не проходит)
+    """
+    body = body.lstrip(_BOM + _WHITESPACE).rstrip(_WHITESPACE)
+    return body[:1] + body[-1:] in (b'{}', b'[]')
+
+
+class RawPayload:
+    """
+    Исходные байты JSON ответа LDAP API
+
+    Ведет себя как разобранный ответ (get, [], in, итерация), поэтому код,
+    которому нужны данные, работает с ним как с dict. Разобранные данные не
+    сохраняются: payload живет в кэше ответов, и копия в виде dict удвоила бы
+    его память - код, которому данные нужны несколько раз, берет data один раз.
+    """
+
+    __slots__ = ('body', '_digest')
+
+    def __init__(self, body: bytes):
+        if body.startswith(_BOM):
+            body = body[len(_BOM):]
+        self.body = body
+        self._digest = None
+
+    @property
+    def data(self) -> Any:
+        """
+        Разобранный JSON (при каждом обращении)
+
+        Raises:
+            ValueError: тело не является корректным JSON
+        """
+        return json.loads(self.body)
+
+    @property
+    def digest(self) -> str:
+        """Хэш исходных байт (считается один раз)"""
+        if self._digest is None:
+            self._digest = hashlib.blake2b(self.body, digest_size=16).hexdigest()
+        return self._digest
+
+    def wrap(self, fields: Dict[str, Any]) -> bytes:
+        """JSON объект fields + "data": исходные байты (без повторной сериализации)"""
+        head = json.dumps(fields, ensure_ascii=False, separators=(',', ':'))[:-1].encode('utf-8')
+        separator = b',' if fields else b''
+        return head + separator + b'"data":' + self.body + b'}'
+
+    def get(self, key, default=None):
+        data = self.data
+        return data.get(key, default) if isinstance(data, dict) else default
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, RawPayload):
+            return self.body == other.body
+        return self.data == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'RawPayload({len(self.body)} bytes)'
@@ -0,0 +1,283 @@
+"""
+Прогрев кэша перед пиковыми окнами расписания
+
+Сразу после окончания пар все открывают оценки и посещаемость одновременно.
+Окна пиков - время окончания занятий из Schedule.time ("09:00-10:30") на
+текущий день недели. За lead секунд до каждого окна планировщик обновляет
+кэш (refresh) выбранных наборов данных для недавно активных токенов, и пик
+обслуживается из теплого кэша.
+
+- Реестр активных токенов пополняется запросами пользователей к LDAP API
+  (фоновые запросы его не продлевают); токены хранятся только в памяти процесса
+- Обновления идут через пул фонового обновления с фоновым приоритетом
+  bulkhead и не чаще rate запросов в секунду, не больше budget за окно
+- Токен, на который LDAP API ответил unauthorized, удаляется из реестра
+- Кэш и реестр - память процесса воркера, поэтому поток планировщика
+  запускается в каждом воркере при первом запросе пользователя (не в
+  AppConfig.ready: там он попал бы в manage.py команды и preload master)
+"""
+
+import datetime
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from .bulkhead import BACKGROUND, current_priority
+from .cache import make_key, token_hash
+from .refresher import background_refresher
+
+logger = logging.getLogger(__name__)
+
+# Дни недели Schedule.day по datetime.weekday()
+WEEKDAYS = ('Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье')
+
+# Время окончания занятия: "09:00-10:30" -> 10:30
+_SLOT_END_RE = re.compile(r'(\d{1,2})[:.](\d{2})\s*$')
+
+
+def slot_end(slot: str) -> Optional[datetime.time]:
+    """Время окончания слота Schedule.time или None, если формат не распознан"""
+    match = _SLOT_END_RE.search(slot or '')
+    if not match:
+        return None
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if hour > 23 or minute > 59:
+        return None
+    return datetime.time(hour, minute)
+
+
+class ActiveTokens:
+    """
+    Недавно активные токены (LRU по последнему запросу)
+
+    Args:
+        maxsize: сколько токенов помнить
+    """
+
+    def __init__(self, maxsize: int = 5000):
+        self.maxsize = maxsize
+        self._tokens: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def touch(self, access_token: str):
+        """Отмечает запрос пользователя; запросы с фоновым приоритетом не учитываются"""
+        if not access_token or current_priority() == BACKGROUND:
+            return
+        key = token_hash(access_token)
+        with self._lock:
+            self._tokens[key] = (time.time(), access_token)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self.maxsize:
+                self._tokens.popitem(last=False)
+        # Первый запрос пользователя в процессе - это обслуживающий воркер
+        prefetch_scheduler.ensure_running()
+
+    def forget(self, access_token: str):
+        with self._lock:
+            self._tokens.pop(token_hash(access_token), None)
+
+    def active(self, within: float) -> List[str]:
+        """Токены, активные за последние within секунд (недавние первыми)"""
+        since = time.time() - within
+        with self._lock:
+            items = list(self._tokens.values())
+        return [token for seen, token in reversed(items) if seen >= since]
+
+    def __len__(self):
+        return len(self._tokens)
+
+
+active_tokens = ActiveTokens(maxsize=getattr(settings, 'LDAP_PREFETCH_MAX_TOKENS', 5000))
+
+
+class PrefetchScheduler:
+    """
+    Фоновый поток прогрева кэша перед окончанием занятий
+
+    Args:
+        enabled: запускать ли планировщик (LDAP_PREFETCH_ENABLED)
+        datasets: какие данные обновлять (ключи LDAPService.endpoints)
+        lead: за сколько секунд до окончания занятия начинать (сек)
+        active_within: какие токены считать активными (сек с последнего запроса)
+        rate: обновлений в секунду (бюджет запросов к LDAP API)
+        budget: максимум обновлений за одно окно
+        reload: как часто перечитывать расписание (сек)
+    """
+
+    def __init__(self, enabled: bool = False, datasets=('grades', 'attendance'), lead: int = 120,
+                 active_within: int = 3600, rate: float = 5, budget: int = 1000, reload: int = 300):
+        self.enabled = enabled
+        self.datasets = tuple(datasets)
+        self.lead = lead
+        self.active_within = active_within
+        self.rate = rate
+        self.budget = budget
+        self.reload = reload
+        self._thread = None
+        self._thread_pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._windows: List[datetime.time] = []
+        self._windows_day = None
+        self._windows_loaded_at = 0.0
+        self.runs = 0
+        self.submitted = 0
+        self.skipped = 0
+        self.unauthorized = 0
+        self.last_run = None
+        self.next_run = None
+
+    def windows(self, day: datetime.date) -> List[datetime.time]:
+        """Окна пиков дня: отсортированные времена окончания занятий"""
+        if self._windows_day == day and time.monotonic() - self._windows_loaded_at < self.reload:
+            return self._windows
+        from schedule.models import Schedule
+
+        try:
+            slots = Schedule.objects.filter(day=WEEKDAYS[day.weekday()]).values_list('time', flat=True).distinct()
+            windows = sorted({end for end in map(slot_end, slots) if end is not None})
+        except DatabaseError as e:
+            logger.warning(f"Prefetch schedule load failed: {e}")
+            windows = self._windows if self._windows_day == day else []
+        finally:
+            # Поток спит между загрузками дольше wait_timeout БД - соединение не держим
+            connection.close()
+        self._windows, self._windows_day = windows, day
+        self._windows_loaded_at = time.monotonic()
+        return windows
+
+    def next_window(self, now: datetime.datetime) -> Optional[datetime.datetime]:
+        """Ближайший момент прогрева сегодня (окончание занятия - lead), не раньше now"""
+        for end in self.windows(now.date()):
+            start = datetime.datetime.combine(now.date(), end, tzinfo=now.tzinfo)
+            start -= datetime.timedelta(seconds=self.lead)
+            if start >= now:
+                return start
+        return None
+
+    def _fetch(self, service, name: str, access_token: str):
+        method = {
+            'courses': service.get_active_courses,
+            'grades': service.get_course_grades,
+            'attendance': service.get_course_attendance,
+            'messages': service.get_messages,
+        }[name]
+        success, response = method(access_token, refresh=True)
+        if not success and 'unauthorized' in str(response.get('error', '')).lower():
+            # Токен истек - больше не прогреваем
+            active_tokens.forget(access_token)
+            with self._lock:
+                self.unauthorized += 1
+
+    def run_once(self) -> int:
+        """
+        Обновляет кэш активных токенов (с ограничением скорости)
+
+        Returns:
+            int: сколько обновлений поставлено в очередь
+        """
+        from .ldap_service import ldap_service
+
+        tokens = active_tokens.active(self.active_within)
+        submitted = 0
+        interval = 1 / self.rate if self.rate > 0 else 0
+        for access_token in tokens:
+            if submitted >= self.budget or self._stop.is_set():
+                break
+            for name in self.datasets:
+                if submitted >= self.budget or self._stop.is_set():
+                    break
+                if not ldap_service.cache_ttl.get(name):
+                    continue
+                queued = background_refresher.submit(
+                    make_key(f'prefetch:{name}', access_token),
+                    lambda name=name, access_token=access_token: self._fetch(ldap_service, name, access_token)
+                )
+                if not queued:
+                    with self._lock:
+                        self.skipped += 1
+                    continue
+                submitted += 1
+                if interval:
+                    self._stop.wait(interval)
+
+        with self._lock:
+            self.runs += 1
+            self.submitted += submitted
+            self.last_run = timezone.now().isoformat()
+        logger.info(f"Prefetch: {submitted} refreshes for {len(tokens)} active tokens")
+        return submitted
+
+    def _loop(self):
+        while not self._stop.is_set():
+            now = timezone.localtime()
+            start = self.next_window(now)
+            self.next_run = start.isoformat() if start else None
+            if start is None:
+                # Сегодня пиков больше нет: ждем следующего дня (или обновления расписания)
+                tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1),
+                                                     datetime.time(), tzinfo=now.tzinfo)
+                self._stop.wait(min(self.reload, (tomorrow - now).total_seconds()))
+                continue
+            delay = (start - now).total_seconds()
+            if delay > 0:
+                # Расписание могло измениться - перепроверяем не реже reload
+                self._stop.wait(min(delay, self.reload))
+                if delay > self.reload:
+                    continue
+            if self._stop.is_set():
+                break
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Prefetch failed: {e}")
+            # Не запускаем то же окно повторно
+            self._stop.wait(max(0.0, (start - timezone.localtime()).total_seconds()) + 1)
+
+    def start(self):
+        """Запускает поток планировщика (один на процесс)"""
+        with self._lock:
+            if self._thread_pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='ldap-prefetch', daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def ensure_running(self):
+        """Запускает планировщик в текущем процессе, если он включен и еще не запущен"""
+        if self.enabled and self._thread_pid != os.getpid() and not self._stop.is_set():
+            self.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'running': self._thread_pid == os.getpid() and self._thread.is_alive(),
+                'datasets': list(self.datasets),
+                'active_tokens': len(active_tokens),
+                'windows': [end.strftime('%H:%M') for end in self._windows],
+                'next_run': self.next_run,
+                'last_run': self.last_run,
+                'runs': self.runs,
+                'submitted': self.submitted,
+                'skipped': self.skipped,
+                'unauthorized': self.unauthorized,
+            }
+
+
+prefetch_scheduler = PrefetchScheduler(
+    enabled=getattr(settings, 'LDAP_PREFETCH_ENABLED', False),
+    **getattr(settings, 'LDAP_PREFETCH', {}),
+)
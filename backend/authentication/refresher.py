@@ -0,0 +1,89 @@
+"""
+Фоновое обновление данных LDAP API
+Задачи выполняются в отдельном пуле потоков и никогда не блокируют поток запроса;
+запросы к LDAP API из них идут с фоновым приоритетом (только свободная емкость)
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable
+
+from django.conf import settings
+
+from .bulkhead import BACKGROUND, upstream_priority
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundRefresher:
+    """
+    Пул фоновых обновлений с дедупликацией по ключу
+
+    Args:
+        max_workers: потоков для обновлений
+        max_pending: максимум задач в очереди; лишние отбрасываются
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 100):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        self.submitted = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix='ldap-refresh'
+            )
+        return self._executor
+
+    def submit(self, key: Hashable, fn: Callable[[], Any]) -> bool:
+        """
+        Ставит обновление в очередь, если такое же еще не выполняется
+
+        Returns:
+            bool: задача поставлена в очередь
+        """
+        with self._lock:
+            if key in self._pending:
+                return False
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.add(key)
+            self.submitted += 1
+            executor = self._get_executor()
+
+        executor.submit(self._run, key, fn)
+        return True
+
+    def _run(self, key: Hashable, fn: Callable[[], Any]):
+        try:
+            with upstream_priority(BACKGROUND):
+                fn()
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"LDAP background refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'submitted': self.submitted,
+                'dropped': self.dropped,
+                'failed': self.failed,
+            }
+
+
+background_refresher = BackgroundRefresher(
+    max_workers=getattr(settings, 'LDAP_REFRESH_WORKERS', 4),
+    max_pending=getattr(settings, 'LDAP_REFRESH_MAX_PENDING', 100),
+)
@@ -0,0 +1,66 @@
+"""
+Общий бюджет повторных запросов к LDAP API
+
+Повторы (retry и hedged запросы) разрешены, пока их не больше ratio от
+обычных запросов (плюс небольшой минимум в секунду). Во время сбоя LDAP API
+повторы быстро исчерпывают бюджет и не умножают нагрузку на него.
+"""
+
+import threading
+import time
+from typing import Dict
+
+from django.conf import settings
+
+
+class RetryBudget:
+    """
+    Token bucket: каждый запрос добавляет ratio токена, каждый повтор тратит один
+
+    Args:
+        ratio: доля повторов от запросов (0.1 - не больше 10%)
+        min_per_second: повторы, разрешенные даже при малом трафике
+        max_tokens: максимальный запас повторов
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1, max_tokens: float = 20):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._tokens = max_tokens
+        self._updated_at = time.monotonic()
+        self.retries = 0
+        self.exhausted = 0
+
+    def _refill(self, amount: float):
+        now = time.monotonic()
+        amount += (now - self._updated_at) * self.min_per_second
+        self._updated_at = now
+        self._tokens = min(self.max_tokens, self._tokens + amount)
+
+    def record_request(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def try_retry(self) -> bool:
+        """Можно ли повторить запрос (если да - повтор учтен)"""
+        with self._lock:
+            self._refill(0)
+            if self._tokens < 1:
+                self.exhausted += 1
+                return False
+            self._tokens -= 1
+            self.retries += 1
+            return True
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                'tokens': round(self._tokens, 2),
+                'retries': self.retries,
+                'exhausted': self.exhausted,
+            }
+
+
+retry_budget = RetryBudget(**getattr(settings, 'LDAP_RETRY_BUDGET', {}))
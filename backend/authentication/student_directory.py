@@ -0,0 +1,213 @@
+"""
+Поиск студентов по локальной копии справочника LDAP (таблица DirectoryStudent)
+
+Индекс строится в памяти процесса при изменении таблицы:
+- uid -> запись (точное совпадение)
+- отсортированный список токенов: слова ФИО, uid, email (поиск по префиксу)
+- триграммы -> записи (поиск подстроки)
+
+Ранжирование: точный uid, затем префикс, затем подстрока; внутри - по ФИО
+"""
+
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Count, Max
+
+from .models import DirectoryStudent
+
+logger = logging.getLogger(__name__)
+
+EXACT = 0
+PREFIX = 1
+SUBSTRING = 2
+
+
+def _normalize(value) -> str:
+    return str(value or '').strip().lower()
+
+
+def _trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class StudentDirectoryIndex:
+    """Неизменяемый индекс по записям /mobile/students"""
+
+    def __init__(self, records: Iterable[Dict]):
+        self._records: List[Dict] = []
+        self._names: List[str] = []
+        self._departments: List[str] = []
+        self._haystacks: List[str] = []
+        self._by_uid: Dict[str, int] = {}
+        self._by_group = defaultdict(list)
+        self._grams = defaultdict(set)
+        tokens = []
+
+        for record in records:
+            uid = _normalize(record.get('uid'))
+            if not uid:
+                continue
+            i = len(self._records)
+            name = _normalize(record.get('display_name'))
+            mail = _normalize(record.get('mail'))
+            department = record.get('department', 'no info')
+
+            self._records.append(record)
+            self._names.append(name)
+            self._departments.append(department)
+            self._by_uid[uid] = i
+            self._by_group[department].append(i)
+
+            fields = [uid, name, mail]
+            # Разделитель не встречается в запросе - подстрока не "склеит" два поля
+            self._haystacks.append('\n'.join(fields))
+            for field in fields:
+                for gram in _trigrams(field):
+                    self._grams[gram].add(i)
+
+            field_tokens = {uid, name, mail, mail.split('@')[0]}
+            field_tokens.update(name.split())
+            tokens.extend((token, i) for token in field_tokens if token)
+
+        tokens.sort()
+        self._tokens = tokens
+
+    def __len__(self):
+        return len(self._records)
+
+    def _prefix_matches(self, query: str):
+        start = bisect_left(self._tokens, (query,))
+        for token, i in self._tokens[start:]:
+            if not token.startswith(query):
+                break
+            yield i
+
+    def _substring_candidates(self, query: str) -> Iterable[int]:
+        if len(query) < 3:
+            # Для 1-2 символов триграмм нет - проверяем все записи
+            return range(len(self._records))
+        postings = []
+        for gram in _trigrams(query):
+            ids = self._grams.get(gram)
+            if not ids:
+                return ()
+            postings.append(ids)
+        postings.sort(key=len)
+        return set.intersection(*postings)
+
+    def search(self, query: Optional[str] = None, group: Optional[str] = None,
+               limit: int = 50, offset: int = 0) -> List[Dict]:
+        """
+        Returns:
+            List[Dict]: исходные записи LDAP (не изменять)
+        """
+        q = _normalize(query)
+        ranks: Dict[int, int] = {}
+
+        if q:
+            exact = self._by_uid.get(q)
+            if exact is not None:
+                ranks[exact] = EXACT
+            for i in self._prefix_matches(q):
+                ranks.setdefault(i, PREFIX)
+            for i in self._substring_candidates(q):
+                if i not in ranks and q in self._haystacks[i]:
+                    ranks[i] = SUBSTRING
+        elif group:
+            ranks = {i: SUBSTRING for i in self._by_group.get(group, ())}
+
+        matches = (
+            (rank, self._names[i], i) for i, rank in ranks.items()
+            if not group or self._departments[i] == group
+        )
+        top = heapq.nsmallest(max(0, offset + limit), matches)
+        return [self._records[i] for _, _, i in top[offset:]]
+
+
+class StudentDirectory:
+    """
+    Индекс справочника текущего процесса
+
+    Таблица проверяется не чаще раза в reload_interval секунд; индекс
+    перестраивается, только если изменилось число записей или время синхронизации.
+    Пока индекс перестраивается, остальные потоки используют предыдущий.
+    """
+
+    def __init__(self, reload_interval: float = 60):
+        self.reload_interval = reload_interval
+        self._index: Optional[StudentDirectoryIndex] = None
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        try:
+            version = DirectoryStudent.objects.aggregate(count=Count('id'), synced=Max('synced_at'))
+            if version != self._version:
+                records = DirectoryStudent.objects.values_list('data', flat=True).iterator(chunk_size=2000)
+                index = StudentDirectoryIndex(records)
+                self._index = index if len(index) else None
+                self._version = version
+                logger.info(f"Student directory index loaded: {len(index)} students")
+        except DatabaseError as e:
+            logger.error(f"Student directory load error: {e}")
+        self._checked_at = time.monotonic()
+
+    def get_index(self) -> Optional[StudentDirectoryIndex]:
+        """Текущий индекс или None, если справочник еще не синхронизирован"""
+        checked_at = self._checked_at
+        if checked_at is not None and time.monotonic() - checked_at < self.reload_interval:
+            return self._index
+
+        # Первая загрузка ждет, последующие - нет
+        if self._lock.acquire(blocking=checked_at is None):
+            try:
+                if self._checked_at is checked_at:
+                    self._reload()
+            finally:
+                self._lock.release()
+        return self._index
+
+    def store(self, records: Iterable[Dict], synced_at) -> int:
+        """Сохраняет (upsert по uid) страницу записей /mobile/students"""
+        objects = [
+            DirectoryStudent(
+                uid=str(record['uid']),
+                display_name=record.get('display_name') or '',
+                mail=record.get('mail') or '',
+                department=record.get('department') or '',
+                data=record,
+                synced_at=synced_at,
+            )
+            for record in records
+            if record.get('uid')
+        ]
+        options = {}
+        if connection.features.supports_update_conflicts_with_target:
+            options['unique_fields'] = ['uid']
+        DirectoryStudent.objects.bulk_create(
+            objects,
+            batch_size=500,
+            update_conflicts=True,
+            update_fields=['display_name', 'mail', 'department', 'data', 'synced_at'],
+            **options
+        )
+        return len(objects)
+
+    def prune(self, synced_at) -> int:
+        """Удаляет записи, которых не было в последней полной синхронизации"""
+        deleted, _ = DirectoryStudent.objects.filter(synced_at__lt=synced_at).delete()
+        return deleted
+
+
+student_directory = StudentDirectory(
+    reload_interval=getattr(settings, 'LDAP_DIRECTORY_RELOAD_SECONDS', 60),
+)
@@ -7,10 +7,33 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework import status
 from .ldap_service import ldap_service
+from .views import _unavailable_response
 
 logger = logging.getLogger(__name__)
 
 
+def _search_offset(request, limit: int) -> int:
+    """
+    Смещение выдачи: cursor (next_cursor прошлого ответа) или page размером limit
+
+    Raises:
+        ValueError: некорректные параметры
+    """
+    cursor = request.GET.get('cursor')
+    if cursor:
+        offset = int(cursor)
+    else:
+        offset = (int(request.GET.get('page', 1)) - 1) * limit
+    if limit < 1 or offset < 0:
+        raise ValueError('Invalid paging parameters')
+    return offset
+
+
+def _typeahead_requested(request) -> bool:
+    """Клиент ищет по мере набора запроса (?typeahead=1)"""
+    return request.GET.get('typeahead') in ('1', 'true', 'True')
+
+
 @csrf_exempt
 @api_view(['GET'])
 @permission_classes([AllowAny])
@@ -22,6 +45,13 @@ def search_students(request):
     - q: поисковый запрос (имя, фамилия, username)
     - group: группа/department (например, BM_01 EN Year1)
     - limit: максимальное количество результатов (по умолчанию 50)
+    - cursor: продолжение выдачи (next_cursor из предыдущего ответа)
+    - page: номер страницы размером limit (если cursor не указан)
+    - typeahead: 1 - запрос набирается по буквам: выдача уточняется по полной
+      выдаче более короткого запроса без обращения к LDAP
+    
+    Response: {"success": true, "data": [...], "next_cursor": 50}
+    next_cursor = null - результатов больше нет
     """
     try:
         # Получаем Bearer токен
@@ -38,6 +68,7 @@ def search_students(request):
         query = request.GET.get('q', '')
         group = request.GET.get('group')
         limit = int(request.GET.get('limit', 50))
+        offset = _search_offset(request, limit)
         
         # Валидация параметров
         if not query and not group:
@@ -51,7 +82,9 @@ def search_students(request):
             access_token,
             query=query if query else None,
             group=group if group else None,
-            limit=limit
+            limit=limit,
+            offset=offset,
+            typeahead=_typeahead_requested(request)
         )
         
         if success:
@@ -64,9 +97,14 @@ def search_students(request):
             
             return Response({
                 'success': True,
-                'data': students
+                'data': students,
+                'next_cursor': ldap_response.get('next_cursor')
             }, status=status.HTTP_200_OK)
         else:
+            unavailable = _unavailable_response(ldap_response)
+            if unavailable:
+                return unavailable
+            
             error_message = ldap_response.get('error', 'Не удалось найти студентов')
             
             if 'timeout' in error_message.lower() or 'connection' in error_message.lower():
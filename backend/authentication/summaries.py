@@ -0,0 +1,223 @@
+"""
+Сводки оценок и посещаемости
+
+Компактные агрегаты по курсам и в целом (средний балл, процент посещаемости),
+которые считаются на сервере из (кэшированных) ответов LDAP API. Средний балл
+(gpa) совпадает с calculateGPA приложения (app/grades.tsx). Сводка
+мемоизируется по хэшу ответа: пока ответ не изменился, повторный запрос -
+это поиск в кэше.
+
+Формат записей LDAP API не зафиксирован, поэтому значения берутся из первого
+найденного поля (те же варианты, что разбирает мобильное приложение).
+"""
+
+import math
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .cache import summary_cache
+from .versions import course_entries, payload_digest
+
+# Порядок как в приложении: parseFloat(item.final_grade || item.grade || item.score || 0)
+GRADE_FIELDS = ('final_grade', 'grade', 'score')
+ATTENDED_FIELDS = ('attended', 'present', 'visited', 'attended_count')
+ABSENT_FIELDS = ('absent', 'missed', 'absent_count')
+TOTAL_FIELDS = ('total', 'total_classes', 'lessons', 'total_count')
+PERCENT_FIELDS = ('percent', 'percentage', 'attendance_percent', 'attendance')
+
+# Числовой префикс строки, который читает parseFloat в JavaScript
+_JS_FLOAT = re.compile(r'[+-]?(?:Infinity|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)')
+
+
+def _number(entry: Dict, fields) -> Optional[float]:
+    """Первое поле из fields, которое удалось привести к числу"""
+    for field in fields:
+        value = entry.get(field)
+        if value is None or value == '' or isinstance(value, bool):
+            continue
+        try:
+            return float(str(value).replace(',', '.').rstrip('%'))
+        except ValueError:
+            continue
+    return None
+
+
+def _js_truthy(value: Any) -> bool:
+    """Истинность значения в JavaScript (пустые списки и объекты - истина)"""
+    if value is None or value is False or value == '':
+        return False
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value != 0 and not math.isnan(value)
+    return True
+
+
+def _parse_float(value: Any) -> float:
+    """parseFloat из JavaScript: число в начале строки, иначе NaN"""
+    if isinstance(value, bool):
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return math.nan
+    match = _JS_FLOAT.match(value.lstrip())
+    return float(match.group().replace('Infinity', 'inf')) if match else math.nan
+
+
+def _app_grade(entry: Dict) -> Tuple[float, bool]:
+    """
+    Оценка курса как в приложении: parseFloat(final_grade || grade || score || 0)
+
+    Returns:
+        Tuple: (оценка или NaN, оценка выставлена - нашлось истинное поле)
+    """
+    value = next((entry.get(field) for field in GRADE_FIELDS if _js_truthy(entry.get(field))), None)
+    if value is None:
+        return 0.0, False
+    return _parse_float(value), True
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 2) if value is not None else None
+
+
+def _app_round(value: float) -> float:
+    """Округление до 2 знаков как в приложении: Math.round(value * 100) / 100"""
+    return math.floor(value * 100 + 0.5) / 100
+
+
+def _course(entry: Dict) -> Dict[str, Any]:
+    return {
+        'course_id': entry.get('course_id', entry.get('id')),
+        'course_name': entry.get('course_name', entry.get('subject')),
+    }
+
+
+def grades_summary(payload: Any) -> Dict[str, Any]:
+    """
+    Оценки по курсам, минимум/максимум и средний балл
+
+    average - среднее выставленных оценок; gpa - как calculateGPA приложения:
+    среднее арифметическое по всем курсам (курс без оценки считается за 0).
+    Оценка, которую parseFloat не читает (NaN в приложении), отдается как None,
+    и gpa тоже None - в приложении он был бы NaN (JSON не передает NaN)
+    """
+    courses = []
+    grades = []
+    total = 0.0
+    for entry in course_entries(payload) or []:
+        grade, graded = _app_grade(entry)
+        valid = math.isfinite(grade)
+        courses.append({**_course(entry), 'grade': _round(grade) if valid else None})
+        total += grade
+        if graded and valid:
+            grades.append(grade)
+
+    average = sum(grades) / len(grades) if grades else None
+    gpa = 0
+    if courses:
+        gpa = _app_round(total / len(courses)) if math.isfinite(total) else None
+    return {
+        'courses': courses,
+        'overall': {
+            'courses': len(courses),
+            'graded': len(grades),
+            'average': _round(average),
+            'min': _round(min(grades)) if grades else None,
+            'max': _round(max(grades)) if grades else None,
+            'gpa': gpa,
+        },
+    }
+
+
+def _attendance(entry: Dict) -> Dict[str, Optional[float]]:
+    attended = _number(entry, ATTENDED_FIELDS)
+    total = _number(entry, TOTAL_FIELDS)
+    if attended is None and total is not None:
+        absent = _number(entry, ABSENT_FIELDS)
+        if absent is not None:
+            attended = total - absent
+    if attended is not None and total:
+        percent = attended / total * 100
+    else:
+        percent = _number(entry, PERCENT_FIELDS)
+    return {'attended': attended, 'total': total, 'percent': percent}
+
+
+def attendance_summary(payload: Any) -> Dict[str, Any]:
+    """
+    Посещаемость по курсам и в целом: общий процент считается по занятиям
+    (если известны количества), иначе - среднее процентов курсов
+    """
+    courses = []
+    attended_sum = total_sum = 0.0
+    percents: List[float] = []
+    for entry in course_entries(payload) or []:
+        counts = _attendance(entry)
+        courses.append({**_course(entry), **{key: _round(value) for key, value in counts.items()}})
+        if counts['attended'] is not None and counts['total']:
+            attended_sum += counts['attended']
+            total_sum += counts['total']
+        if counts['percent'] is not None:
+            percents.append(counts['percent'])
+
+    if total_sum:
+        percent = attended_sum / total_sum * 100
+    else:
+        percent = sum(percents) / len(percents) if percents else None
+    rated = [course for course in courses if course['percent'] is not None]
+    return {
+        'courses': courses,
+        'overall': {
+            'courses': len(courses),
+            'attended': _round(attended_sum) if total_sum else None,
+            'total': _round(total_sum) if total_sum else None,
+            'percent': _round(percent),
+            # Курс с самой низкой посещаемостью
+            'lowest': min(rated, key=lambda course: course['percent'], default=None),
+        },
+    }
+
+
+SUMMARIES: Dict[str, Callable[[Any], Dict[str, Any]]] = {
+    'grades': grades_summary,
+    'attendance': attendance_summary,
+}
+
+
+class SummaryStats:
+    """Счетчики вычисленных сводок текущего процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.computed = dict.fromkeys(SUMMARIES, 0)
+
+    def add(self, name: str):
+        with self._lock:
+            self.computed[name] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        stats = summary_cache.stats()
+        with self._lock:
+            stats['computed'] = dict(self.computed)
+        return stats
+
+
+summary_stats = SummaryStats()
+
+
+def summarize(name: str, payload: Any) -> Dict[str, Any]:
+    """
+    Сводка ответа endpoint'а name (grades | attendance), мемоизированная
+    по хэшу ответа; результат не изменять
+    """
+    key = (name, payload_digest(payload))
+    summary = summary_cache.get(key)
+    if summary is None:
+        summary = SUMMARIES[name](payload)
+        summary['version'] = key[1]
+        summary_cache.set(key, summary, getattr(settings, 'LDAP_SUMMARY_CACHE_TTL', 86400))
+        summary_stats.add(name)
+    return summary
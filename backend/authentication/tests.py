@@ -1,3 +1,1449 @@
-from django.test import TestCase
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import MemoryFileUploadHandler
+from django.http.multipartparser import MultiPartParser
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .async_ldap_service import AsyncLDAPService
+from .authentication import LDAPBearerAuthentication, identity_cache, resolve_identity
+from .bulkhead import (AUTH, BACKGROUND, INTERACTIVE, AsyncBulkhead, Bulkhead, BulkheadFull,
+                       current_priority, upstream_priority)
+from .cache import (TTLCache, refresh_results, rejected_tokens, response_age, response_cache, search_cache,
+                    stale_store, typeahead_cache)
+from .circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, circuit_breakers
+from .http_pool import build_session, pool_stats
+from .inbox import MessageInbox, message_id
+from .json_stream import iter_json_array
+from .latency import AdaptiveTimeouts
+from .ldap_service import LDAPService, ldap_service
+from .multipart import MultipartStream
+from .payload import RawPayload
+from .prefetch import ActiveTokens, PrefetchScheduler, slot_end
+from .refresher import BackgroundRefresher
+from .retry_budget import RetryBudget
+from .singleflight import AsyncSingleFlight, SingleFlight
+from .student_directory import StudentDirectory, StudentDirectoryIndex
+from .summaries import attendance_summary, grades_summary
+from .tracing import EndpointHistogram, UpstreamTrace, UpstreamTracer, propagate, request_id_var
+from .versions import course_entries
+
+
+class _UpstreamHandler(BaseHTTPRequestHandler):
+    """Локальный LDAP API: keep-alive, на любой запрос - {"data": []}, X-Request-ID возвращается"""
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        body = b'{"data": []}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Request-ID', self.headers.get('X-Request-ID', ''))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    do_GET = do_POST = do_HEAD = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+def start_upstream(testcase) -> str:
+    """Запускает локальный LDAP API на время теста и возвращает его base_url"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _UpstreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    testcase.addCleanup(server.server_close)
+    testcase.addCleanup(server.shutdown)
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+class PooledSessionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.base_url = start_upstream(self)
+        pool_stats.reset()
+
+    def test_sequential_requests_reuse_connection(self):
+        session = build_session(pool_connections=1, pool_maxsize=2, pool_block=False)
+        for _ in range(3):
+            session.get(self.base_url).close()
+        counters = pool_stats.snapshot()['127.0.0.1']
+        self.assertEqual(counters['requests'], 3)
+        self.assertEqual(counters['new_connections'], 1)
+        self.assertEqual(counters['in_use'], 0)
+
+    def test_session_is_recreated_after_fork(self):
+        service = LDAPService()
+        session = service.session
+        self.assertIs(service.session, session)
+        with mock.patch('authentication.ldap_service.os.getpid', return_value=-1):
+            self.assertIsNot(service.session, session)
+
+
+class AsyncLDAPServiceTests(SimpleTestCase):
+
+    def test_client_is_closed_with_its_event_loop(self):
+        service = AsyncLDAPService()
+        clients = []
+
+        async def use():
+            clients.append(service.client)
+            self.assertIs(service.client, clients[-1])
+
+        asyncio.run(use())
+        asyncio.run(use())
+        self.assertIsNot(clients[0], clients[1])
+        self.assertTrue(all(client.is_closed for client in clients))
+        self.assertEqual(service._clients, {})
+
+    def test_cancelled_request_is_not_a_breaker_failure(self):
+        service = AsyncLDAPService()
+        service.hedge_requests = False
+        endpoint = '/tests/cancelled'
+        breaker = circuit_breakers.get(endpoint)
+
+        async def slow(*args, **kwargs):
+            await asyncio.sleep(10)
+
+        async def scenario():
+            for _ in range(breaker.min_calls):
+                task = asyncio.create_task(service._make_request(endpoint))
+                await asyncio.sleep(0.01)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+
+        with mock.patch.object(service, '_send', side_effect=slow):
+            asyncio.run(scenario())
+        self.assertEqual(breaker.snapshot()['calls'], 0)
+        self.assertEqual(breaker.snapshot()['state'], 'closed')
+
+
+class TTLCacheTests(SimpleTestCase):
+
+    def test_entry_expires_after_ttl(self):
+        cache = TTLCache(maxsize=10)
+        with mock.patch('authentication.cache.time.monotonic', return_value=100.0):
+            cache.set('key', 'value', 5)
+            self.assertEqual(cache.get('key'), 'value')
+        with mock.patch('authentication.cache.time.monotonic', return_value=105.0):
+            self.assertIsNone(cache.get('key'))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(maxsize=2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        cache.get('a')
+        cache.set('c', 3, 60)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+class ResponseCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        response_cache.clear()
+        stale_store.clear()
+        self.addCleanup(response_cache.clear)
+        self.addCleanup(stale_store.clear)
+
+    def _upstream(self, *results):
+        return mock.patch.object(ldap_service, '_make_request', side_effect=list(results))
+
+    def test_response_is_cached_per_token(self):
+        with self._upstream((True, {'data': [1]}), (True, {'data': [2]})) as upstream:
+            self.assertEqual(ldap_service.get_course_grades('token-a'), (True, {'data': [1]}))
+            self.assertEqual(ldap_service.get_course_grades('token-a'), (True, {'data': [1]}))
+            self.assertEqual(ldap_service.get_course_grades('token-b'), (True, {'data': [2]}))
+        self.assertEqual(upstream.call_count, 2)
+
+    def test_refresh_bypasses_cache(self):
+        with self._upstream((True, {'data': [1]}), (True, {'data': [2]})) as upstream:
+            ldap_service.get_course_grades('token-a')
+            self.assertEqual(ldap_service.get_course_grades('token-a', refresh=True), (True, {'data': [2]}))
+            self.assertEqual(ldap_service.get_course_grades('token-a'), (True, {'data': [2]}))
+        self.assertEqual(upstream.call_count, 2)
+
+    def test_errors_are_not_cached(self):
+        with self._upstream((False, {'error': 'HTTP 500'}), (True, {'data': [1]})) as upstream:
+            self.assertFalse(ldap_service.get_course_grades('token-a')[0])
+            self.assertTrue(ldap_service.get_course_grades('token-a')[0])
+        self.assertEqual(upstream.call_count, 2)
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def _run_concurrently(self, flight, fn, callers=4):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flight.do('key', fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+
+        threads, results, errors = self._run_concurrently(flight, fn)
+        while flight.stats()['leaders'] + flight.stats()['shared'] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 4)
+        self.assertEqual(errors, [])
+        self.assertEqual(flight.stats()['in_flight'], 0)
+
+    def test_error_is_raised_in_every_caller(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def fn():
+            release.wait(5)
+            raise RuntimeError('upstream failed')
+
+        threads, results, errors = self._run_concurrently(flight, fn)
+        while flight.stats()['leaders'] + flight.stats()['shared'] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, [])
+        self.assertEqual([str(e) for e in errors], ['upstream failed'] * 4)
+
+
+class AsyncSingleFlightTests(SimpleTestCase):
+
+    def test_leader_cancellation_does_not_cancel_followers(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'result'
+
+        async def scenario():
+            leader = asyncio.create_task(flight.do('key', fn))
+            await asyncio.sleep(0)
+            followers = [asyncio.create_task(flight.do('key', fn)) for _ in range(3)]
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await asyncio.gather(*followers), leader
+
+        results, leader = asyncio.run(scenario())
+        self.assertEqual(results, ['result'] * 3)
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(len(calls), 1)
+
+    def test_error_is_raised_in_every_caller(self):
+        flight = AsyncSingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            raise RuntimeError('upstream failed')
+
+        async def scenario():
+            return await asyncio.gather(*(flight.do('key', fn) for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(scenario())
+        self.assertEqual([str(e) for e in results], ['upstream failed'] * 3)
+        self.assertEqual(flight.stats(), {'in_flight': 0, 'leaders': 1, 'shared': 2})
+
+
+class ReadCoalescingTests(SimpleTestCase):
+
+    def setUp(self):
+        response_cache.clear()
+        self.addCleanup(response_cache.clear)
+
+    def test_concurrent_reads_share_one_upstream_call(self):
+        release = threading.Event()
+
+        def upstream(*args, **kwargs):
+            release.wait(5)
+            return True, {'data': []}
+
+        with mock.patch.object(ldap_service, '_make_request', side_effect=upstream) as request:
+            threads = [threading.Thread(target=ldap_service.get_messages, args=('coalesced-token',))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            while ldap_service._inflight.stats()['in_flight'] == 0:
+                time.sleep(0.001)
+            time.sleep(0.05)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(request.call_count, 1)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('authentication.circuit_breaker.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, window=4, open_seconds=30)
+
+    def _state(self):
+        return self.breaker.snapshot()['state']
+
+    def _open(self):
+        for success in (True, False, True, False):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(success)
+
+    def test_opens_when_failure_rate_reached(self):
+        self._open()
+        self.assertEqual(self._state(), OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 30)
+
+    def test_stays_closed_below_min_calls(self):
+        for _ in range(3):
+            self.breaker.allow()
+            self.breaker.record(False)
+        self.assertEqual(self._state(), CLOSED)
+
+    def test_half_open_probe_success_closes(self):
+        self._open()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self._state(), HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record(True)
+        self.assertEqual(self._state(), CLOSED)
+
+    def test_half_open_probe_failure_reopens(self):
+        self._open()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(False)
+        self.assertEqual(self._state(), OPEN)
+        self.assertEqual(self.breaker.snapshot()['opened'], 2)
+
+    def test_cancelled_probe_is_released_without_result(self):
+        self._open()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.cancel()
+        self.assertEqual(self._state(), HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+
+
+class EndpointAuthTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.staff = User.objects.create_user('staff', 'staff@tiue.uz', 'password', is_staff=True)
+        self.user = User.objects.create_user('student', 'student@tiue.uz', 'password')
+        self.api = APIClient()
+
+    def _assert_staff_only(self, path):
+        self.api.force_authenticate(None)
+        self.assertEqual(self.api.get(path).status_code, 401)
+        self.assertEqual(self.api.get(path, HTTP_AUTHORIZATION='Bearer ldap-token').status_code, 401)
+        self.api.force_authenticate(self.user)
+        self.assertEqual(self.api.get(path).status_code, 403)
+        self.api.force_authenticate(self.staff)
+        self.assertEqual(self.api.get(path).status_code, 200)
+
+    def test_upstream_status_requires_staff(self):
+        self._assert_staff_only('/api/auth/upstream/status/')
+
+    def test_upstream_traces_requires_staff(self):
+        self._assert_staff_only('/api/auth/upstream/traces/')
+
+    def test_ldap_proxy_endpoints_require_bearer_token(self):
+        for path in ('/api/auth/grades/', '/api/auth/attendance/', '/api/auth/grades/summary/',
+                     '/api/auth/attendance/summary/'):
+            self.assertEqual(self.client.get(path).status_code, 401)
+        self.assertEqual(self.client.post('/api/auth/messages/').status_code, 401)
+
+
+class StaleWhileRevalidateTests(SimpleTestCase):
+
+    def setUp(self):
+        for cache in (response_cache, stale_store, rejected_tokens):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        for patcher in (mock.patch.object(ldap_service, 'stale_ttl', 300),
+                        mock.patch('authentication.ldap_service.background_refresher')):
+            self.refresher = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _expire_fresh_cache(self):
+        response_cache.clear()
+
+    def test_expired_response_is_served_stale_and_refreshed(self):
+        with mock.patch.object(ldap_service, '_make_request', return_value=(True, {'data': [1]})) as upstream:
+            ldap_service.get_course_grades('token-a')
+            self._expire_fresh_cache()
+            self.assertEqual(ldap_service.get_course_grades('token-a'), (True, {'data': [1]}))
+        self.assertEqual(upstream.call_count, 1)
+        self.assertEqual(response_age(), 0)
+        self.refresher.submit.assert_called_once()
+
+    def test_rejected_token_is_never_served_stale(self):
+        rejected = (False, {'error': 'HTTP 401', 'status_code': 401})
+        with mock.patch.object(ldap_service, '_make_request',
+                               side_effect=[(True, {'data': [1]}), rejected, rejected]) as upstream:
+            ldap_service.get_course_grades('token-a')
+            self._expire_fresh_cache()
+            # Токен отклонен на другом endpoint'е - устаревшие оценки больше не отдаются
+            self.assertFalse(ldap_service.get_user_profile('token-a')[0])
+            self.assertEqual(ldap_service.get_course_grades('token-a'), rejected)
+        self.assertEqual(upstream.call_count, 3)
+        self.refresher.submit.assert_not_called()
+
+
+class WarmUpTests(SimpleTestCase):
+
+    def setUp(self):
+        response_cache.clear()
+        self.addCleanup(response_cache.clear)
+
+    def test_pool_warm_up_leaves_open_connections(self):
+        service = LDAPService()
+        service.base_url = start_upstream(self)
+        pool_stats.reset()
+        service.warm_up(connections=2)
+        opened = pool_stats.snapshot()['127.0.0.1']['new_connections']
+        self.assertGreaterEqual(opened, 1)
+        service.session.get(service.base_url).close()
+        self.assertEqual(pool_stats.snapshot()['127.0.0.1']['new_connections'], opened)
+
+    def test_login_warm_up_caches_first_screen(self):
+        refresher = BackgroundRefresher(max_workers=4)
+        with mock.patch('authentication.ldap_service.background_refresher', refresher), \
+                mock.patch.object(ldap_service, '_make_request', return_value=(True, {'data': []})) as upstream:
+            ldap_service.warm_up_user('warm-token')
+            refresher._get_executor().shutdown(wait=True)
+            self.assertEqual(upstream.call_count, 4)
+
+            for fetch in (ldap_service.get_active_courses, ldap_service.get_course_grades,
+                          ldap_service.get_course_attendance, ldap_service.get_messages):
+                self.assertEqual(fetch('warm-token'), (True, {'data': []}))
+        self.assertEqual(upstream.call_count, 4)
+        self.assertEqual(refresher.stats()['failed'], 0)
+
+
+class BatchViewTests(TransactionTestCase):
+    """Под-запросы batch выполняются в потоках пула - нужна БД без открытой транзакции теста"""
+
+    def test_batch_allows_only_read_only_views(self):
+        user = get_user_model().objects.create_user('student', 'student@tiue.uz', 'password')
+        token = Token.objects.create(user=user)
+        response = self.client.post('/api/batch/', json.dumps({'requests': [
+            {'id': 'users', 'path': '/api/users/'},
+            {'id': 'login', 'method': 'POST', 'path': '/api/auth/login'},
+            {'id': 'delete', 'method': 'DELETE', 'path': '/api/auth/grades'},
+            {'id': 'create', 'method': 'POST', 'path': '/api/news/'},
+            {'id': 'header', 'path': '/api/auth/grades', 'headers': {'Cookie': 'sessionid=x'}},
+            {'id': 'grades', 'path': '/api/auth/grades'},
+            {'id': 'news', 'path': '/api/news/'},
+            {'id': 'dashboard', 'path': '/api/users/dashboard/',
+             'headers': {'Authorization': f'Token {token.key}'}},
+        ]}), content_type='application/json')
+        statuses = {item['id']: item['status'] for item in json.loads(response.content)['data']}
+        self.assertEqual(statuses, {'users': 400, 'login': 400, 'delete': 400, 'create': 400, 'header': 400,
+                                    'grades': 401, 'news': 200, 'dashboard': 200})
+
+
+DIRECTORY = [
+    {'uid': 'karim.a', 'display_name': 'KARIM ALIEV', 'mail': 'karim.a@tiue.uz', 'department': 'BM_01'},
+    {'uid': 'akarim', 'display_name': 'AZIZ SHAKIROV', 'mail': 'akarim@tiue.uz', 'department': 'BM_02'},
+    {'uid': 'karim', 'display_name': 'SHAKARIM KARIM', 'mail': 'karim@tiue.uz', 'department': 'BM_01'},
+    {'uid': 'nodir', 'display_name': 'NODIR SAIDOV', 'mail': 'nodir@tiue.uz', 'department': 'BM_01'},
+]
+
+
+class StudentDirectoryIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.index = StudentDirectoryIndex(DIRECTORY)
+
+    def _uids(self, *args, **kwargs):
+        return [record['uid'] for record in self.index.search(*args, **kwargs)]
+
+    def test_exact_uid_then_prefix_then_substring(self):
+        self.assertEqual(self._uids('Karim '), ['karim', 'karim.a', 'akarim'])
+
+    def test_short_query_and_group_filter(self):
+        self.assertEqual(self._uids('ka', group='BM_01'), ['karim.a', 'karim'])
+        self.assertEqual(self._uids(group='BM_01'), ['karim.a', 'nodir', 'karim'])
+        self.assertEqual(self._uids('xyz'), [])
+
+    def test_limit_and_offset(self):
+        self.assertEqual(self._uids('karim', limit=2), ['karim', 'karim.a'])
+        self.assertEqual(self._uids('karim', limit=2, offset=2), ['akarim'])
+
+
+class StudentDirectoryTests(TestCase):
+
+    def setUp(self):
+        self.directory = StudentDirectory(reload_interval=0)
+
+    def test_index_follows_store_and_prune(self):
+        self.assertIsNone(self.directory.get_index())
+
+        first_sync = timezone.now()
+        self.directory.store(DIRECTORY, first_sync)
+        self.assertEqual(len(self.directory.get_index()), 4)
+
+        second_sync = first_sync + timedelta(hours=1)
+        self.directory.store([dict(DIRECTORY[0], display_name='KARIM ALIEV JR')], second_sync)
+        self.assertEqual(self.directory.prune(second_sync), 3)
+        index = self.directory.get_index()
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.search('jr')[0]['display_name'], 'KARIM ALIEV JR')
+
+    def test_search_uses_mirror_without_upstream(self):
+        with mock.patch.object(ldap_service, 'directory_mirror', True), \
+                mock.patch('authentication.ldap_service.student_directory.get_index',
+                           return_value=StudentDirectoryIndex(DIRECTORY)), \
+                mock.patch.object(ldap_service, 'get_user_profile', return_value=(True, {'uid': 'nodir'})), \
+                mock.patch.object(ldap_service, '_make_request') as upstream:
+            success, result = ldap_service.search_students('token', 'karim', limit=2)
+        self.assertTrue(success)
+        self.assertEqual([student['id'] for student in result['students']], ['karim', 'karim.a'])
+        self.assertEqual(result['next_cursor'], 2)
+        upstream.assert_not_called()
+
+
+class SearchPagingTests(SimpleTestCase):
+    total = 237
+
+    def _page(self, skip, take):
+        records = [{'uid': str(i), 'display_name': 'A B'} for i in range(skip, min(skip + take, self.total))]
+        return True, {'data': records, 'count': self.total}
+
+    def _search(self, offset, limit):
+        chunks = ldap_service._search_chunks(offset, limit)
+        for skip, take in chunks:
+            # page/pageSize и skip/take указывают на одни и те же записи
+            self.assertEqual(skip % take, 0)
+        pages = [self._page(*chunk) for chunk in chunks]
+        return ldap_service._search_result(chunks, pages, offset, limit, self.total)[1]
+
+    def test_unaligned_offset_returns_exact_window(self):
+        with mock.patch.object(ldap_service, 'search_page_size', 100):
+            for offset, limit in ((30, 150), (5, 3), (199, 100)):
+                result = self._search(offset, limit)
+                ids = [int(student['id']) for student in result['students']]
+                self.assertEqual(ids, list(range(offset, min(offset + limit, self.total))))
+
+    def test_next_cursor(self):
+        with mock.patch.object(ldap_service, 'search_page_size', 100):
+            self.assertEqual(self._search(30, 150)['next_cursor'], 180)
+            self.assertIsNone(self._search(199, 100)['next_cursor'])
+
+
+class JsonStreamTests(SimpleTestCase):
+    body = '{"count": 3, "data": [{"uid": "a", "name": "Ёлка \\"1\\""}, {"uid": "b", "gpa": 3.75}, [1, 2]], "next": null}'
+    expected = [{'uid': 'a', 'name': 'Ёлка "1"'}, {'uid': 'b', 'gpa': 3.75}, [1, 2]]
+
+    def _split(self, size, data=None):
+        data = data or self.body.encode('utf-8')
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    def test_object_response_with_meta(self):
+        meta = {}
+        self.assertEqual(list(iter_json_array([self.body.encode('utf-8')], meta=meta)), self.expected)
+        self.assertEqual(meta, {'count': 3, 'next': None})
+
+    def test_any_chunk_split_gives_same_result(self):
+        # Чанк в 1 байт режет многобайтовые символы, строки и числа (3.75) посередине
+        for size in (1, 2, 3, 7, 64):
+            meta = {}
+            self.assertEqual(list(iter_json_array(self._split(size), meta=meta)), self.expected, size)
+            self.assertEqual(meta, {'count': 3, 'next': None})
+
+    def test_bare_and_empty_arrays(self):
+        self.assertEqual(list(iter_json_array([b' [1', b'0, 2', b'0] '])), [10, 20])
+        self.assertEqual(list(iter_json_array([b'[', b' ]'])), [])
+        self.assertEqual(list(iter_json_array([b'{}'])), [])
+
+    def test_elements_are_yielded_before_the_stream_ends(self):
+        def chunks():
+            yield b'{"data": [{"uid": "a"}, '
+            raise AssertionError('stream read past the first element')
+
+        self.assertEqual(next(iter_json_array(chunks())), {'uid': 'a'})
+
+    def test_invalid_json_raises_value_error(self):
+        for body in (b'"text"', b'[1 2]', b'{"data": [1,', b'{"data" 1}'):
+            with self.assertRaises(ValueError, msg=body):
+                list(iter_json_array(self._split(1, body)))
+
+
+class MultipartStreamTests(SimpleTestCase):
+
+    def setUp(self):
+        self.photo = SimpleUploadedFile('photo "1".jpg', b'\xff\xd8' + b'x' * 5000, content_type='image/jpeg')
+        self.document = BytesIO(b'%PDF' + b'y' * 3000)
+        self.document.name = '/tmp/doc.pdf'
+
+    def _parse(self, stream, body):
+        meta = {'CONTENT_TYPE': stream.content_type, 'CONTENT_LENGTH': str(len(body))}
+        return MultiPartParser(meta, BytesIO(body), [MemoryFileUploadHandler()], 'utf-8').parse()[1]
+
+    def test_body_matches_length_and_parses(self):
+        stream = MultipartStream({'image': self.photo, 'file': self.document}, chunk_size=1024)
+        body = b''.join(stream)
+        self.assertEqual(len(stream), len(body))
+        self.assertEqual(stream.size, 5002 + 3004)
+
+        files = self._parse(stream, body)
+        self.assertEqual(files['image'].read(), self.photo.open().read())
+        self.assertEqual(files['image'].content_type, 'image/jpeg')
+        self.assertEqual(files['file'].name, 'doc.pdf')
+        self.assertEqual(files['file'].content_type, 'application/pdf')
+        self.assertEqual(stream.digests, {
+            'image': hashlib.sha256(self.photo.open().read()).hexdigest(),
+            'file': hashlib.sha256(self.document.getvalue()).hexdigest(),
+        })
+
+    def test_file_changed_during_upload(self):
+        stream = MultipartStream({'file': self.document})
+        self.document.seek(0, os.SEEK_END)
+        self.document.write(b'appended')
+        with self.assertRaises(ValueError):
+            b''.join(stream)
+
+    def test_async_chunks_match_sync_body(self):
+        stream = MultipartStream({'file': self.document}, chunk_size=512)
+
+        async def read():
+            return [chunk async for chunk in stream.aiter_chunks()]
+
+        chunks = asyncio.run(read())
+        self.assertEqual(len(b''.join(chunks)), len(stream))
+        self.assertEqual(len(chunks), 3 + 3000 // 512 + 1)
+
+    def test_upload_over_limit_is_rejected_before_sending(self):
+        with mock.patch.object(ldap_service, 'upload_max_size', 1000):
+            stream, error = ldap_service._upload_stream({'image': self.photo})
+        self.assertIsNone(stream)
+        self.assertEqual(error['max_size'], 1000)
+
+
+def _jwt(exp):
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': exp}).encode()).decode().rstrip('=')
+    return f'header.{payload}.signature'
+
+
+class IdentityCacheTests(SimpleTestCase):
+    profile = {'email': 'karim@tiue.uz', 'full_name': 'Karim Aliev', 'group': 'BM_01'}
+
+    def setUp(self):
+        identity_cache.clear()
+        self.addCleanup(identity_cache.clear)
+
+    def _profile(self, *results):
+        return mock.patch.object(ldap_service, 'get_user_profile', side_effect=list(results))
+
+    def test_identity_is_resolved_once_per_token(self):
+        with self._profile((True, self.profile)) as profile:
+            for _ in range(3):
+                self.assertEqual(resolve_identity('token')['username'], 'karim')
+        self.assertEqual(profile.call_count, 1)
+
+    def test_cache_ttl_follows_token_expiry(self):
+        with self._profile((True, self.profile), (True, self.profile)) as profile:
+            resolve_identity(_jwt(time.time() - 10))
+            resolve_identity(_jwt(time.time() - 10))
+        self.assertEqual(profile.call_count, 2)
+
+    def test_rejected_token_is_cached_briefly_but_outage_is_not(self):
+        with self._profile((False, {'error': 'HTTP 401'}), (False, {'error': 'Connection error'}),
+                           (False, {'error': 'Connection error'})) as profile:
+            self.assertIsNone(resolve_identity('rejected'))
+            self.assertIsNone(resolve_identity('rejected'))
+            self.assertIsNone(resolve_identity('outage'))
+            self.assertIsNone(resolve_identity('outage'))
+        self.assertEqual(profile.call_count, 3)
+
+    def test_user_profile_is_loaded_lazily(self):
+        with self._profile((True, self.profile)) as profile:
+            user, token = LDAPBearerAuthentication().authenticate(
+                RequestFactory().get('/', HTTP_AUTHORIZATION='Bearer lazy-token'))
+            self.assertEqual(token, 'lazy-token')
+            profile.assert_not_called()
+            self.assertTrue(user.is_authenticated)
+            self.assertEqual(user.group, 'BM_01')
+        self.assertEqual(profile.call_count, 1)
+
+
+def _response(status_code, body=b'{"data": []}'):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+
+class AdaptiveTimeoutsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.timeouts = AdaptiveTimeouts(connect=5, min_connect=0.5, min_read=2, max_read=30,
+                                         multiplier=3, min_samples=5)
+
+    def test_conservative_until_enough_samples(self):
+        for _ in range(4):
+            self.timeouts.record('/grades', 0.1)
+            self.timeouts.record_connect(0.01)
+        self.assertEqual(self.timeouts.timeout('/grades'), (5, 30))
+        self.assertIsNone(self.timeouts.hedge_delay('/grades'))
+
+    def test_read_timeout_follows_p99_within_bounds(self):
+        for seconds in (1, 1, 1, 1, 4):
+            self.timeouts.record('/grades', seconds)
+            self.timeouts.record('/fast', 0.1)
+            self.timeouts.record('/slow', 20)
+        self.assertEqual(self.timeouts.timeout('/grades')[1], 12)
+        self.assertEqual(self.timeouts.timeout('/fast')[1], 2)
+        self.assertEqual(self.timeouts.timeout('/slow')[1], 30)
+        self.assertEqual(self.timeouts.hedge_delay('/grades'), 4)
+
+    def test_connect_timeout_follows_observed_connects(self):
+        for seconds in (0.2, 0.2, 0.2, 0.2, 0.4):
+            self.timeouts.record_connect(seconds)
+        self.assertAlmostEqual(self.timeouts.timeout('/grades')[0], 1.2)
+        for _ in range(200):
+            self.timeouts.record_connect(0.01)
+        self.assertEqual(self.timeouts.connect_timeout(), 0.5)
+        for _ in range(200):
+            self.timeouts.record_connect(5)
+        self.assertEqual(self.timeouts.connect_timeout(), 5)
+
+    def test_new_connections_are_measured(self):
+        service = LDAPService()
+        service.base_url = start_upstream(self)
+        timeouts = AdaptiveTimeouts(min_samples=1)
+        with mock.patch('authentication.ldap_service.upstream_timeouts', timeouts):
+            for _ in range(2):
+                service._send('/tests/connect', 'GET', f'{service.base_url}/tests/connect', {})
+        # Второй запрос идет по keep-alive соединению
+        self.assertEqual(len(timeouts._connects), 1)
+        self.assertLess(timeouts.connect_timeout(), timeouts.connect)
+
+
+class RetryBudgetTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('authentication.retry_budget.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.budget = RetryBudget(ratio=0.1, min_per_second=1, max_tokens=2)
+
+    def test_retries_limited_by_requests_and_time(self):
+        self.assertTrue(self.budget.try_retry())
+        self.assertTrue(self.budget.try_retry())
+        self.assertFalse(self.budget.try_retry())
+        for _ in range(11):
+            self.budget.record_request()
+        self.assertTrue(self.budget.try_retry())
+        self.assertFalse(self.budget.try_retry())
+        self.now += 1
+        self.assertTrue(self.budget.try_retry())
+        self.assertEqual(self.budget.stats(), {'tokens': 0.1, 'retries': 4, 'exhausted': 2})
+
+    def test_server_error_is_retried_within_budget(self):
+        service = LDAPService()
+        service.max_retries = 2
+        with mock.patch('authentication.ldap_service.retry_budget', self.budget), \
+                mock.patch.object(service, '_retry_delay', return_value=0), \
+                mock.patch.object(service, '_send', side_effect=[_response(503), _response(503), _response(200)]):
+            self.assertTrue(service._make_request(service.endpoints['messages'], method='POST')[0])
+        with mock.patch('authentication.ldap_service.retry_budget', self.budget), \
+                mock.patch.object(service, '_send', side_effect=[_response(503)]) as send:
+            self.assertFalse(service._make_request(service.endpoints['messages'], method='POST')[0])
+        # Бюджет исчерпан - без повтора
+        self.assertEqual(send.call_count, 1)
+
+
+class HedgedRequestTests(SimpleTestCase):
+
+    def setUp(self):
+        self.service = LDAPService()
+        self.addCleanup(lambda: self.service._hedge_executor and self.service._hedge_executor.shutdown())
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        patcher = mock.patch('authentication.ldap_service.upstream_timeouts.hedge_delay', return_value=0.02)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _send(self):
+        responses = iter(['slow', 'fast'])
+
+        def send():
+            response = next(responses)
+            if response == 'slow':
+                self.release.wait(5)
+            return mock.Mock(status_code=200, label=response)
+        return send
+
+    def test_slow_request_is_hedged(self):
+        with mock.patch('authentication.ldap_service.retry_budget', RetryBudget()):
+            response = self.service._send_hedged('/tests/hedge', self._send())
+        self.assertEqual(response.label, 'fast')
+        self.assertEqual(self.service.hedged, 1)
+
+    def test_no_hedge_without_retry_budget(self):
+        with mock.patch('authentication.ldap_service.retry_budget', RetryBudget(max_tokens=0, min_per_second=0)):
+            threading.Timer(0.1, self.release.set).start()
+            response = self.service._send_hedged('/tests/hedge', self._send())
+        self.assertEqual(response.label, 'slow')
+        self.assertEqual(self.service.hedged, 0)
+
+
+class TracingTests(SimpleTestCase):
+
+    def _trace(self, total_ms, status=200, error=None):
+        trace = UpstreamTrace('/grades', 'GET')
+        trace.total = total_ms / 1000
+        trace.status = status
+        trace.error = error
+        return trace
+
+    def test_histogram_buckets_and_percentiles(self):
+        histogram = EndpointHistogram()
+        for total_ms in [3] * 90 + [40] * 9 + [45000]:
+            histogram.add(self._trace(total_ms))
+        histogram.add(self._trace(0, status=None, error='ReadTimeout'))
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 101)
+        self.assertEqual(snapshot['errors'], 1)
+        self.assertEqual(snapshot['statuses'], {'200': 100, 'ReadTimeout': 1})
+        self.assertEqual(snapshot['buckets']['le_5'], 91)
+        self.assertEqual(snapshot['buckets']['le_50'], 9)
+        self.assertEqual(snapshot['buckets']['inf'], 1)
+        self.assertEqual(snapshot['p50_ms'], 5)
+        self.assertEqual(snapshot['p99_ms'], 50)
+        self.assertEqual(snapshot['max_ms'], 45000)
+
+    def test_request_is_traced_with_request_id(self):
+        service = LDAPService()
+        service.base_url = start_upstream(self)
+        tracer = UpstreamTracer()
+        token = request_id_var.set('trace-request-id')
+        self.addCleanup(request_id_var.reset, token)
+        with mock.patch('authentication.ldap_service.upstream_tracer', tracer):
+            response = service._send('/grades', 'GET', f'{service.base_url}/grades',
+                                     service._build_headers({}))
+        self.assertEqual(response.headers['X-Request-ID'], 'trace-request-id')
+
+        # Поток executor'а видит request ID вызывающего кода
+        seen = []
+        thread = threading.Thread(target=propagate(lambda: seen.append(tracer.start('/other', 'get').request_id)))
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, ['trace-request-id'])
+
+        trace, = tracer.recent(request_id='trace-request-id')
+        self.assertEqual((trace['endpoint'], trace['method'], trace['status'], trace['bytes']),
+                         ('/grades', 'GET', 200, len(b'{"data": []}')))
+        self.assertGreater(trace['connect_ms'], 0)
+        self.assertEqual(tracer.histograms()['/grades']['count'], 1)
+
+    def test_failed_request_is_traced(self):
+        tracer = UpstreamTracer()
+        with self.assertRaises(ConnectionError):
+            with tracer.trace('/grades', 'GET'):
+                raise ConnectionError('refused')
+        self.assertEqual(tracer.recent()[0]['error'], 'ConnectionError')
+        self.assertEqual(tracer.histograms('/grades')['/grades']['errors'], 1)
+
+
+class RefreshDedupeTests(SimpleTestCase):
+    tokens = {'access_token': 'new-access', 'refresh_token': 'new-refresh'}
+
+    def setUp(self):
+        refresh_results.clear()
+        self.addCleanup(refresh_results.clear)
+
+    def test_concurrent_refreshes_share_one_exchange(self):
+        release = threading.Event()
+        results = []
+
+        def exchange(*args, **kwargs):
+            release.wait(5)
+            return True, dict(self.tokens)
+
+        def refresh():
+            results.append(ldap_service.refresh_token('old-refresh'))
+
+        with mock.patch.object(ldap_service, '_make_request', side_effect=exchange) as upstream:
+            threads = [threading.Thread(target=refresh) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            while ldap_service._inflight.stats()['in_flight'] == 0:
+                time.sleep(0.001)
+            time.sleep(0.05)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+            # Опоздавший запрос со старым токеном получает ту же пару
+            results.append(ldap_service.refresh_token('old-refresh'))
+        self.assertEqual(upstream.call_count, 1)
+        self.assertEqual(results, [(True, self.tokens)] * 4)
+
+    def test_failed_refresh_is_not_reused(self):
+        with mock.patch.object(ldap_service, '_make_request',
+                               side_effect=[(False, {'error': 'HTTP 401'}), (True, dict(self.tokens))]) as upstream:
+            self.assertFalse(ldap_service.refresh_token('old-refresh')[0])
+            self.assertEqual(ldap_service.refresh_token('old-refresh'), (True, self.tokens))
+        self.assertEqual(upstream.call_count, 2)
+
+    def test_reused_result_is_a_copy(self):
+        with mock.patch.object(ldap_service, '_make_request', return_value=(True, dict(self.tokens))):
+            ldap_service.refresh_token('old-refresh')[1]['access_token'] = 'changed'
+            self.assertEqual(ldap_service.refresh_token('old-refresh')[1], self.tokens)
+
+
+class BulkheadTests(SimpleTestCase):
+
+    def test_full_bulkhead_queues_then_rejects(self):
+        bulkhead = Bulkhead(max_concurrent=1, max_queue=1, queue_timeout=0.05, auth_reserve=0)
+        bulkhead.acquire(INTERACTIVE)
+        waiter = threading.Thread(target=lambda: self.assertRaises(BulkheadFull, bulkhead.acquire, INTERACTIVE))
+        waiter.start()
+        while not bulkhead.stats()['waiting']['interactive']:
+            time.sleep(0.001)
+        # Очередь занята - отказ без ожидания
+        with self.assertRaises(BulkheadFull):
+            bulkhead.acquire(INTERACTIVE)
+        waiter.join(5)
+        stats = bulkhead.stats()
+        self.assertEqual((stats['active'], stats['waiting']['interactive']), (1, 0))
+        self.assertEqual((stats['rejected']['interactive'], stats['timed_out']['interactive']), (2, 1))
+
+    def test_released_slot_goes_to_waiter(self):
+        bulkhead = Bulkhead(max_concurrent=1, max_queue=1, queue_timeout=5, auth_reserve=0)
+        bulkhead.acquire(INTERACTIVE)
+        waiter = threading.Thread(target=bulkhead.acquire, args=(INTERACTIVE,))
+        waiter.start()
+        while not bulkhead.stats()['waiting']['interactive']:
+            time.sleep(0.001)
+        bulkhead.release()
+        waiter.join(5)
+        self.assertEqual(bulkhead.stats()['active'], 1)
+        self.assertEqual(bulkhead.stats()['accepted']['interactive'], 2)
+
+
+class AsyncBulkheadTests(SimpleTestCase):
+
+    def setUp(self):
+        self.bulkhead = AsyncBulkhead(max_concurrent=1, max_queue=2, queue_timeout=0.05, auth_reserve=0)
+
+    def _counters(self):
+        stats = self.bulkhead.stats()
+        return stats['active'], sum(stats['waiting'].values())
+
+    def test_timed_out_waiter_leaves_queue_once(self):
+        async def scenario():
+            await self.bulkhead.acquire(INTERACTIVE)
+            with self.assertRaises(BulkheadFull):
+                await self.bulkhead.acquire(INTERACTIVE)
+
+        asyncio.run(scenario())
+        self.assertEqual(self._counters(), (1, 0))
+        self.assertEqual(self.bulkhead.stats()['timed_out']['interactive'], 1)
+
+    def test_cancel_after_grant_returns_the_slot(self):
+        async def scenario():
+            await self.bulkhead.acquire(INTERACTIVE)
+            waiter = asyncio.create_task(self.bulkhead.acquire(INTERACTIVE))
+            await asyncio.sleep(0.01)
+            # Место передано ожидающему, и в тот же момент его отменили
+            await self.bulkhead.release()
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+
+        asyncio.run(scenario())
+        self.assertEqual(self._counters(), (0, 0))
+
+    def test_slots_are_shared_between_event_loops(self):
+        self.bulkhead.queue_timeout = 5
+        entered, release = threading.Event(), threading.Event()
+
+        async def hold():
+            async with self.bulkhead.slot(INTERACTIVE):
+                entered.set()
+                await asyncio.to_thread(release.wait, 5)
+
+        holder = threading.Thread(target=asyncio.run, args=(hold(),))
+        holder.start()
+        entered.wait(5)
+
+        async def wait_for_slot():
+            task = asyncio.create_task(self.bulkhead.acquire(INTERACTIVE))
+            await asyncio.sleep(0.01)
+            self.assertEqual(self._counters(), (1, 1))
+            release.set()
+            await task
+
+        asyncio.run(wait_for_slot())
+        holder.join(5)
+        self.assertEqual(self._counters(), (1, 0))
+
+
+class BulkheadPriorityTests(SimpleTestCase):
+
+    def test_auth_enters_ahead_of_background_when_full(self):
+        bulkhead = Bulkhead(max_concurrent=2, max_queue=5, queue_timeout=5, auth_reserve=1,
+                            background_share=1)
+        bulkhead.acquire(INTERACTIVE)
+        bulkhead.acquire(AUTH)
+        order = []
+
+        def enter(priority, name):
+            bulkhead.acquire(priority)
+            order.append(name)
+
+        background = threading.Thread(target=enter, args=(BACKGROUND, 'background'))
+        background.start()
+        while not bulkhead.stats()['waiting']['background']:
+            time.sleep(0.001)
+        auth = threading.Thread(target=enter, args=(AUTH, 'auth'))
+        auth.start()
+        while not bulkhead.stats()['waiting']['auth']:
+            time.sleep(0.001)
+
+        bulkhead.release()
+        auth.join(5)
+        self.assertEqual(order, ['auth'])
+        bulkhead.release()
+        background.join(5)
+        self.assertEqual(order, ['auth', 'background'])
+
+    def test_limits_per_priority(self):
+        bulkhead = Bulkhead(max_concurrent=4, max_queue=0, auth_reserve=1, background_share=0.5)
+        for _ in range(2):
+            bulkhead.acquire(BACKGROUND)
+        self.assertRaises(BulkheadFull, bulkhead.acquire, BACKGROUND)
+        bulkhead.acquire(INTERACTIVE)
+        self.assertRaises(BulkheadFull, bulkhead.acquire, INTERACTIVE)
+        # Последнее место зарезервировано для входа
+        bulkhead.acquire(AUTH)
+        self.assertEqual(bulkhead.stats()['active'], 4)
+
+    def test_async_auth_enters_ahead_of_background_when_full(self):
+        bulkhead = AsyncBulkhead(max_concurrent=1, max_queue=5, queue_timeout=5, auth_reserve=0,
+                                 background_share=1)
+        order = []
+
+        async def enter(priority, name):
+            await bulkhead.acquire(priority)
+            order.append(name)
+
+        async def scenario():
+            await bulkhead.acquire(INTERACTIVE)
+            background = asyncio.create_task(enter(BACKGROUND, 'background'))
+            await asyncio.sleep(0.01)
+            auth = asyncio.create_task(enter(AUTH, 'auth'))
+            await asyncio.sleep(0.01)
+            await bulkhead.release()
+            await auth
+            self.assertEqual(order, ['auth'])
+            await bulkhead.release()
+            await background
+
+        asyncio.run(scenario())
+        self.assertEqual(order, ['auth', 'background'])
+
+    def test_background_refresh_runs_with_background_priority(self):
+        refresher = BackgroundRefresher(max_workers=1)
+        seen = []
+        refresher.submit('key', lambda: seen.append(current_priority()))
+        refresher._get_executor().shutdown(wait=True)
+        self.assertEqual(seen, [BACKGROUND])
+
+
+def _directory_page(access_token, query, group, chunk):
+    """Страница /mobile/students: contains по uid, mail и имени, как в LDAP API"""
+    query = (query or '').lower()
+    records = [
+        record for record in DIRECTORY
+        if any(query in record[field].lower() for field in ('uid', 'mail', 'display_name'))
+        and (not group or record['department'] == group)
+    ]
+    skip, take = chunk
+    return True, {'data': records[skip:skip + take], 'count': len(records)}
+
+
+class SearchCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        search_cache.clear()
+        self.addCleanup(search_cache.clear)
+        for patcher in (mock.patch.object(ldap_service, 'directory_mirror', False),
+                        mock.patch.object(ldap_service, 'search_cache_ttl', 300)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _search(self, token, query, profile=(True, {'uid': 'nodir'}), **kwargs):
+        with mock.patch.object(ldap_service, 'get_user_profile', return_value=profile):
+            return ldap_service.search_students(token, query, **kwargs)
+
+    def test_result_is_shared_by_normalized_query(self):
+        with mock.patch.object(ldap_service, '_search_page', side_effect=_directory_page) as page:
+            first = self._search('token-a', 'Karim')
+            second = self._search('token-b', '  KARIM ')
+        self.assertEqual(page.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(len(first[1]['students']), 3)
+
+    def test_cached_result_requires_valid_token(self):
+        with mock.patch.object(ldap_service, '_search_page', side_effect=_directory_page):
+            self._search('token-a', 'karim')
+            success, result = self._search('expired', 'karim', profile=(False, {'error': 'HTTP 401'}))
+        self.assertFalse(success)
+        self.assertEqual(result['students'], [])
+
+    def test_cached_students_are_copies(self):
+        with mock.patch.object(ldap_service, '_search_page', side_effect=_directory_page):
+            self._search('token-a', 'karim')[1]['students'][0]['avatar'] = 'changed'
+            self.assertNotIn('avatar', self._search('token-a', 'karim')[1]['students'][0])
+
+    def test_failed_page_is_not_cached(self):
+        pages = [(True, {'data': DIRECTORY[:2], 'count': 4}), (False, {'error': 'HTTP 500'})]
+        with mock.patch.object(ldap_service, 'search_page_size', 2), \
+                mock.patch.object(ldap_service, '_search_page', side_effect=pages):
+            self._search('token-a', None, limit=4)
+        self.assertEqual(len(search_cache), 0)
+
+
+class TypeaheadSearchTests(SimpleTestCase):
+
+    def setUp(self):
+        for cache in (search_cache, typeahead_cache):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        for patcher in (mock.patch.object(ldap_service, 'directory_mirror', False),
+                        mock.patch.object(ldap_service, 'search_cache_ttl', 300),
+                        mock.patch.object(ldap_service, 'typeahead_min_chars', 2),
+                        mock.patch.object(ldap_service, 'get_user_profile', return_value=(True, {}))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _ids(self, query, **kwargs):
+        success, result = ldap_service.search_students('token', query, typeahead=True, **kwargs)
+        self.assertTrue(success)
+        return [student['id'] for student in result['students']]
+
+    def test_longer_query_is_refined_locally(self):
+        with mock.patch.object(ldap_service, '_search_page', side_effect=_directory_page) as page:
+            self.assertEqual(self._ids('ka'), ['karim.a', 'akarim', 'karim'])
+            self.assertEqual(self._ids('kari'), ['karim.a', 'akarim', 'karim'])
+            self.assertEqual(self._ids('Karim.'), ['karim.a'])
+            self.assertEqual(self._ids('kari', limit=1, offset=1), ['akarim'])
+            self.assertEqual(self._ids('nod'), ['nodir'])
+        # "ka" и "nod" - по одному запросу, остальное из полной выдачи "ka"
+        self.assertEqual(page.call_count, 2)
+
+    def test_incomplete_result_is_not_refined(self):
+        with mock.patch.object(ldap_service, 'typeahead_limit', 2), \
+                mock.patch.object(ldap_service, 'search_page_size', 2), \
+                mock.patch.object(ldap_service, '_search_page', side_effect=_directory_page) as page:
+            self.assertEqual(self._ids('ka', limit=2), ['karim.a', 'akarim'])
+            self.assertEqual(self._ids('kari', limit=2), ['karim.a', 'akarim'])
+        self.assertEqual(len(typeahead_cache), 0)
+        self.assertEqual(page.call_count, 2)
+
+
+class RawPayloadValidationTests(SimpleTestCase):
+
+    def test_truncated_body_is_rejected(self):
+        for body in (b'{"data": [', b'{"data": []', b'<html>502</html>'):
+            success, response = ldap_service._handle_response(_response(200, body), raw=True)
+            self.assertFalse(success)
+            self.assertEqual(response['error'], 'Invalid JSON response from LDAP server')
+
+    def test_valid_body_is_kept_raw_without_parsing(self):
+        with mock.patch('authentication.payload.json.loads') as loads:
+            success, response = ldap_service._handle_response(_response(200, b'\xef\xbb\xbf[{"id": 1}]\n'), raw=True)
+            self.assertEqual(response.wrap({'success': True}), b'{"success":true,"data":[{"id": 1}]\n}')
+        loads.assert_not_called()
+        self.assertTrue(success)
+        self.assertEqual(response.data, [{'id': 1}])
+
+    def test_invalid_json_inside_is_a_format_error_for_consumers(self):
+        success, payload = ldap_service._handle_response(_response(200, b'{"data": [oops]}'), raw=True)
+        self.assertTrue(success)
+        self.assertIsNone(course_entries(payload))
+        self.assertEqual(grades_summary(payload)['courses'], [])
+
+
+class VersionedResponseTests(SimpleTestCase):
+    body = b'{"data": [{"course_id": "1", "grade": 80}, {"course_id": "2", "grade": 90}]}'
+    changed = b'{"data": [{"course_id": "1", "grade": 85}, {"course_id": "3", "grade": 70}]}'
+
+    def _get(self, token, body, data=None, **extra):
+        with mock.patch.object(ldap_service, 'get_course_grades', return_value=(True, RawPayload(body))):
+            return self.client.get('/api/auth/grades/', data, HTTP_AUTHORIZATION=f'Bearer {token}', **extra)
+
+    def test_not_modified_for_current_version(self):
+        first = self._get('etag-token', self.body)
+        self.assertEqual(first.status_code, 200)
+        version = json.loads(first.content)['version']
+        self.assertEqual(first['ETag'], f'"{version}"')
+
+        second = self._get('etag-token', self.body, HTTP_IF_NONE_MATCH=f'"{version}"')
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b'')
+
+    def test_delta_since_previous_version(self):
+        version = json.loads(self._get('delta-token', self.body).content)['version']
+        response = json.loads(self._get('delta-token', self.changed, {'since': version}).content)
+        self.assertTrue(response['delta'])
+        self.assertEqual(response['data']['changed'], [
+            {'course_id': '1', 'grade': 85}, {'course_id': '3', 'grade': 70},
+        ])
+        self.assertEqual(response['data']['removed'], ['2'])
+
+    def test_unknown_since_returns_full_response(self):
+        response = json.loads(self._get('full-token', self.body, {'since': 'unknown'}).content)
+        self.assertNotIn('delta', response)
+        self.assertEqual(len(response['data']['data']), 2)
+
+    def test_summary_not_modified(self):
+        with mock.patch.object(ldap_service, 'get_course_grades', return_value=(True, RawPayload(self.body))):
+            first = self.client.get('/api/auth/grades/summary/', HTTP_AUTHORIZATION='Bearer summary-token')
+            second = self.client.get('/api/auth/grades/summary/', HTTP_AUTHORIZATION='Bearer summary-token',
+                                     HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(json.loads(first.content)['data']['overall']['gpa'], 85.0)
+        self.assertEqual(second.status_code, 304)
+
+
+class SummaryTests(SimpleTestCase):
+
+    def test_gpa_matches_app_formula(self):
+        # app/grades.tsx calculateGPA: Math.round((total / grades.length) * 100) / 100
+        grades = [{'course_id': 1, 'grade': 85}, {'course_id': 2, 'grade': '90.5'},
+                  {'course_id': 3, 'grade': 71}, {'course_id': 4}]
+        overall = grades_summary({'data': grades})['overall']
+        self.assertEqual(overall['gpa'], 61.63)
+        self.assertEqual(overall['average'], 82.17)
+        self.assertEqual(overall['graded'], 3)
+
+    def test_grade_takes_first_truthy_field(self):
+        # parseFloat(item.final_grade || item.grade || item.score || 0)
+        courses = grades_summary({'data': [
+            {'course_id': 1, 'final_grade': 0, 'grade': 75, 'score': 60},
+            {'course_id': 2, 'final_grade': '', 'score': 64},
+            {'course_id': 3, 'total_grade': 99},
+        ]})['courses']
+        self.assertEqual([course['grade'] for course in courses], [75, 64, 0])
+
+    def test_grade_parsed_like_parse_float(self):
+        summary = grades_summary({'data': [
+            {'course_id': 1, 'grade': '85abc'},
+            {'course_id': 2, 'grade': ' 7.5e1 '},
+        ]})
+        self.assertEqual([course['grade'] for course in summary['courses']], [85, 75])
+        self.assertEqual(summary['overall']['gpa'], 80)
+
+    def test_unparsable_grade_is_none(self):
+        # В приложении parseFloat('abc') дает NaN, и GPA тоже становится NaN
+        summary = grades_summary({'data': [
+            {'course_id': 1, 'grade': 'abc'}, {'course_id': 2, 'grade': 90},
+        ]})
+        self.assertIsNone(summary['courses'][0]['grade'])
+        self.assertIsNone(summary['overall']['gpa'])
+        self.assertEqual(summary['overall']['graded'], 1)
+
+    def test_gpa_rounds_half_up_like_math_round(self):
+        # round(0.125, 2) == 0.12, а Math.round(12.5) / 100 == 0.13
+        grades = [{'course_id': 1, 'grade': 0.125}]
+        self.assertEqual(grades_summary({'data': grades})['overall']['gpa'], 0.13)
+
+    def test_gpa_without_grades(self):
+        self.assertEqual(grades_summary({'data': []})['overall']['gpa'], 0)
+
+    def test_attendance_percent_by_lessons(self):
+        summary = attendance_summary({'data': [
+            {'course_id': 1, 'attended': 9, 'total': 10},
+            {'course_id': 2, 'absent': 5, 'total': 10},
+        ]})
+        self.assertEqual(summary['overall']['percent'], 70.0)
+        self.assertEqual(summary['overall']['lowest']['course_id'], 2)
+
+
+class PrefetchSchedulerTests(SimpleTestCase):
+
+    def test_slot_end_parses_schedule_time(self):
+        self.assertEqual(slot_end('09:00-10:30').strftime('%H:%M'), '10:30')
+        self.assertEqual(slot_end('13.00 - 14.20').strftime('%H:%M'), '14:20')
+        self.assertIsNone(slot_end('09:00-25:00'))
+        self.assertIsNone(slot_end(''))
+
+    def test_active_tokens_skip_background_requests(self):
+        tokens = ActiveTokens(maxsize=2)
+        tokens.touch('first')
+        with upstream_priority(BACKGROUND):
+            tokens.touch('background')
+        tokens.touch('second')
+        tokens.touch('third')
+        # LRU: первый вытеснен, недавние первыми
+        self.assertEqual(tokens.active(60), ['third', 'second'])
+        tokens.forget('third')
+        self.assertEqual(tokens.active(60), ['second'])
+
+    def test_next_window_is_lead_before_lesson_end(self):
+        scheduler = PrefetchScheduler(lead=120)
+        windows = [slot_end('09:00-10:30'), slot_end('10:40-12:10')]
+        with mock.patch.object(scheduler, 'windows', return_value=windows):
+            self.assertEqual(scheduler.next_window(datetime(2025, 9, 1, 10, 0)), datetime(2025, 9, 1, 10, 28))
+            self.assertEqual(scheduler.next_window(datetime(2025, 9, 1, 10, 29)), datetime(2025, 9, 1, 12, 8))
+            self.assertIsNone(scheduler.next_window(datetime(2025, 9, 1, 12, 9)))
+
+    def _run(self, scheduler, tokens, results):
+        calls = []
+
+        def fetch(access_token, refresh=False):
+            calls.append(access_token)
+            return results.get(access_token, (True, {}))
+
+        def submit(key, fn):
+            fn()
+            return True
+
+        with mock.patch('authentication.prefetch.active_tokens', tokens), \
+                mock.patch('authentication.prefetch.background_refresher.submit', side_effect=submit), \
+                mock.patch.object(ldap_service, 'get_course_grades', side_effect=fetch):
+            return scheduler.run_once(), calls
+
+    def test_run_once_respects_budget(self):
+        tokens = ActiveTokens()
+        for access_token in ('a', 'b', 'c'):
+            tokens.touch(access_token)
+        scheduler = PrefetchScheduler(datasets=('grades',), rate=0, budget=2)
+        submitted, calls = self._run(scheduler, tokens, {})
+        self.assertEqual(submitted, 2)
+        self.assertEqual(calls, ['c', 'b'])
+        self.assertEqual(scheduler.stats()['submitted'], 2)
+
+    def test_unauthorized_token_is_forgotten(self):
+        tokens = ActiveTokens()
+        tokens.touch('expired')
+        tokens.touch('valid')
+        scheduler = PrefetchScheduler(datasets=('grades',), rate=0)
+        self._run(scheduler, tokens, {'expired': (False, {'error': 'Unauthorized'})})
+        self.assertEqual(tokens.active(60), ['valid'])
+        self.assertEqual(scheduler.stats()['unauthorized'], 1)
+
+
+@override_settings(LDAP_INBOX_MIRROR=True)
+class InboxTests(TestCase):
+
+    def setUp(self):
+        self.messages = [{'id': i, 'is_read': i % 2 == 0} for i in range(1, 6)]
+        inbox = MessageInbox(interval=3600, page_size=2)
+        patchers = [
+            mock.patch('authentication.views.message_inbox', inbox),
+            mock.patch('authentication.inbox.resolve_identity', return_value={'username': 'u1'}),
+            mock.patch.object(ldap_service, 'get_messages',
+                              side_effect=lambda *args, **kwargs: (True, {'data': list(self.messages)})),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _read(self, query='', **extra):
+        response = self.client.post(f'/api/auth/messages/{query}', HTTP_AUTHORIZATION='Bearer inbox-token', **extra)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)['data']
+
+    def _ids(self, page):
+        return [message['id'] for message in page['data']]
+
+    def test_pages_are_newest_first(self):
+        first = self._read()
+        self.assertEqual(self._ids(first), [5, 4])
+        self.assertTrue(first['has_more'])
+        self.assertEqual(first['unread_count'], 3)
+
+        second = self._read(f'?before={first["next_before"]}')
+        self.assertEqual(self._ids(second), [3, 2])
+        third = self._read(f'?before={second["next_before"]}')
+        self.assertEqual(self._ids(third), [1])
+        self.assertFalse(third['has_more'])
+        self.assertIsNone(third['next_before'])
+
+    def test_since_returns_only_new_messages(self):
+        cursor = self._read()['cursor']
+        self.messages += [{'id': 6, 'is_read': False}, {'id': 7, 'is_read': False}]
+        page = self._read(f'?since={cursor}&refresh=1')
+        self.assertEqual(self._ids(page), [7, 6])
+        self.assertGreater(page['cursor'], cursor)
+        self.assertEqual(self._read(f'?since={page["cursor"]}')['data'], [])
+
+    def test_cursor_in_non_object_body_is_ignored(self):
+        page = self._read(data='[1, 2]', content_type='application/json')
+        self.assertEqual(self._ids(page), [5, 4])
+
+    def test_message_without_id_keeps_hash_when_read(self):
+        message = {'title': 'Расписание', 'text': 'Пара перенесена', 'is_read': False}
+        self.assertEqual(message_id(message), message_id({**message, 'is_read': True}))
+        self.assertNotEqual(message_id(message), message_id({**message, 'text': 'Пара отменена'}))
+
+    def test_fallback_pages_and_advances_cursor(self):
+        with mock.patch('authentication.inbox.resolve_identity', return_value=None):
+            first = self._read()
+            self.assertEqual(set(first), {'data', 'count', 'unread_count', 'cursor', 'has_more',
+                                          'next_before', 'synced_at'})
+            self.assertEqual(self._ids(first), [5, 4])
+            self.assertEqual(first['unread_count'], 3)
+            second = self._read(f'?before={first["next_before"]}')
+            self.assertEqual(self._ids(second), [3, 2])
+
+            self.messages.append({'id': 6, 'is_read': False})
+            new = self._read(f'?since={first["cursor"]}')
+            self.assertEqual(self._ids(new), [6])
+            self.assertNotEqual(new['cursor'], first['cursor'])
+            self.assertEqual(self._read(f'?since={new["cursor"]}')['data'], [])
+
+        # Курсор ответа без копии копия не понимает - отдает первую страницу
+        self.assertEqual(self._ids(self._read(f'?since={new["cursor"]}')), [6, 5])
@@ -0,0 +1,291 @@
+"""
+Трассировка запросов к LDAP API
+
+Каждый запрос к LDAP API записывается (UpstreamTrace): endpoint, статус,
+размер ответа, фазы (DNS, TCP connect, TLS, ожидание ответа, передача тела)
+и request ID входящего запроса, который также уходит в LDAP API заголовком
+X-Request-ID. По каждому endpoint'у в памяти процесса копится гистограмма
+длительностей с фиксированными границами корзин.
+
+Фазы соединения замеряют соединения http_pool (requests) и trace extension
+httpx (async). У httpx DNS входит в connect.
+"""
+
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Request ID входящего запроса (ставит RequestIDMiddleware)
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# Трасса выполняемого сейчас запроса к LDAP API
+current_trace = contextvars.ContextVar('upstream_trace', default=None)
+
+PHASES = ('dns', 'connect', 'tls', 'wait', 'transfer')
+
+# Верхние границы корзин гистограммы (мс), последняя корзина - все, что дольше
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+def get_request_id() -> Optional[str]:
+    return request_id_var.get()
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def propagate(fn):
+    """
+    Обертка для запуска fn в другом потоке (executor) с contextvars
+    вызывающего кода (request ID). Каждый вызов получает свою копию контекста.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+class UpstreamTrace:
+    """Один запрос к LDAP API; фазы в секундах"""
+
+    __slots__ = ('endpoint', 'method', 'request_id', 'status', 'bytes', 'error',
+                 'dns', 'connect', 'tls', 'wait', 'transfer', 'total',
+                 'started_at', '_started', '_headers_at', '_phase_started')
+
+    def __init__(self, endpoint: str, method: str, request_id: Optional[str] = None):
+        self.endpoint = endpoint
+        self.method = method
+        self.request_id = request_id
+        self.status = None
+        self.bytes = 0
+        self.error = None
+        self.dns = self.connect = self.tls = 0.0
+        self.wait = self.transfer = self.total = 0.0
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._headers_at = None
+        self._phase_started = {}
+
+    @contextmanager
+    def active(self):
+        """Делает трассу текущей (ее заполняют соединения пула)"""
+        token = current_trace.set(self)
+        try:
+            yield self
+        finally:
+            current_trace.reset(token)
+
+    def add_phase(self, phase: str, seconds: float):
+        setattr(self, phase, getattr(self, phase) + seconds)
+
+    def headers_received(self):
+        if self._headers_at is None:
+            self._headers_at = time.perf_counter()
+
+    def set_response(self, status: int, size: Optional[int] = None):
+        self.status = status
+        if size is not None:
+            self.bytes = size
+
+    def fail(self, error: BaseException):
+        self.error = type(error).__name__
+
+    def close(self):
+        now = time.perf_counter()
+        self.total = now - self._started
+        setup = self.dns + self.connect + self.tls
+        if self._headers_at is None:
+            self.wait = max(0.0, self.total - setup)
+        else:
+            self.wait = max(0.0, self._headers_at - self._started - setup)
+            self.transfer = now - self._headers_at
+
+    async def httpx_hook(self, event_name: str, info: Dict):
+        """trace extension httpx: замер фаз соединения async клиента"""
+        if event_name.endswith('.started'):
+            self._phase_started[event_name[:-8]] = time.perf_counter()
+            return
+        if not event_name.endswith('.complete'):
+            return
+        name = event_name[:-9]
+        started = self._phase_started.pop(name, None)
+        if name == 'connection.connect_tcp' and started is not None:
+            self.connect += time.perf_counter() - started
+        elif name == 'connection.start_tls' and started is not None:
+            self.tls += time.perf_counter() - started
+        elif name.endswith('.receive_response_headers'):
+            self.headers_received()
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = {
+            'endpoint': self.endpoint,
+            'method': self.method,
+            'request_id': self.request_id,
+            'status': self.status,
+            'bytes': self.bytes,
+            'error': self.error,
+            'started_at': self.started_at,
+            'total_ms': _ms(self.total),
+        }
+        for phase in PHASES:
+            data[f'{phase}_ms'] = _ms(getattr(self, phase))
+        return data
+
+
+class EndpointHistogram:
+    """Гистограмма длительностей и суммы фаз одного endpoint'а"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.statuses: Dict[str, int] = {}
+        self.bytes = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.phases_ms = dict.fromkeys(PHASES, 0.0)
+
+    def add(self, trace: UpstreamTrace):
+        total_ms = trace.total * 1000
+        index = len(BUCKETS)
+        for i, bound in enumerate(BUCKETS):
+            if total_ms <= bound:
+                index = i
+                break
+        self.buckets[index] += 1
+        self.count += 1
+        status = str(trace.status) if trace.status is not None else (trace.error or 'error')
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if trace.error or (trace.status or 0) >= 500:
+            self.errors += 1
+        self.bytes += trace.bytes
+        self.total_ms += total_ms
+        self.max_ms = max(self.max_ms, total_ms)
+        for phase in PHASES:
+            self.phases_ms[phase] += getattr(trace, phase) * 1000
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Оценка перцентиля - верхняя граница корзины (мс)"""
+        if not self.count:
+            return None
+        threshold = p / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= threshold and count:
+                return BUCKETS[i] if i < len(BUCKETS) else round(self.max_ms, 2)
+        return round(self.max_ms, 2)
+
+    def snapshot(self) -> Dict[str, Any]:
+        count = self.count or 1
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'statuses': dict(self.statuses),
+            'bytes': self.bytes,
+            'mean_ms': round(self.total_ms / count, 2),
+            'max_ms': round(self.max_ms, 2),
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'phases_mean_ms': {phase: round(total / count, 2) for phase, total in self.phases_ms.items()},
+            'buckets': {
+                (f'le_{BUCKETS[i]}' if i < len(BUCKETS) else 'inf'): count
+                for i, count in enumerate(self.buckets)
+            },
+        }
+
+
+class UpstreamTracer:
+    """
+    Гистограммы по endpoint'ам и последние трассы текущего процесса
+
+    Args:
+        recent: сколько последних трасс хранить
+    """
+
+    def __init__(self, recent: int = 500):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, EndpointHistogram] = {}
+        self._recent = deque(maxlen=recent)
+
+    def start(self, endpoint: str, method: str) -> UpstreamTrace:
+        return UpstreamTrace(endpoint, method.upper(), get_request_id())
+
+    @contextmanager
+    def trace(self, endpoint: str, method: str):
+        """Трасса запроса: записывается при выходе из блока"""
+        trace = self.start(endpoint, method)
+        try:
+            with trace.active():
+                yield trace
+        except BaseException as e:
+            trace.fail(e)
+            raise
+        finally:
+            self.record(trace)
+
+    def record(self, trace: UpstreamTrace):
+        trace.close()
+        with self._lock:
+            histogram = self._histograms.get(trace.endpoint)
+            if histogram is None:
+                histogram = self._histograms[trace.endpoint] = EndpointHistogram()
+            histogram.add(trace)
+            self._recent.append(trace)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                f"LDAP {trace.method} {trace.endpoint} {trace.status or trace.error} "
+                f"{trace.bytes}B {_ms(trace.total)}ms "
+                f"(dns {_ms(trace.dns)}, connect {_ms(trace.connect)}, tls {_ms(trace.tls)}, "
+                f"wait {_ms(trace.wait)}, transfer {_ms(trace.transfer)}) "
+                f"request_id={trace.request_id}"
+            )
+
+    def histograms(self, endpoint: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                name: histogram.snapshot()
+                for name, histogram in self._histograms.items()
+                if endpoint is None or name == endpoint
+            }
+
+    def recent(self, endpoint: Optional[str] = None, request_id: Optional[str] = None,
+               limit: int = 50) -> List[Dict[str, Any]]:
+        """Последние трассы (новые первыми) с фильтром по endpoint'у и request ID"""
+        with self._lock:
+            traces = list(self._recent)
+        result = []
+        for trace in reversed(traces):
+            if endpoint is not None and trace.endpoint != endpoint:
+                continue
+            if request_id is not None and trace.request_id != request_id:
+                continue
+            result.append(trace.as_dict())
+            if len(result) >= limit:
+                break
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._recent.clear()
+
+
+upstream_tracer = UpstreamTracer(recent=getattr(settings, 'LDAP_TRACE_RECENT', 500))
@@ -3,53 +3,72 @@ LDAP Authentication URLs
 Все маршруты для работы с LDAP API
 """
 
+from django.conf import settings
 from django.urls import path
 from . import views
 from .student_search import search_students
 
+# Под ASGI прокси endpoints обслуживаются асинхронными views
+if getattr(settings, 'LDAP_ASYNC_VIEWS', False):
+    from . import async_views as proxy_views
+    search_students_view = proxy_views.search_students
+else:
+    proxy_views = views
+    search_students_view = search_students
+
 urlpatterns = [
     # Тестовый endpoint
     path('test/', views.test_api, name='ldap_test'),
     
+    # Состояние подключения к LDAP API (пул соединений) и трассы запросов
+    path('upstream/status/', views.upstream_status, name='ldap_upstream_status'),
+    path('upstream/status', views.upstream_status, name='ldap_upstream_status_no_slash'),
+    path('upstream/traces/', views.upstream_traces, name='ldap_upstream_traces'),
+    path('upstream/traces', views.upstream_traces, name='ldap_upstream_traces_no_slash'),
+    
     # LDAP авторизация
-    path('login/', views.ldap_login, name='ldap_login'),
-    path('login', views.ldap_login, name='ldap_login_no_slash'),
+    path('login/', proxy_views.ldap_login, name='ldap_login'),
+    path('login', proxy_views.ldap_login, name='ldap_login_no_slash'),
     
     # Обновление токена
-    path('refresh/', views.ldap_refresh_token, name='ldap_refresh'),
-    path('refresh', views.ldap_refresh_token, name='ldap_refresh_no_slash'),
+    path('refresh/', proxy_views.ldap_refresh_token, name='ldap_refresh'),
+    path('refresh', proxy_views.ldap_refresh_token, name='ldap_refresh_no_slash'),
     
     # Профиль пользователя из LDAP
-    path('profile/', views.ldap_get_user_profile, name='ldap_profile'),
-    path('profile', views.ldap_get_user_profile, name='ldap_profile_no_slash'),
-    path('me/', views.ldap_get_user_profile, name='ldap_me'),  # Alias для совместимости
-    path('me', views.ldap_get_user_profile, name='ldap_me_no_slash'),
+    path('profile/', proxy_views.ldap_get_user_profile, name='ldap_profile'),
+    path('profile', proxy_views.ldap_get_user_profile, name='ldap_profile_no_slash'),
+    path('me/', proxy_views.ldap_get_user_profile, name='ldap_me'),  # Alias для совместимости
+    path('me', proxy_views.ldap_get_user_profile, name='ldap_me_no_slash'),
     
     # Курсы из LDAP
-    path('courses/', views.ldap_get_active_courses, name='ldap_courses'),
-    path('courses', views.ldap_get_active_courses, name='ldap_courses_no_slash'),
+    path('courses/', proxy_views.ldap_get_active_courses, name='ldap_courses'),
+    path('courses', proxy_views.ldap_get_active_courses, name='ldap_courses_no_slash'),
     
     # Оценки из LDAP
-    path('grades/', views.ldap_get_course_grades, name='ldap_grades'),
-    path('grades', views.ldap_get_course_grades, name='ldap_grades_no_slash'),
+    path('grades/', proxy_views.ldap_get_course_grades, name='ldap_grades'),
+    path('grades', proxy_views.ldap_get_course_grades, name='ldap_grades_no_slash'),
+    path('grades/summary/', proxy_views.ldap_get_grades_summary, name='ldap_grades_summary'),
+    path('grades/summary', proxy_views.ldap_get_grades_summary, name='ldap_grades_summary_no_slash'),
     
     # Посещаемость из LDAP
-    path('attendance/', views.ldap_get_course_attendance, name='ldap_attendance'),
-    path('attendance', views.ldap_get_course_attendance, name='ldap_attendance_no_slash'),
+    path('attendance/', proxy_views.ldap_get_course_attendance, name='ldap_attendance'),
+    path('attendance', proxy_views.ldap_get_course_attendance, name='ldap_attendance_no_slash'),
+    path('attendance/summary/', proxy_views.ldap_get_attendance_summary, name='ldap_attendance_summary'),
+    path('attendance/summary', proxy_views.ldap_get_attendance_summary, name='ldap_attendance_summary_no_slash'),
     
     # Сообщения из LDAP
-    path('messages/', views.ldap_get_messages, name='ldap_messages'),
-    path('messages', views.ldap_get_messages, name='ldap_messages_no_slash'),
+    path('messages/', proxy_views.ldap_get_messages, name='ldap_messages'),
+    path('messages', proxy_views.ldap_get_messages, name='ldap_messages_no_slash'),
     
     # Загрузка изображения в LDAP
-    path('upload/', views.ldap_upload_image, name='ldap_upload'),
-    path('upload', views.ldap_upload_image, name='ldap_upload_no_slash'),
+    path('upload/', proxy_views.ldap_upload_image, name='ldap_upload'),
+    path('upload', proxy_views.ldap_upload_image, name='ldap_upload_no_slash'),
     
     # Заглушка для logout (LDAP не требует серверного logout)
     path('logout/', views.test_api, name='ldap_logout'),
     path('logout', views.test_api, name='ldap_logout_no_slash'),
     
     # Поиск студентов через LDAP
-    path('search/students/', search_students, name='search_students'),
-    path('search/students', search_students, name='search_students_no_slash'),
+    path('search/students/', search_students_view, name='search_students'),
+    path('search/students', search_students_view, name='search_students_no_slash'),
 ]
\ No newline at end of file
@@ -0,0 +1,140 @@
+"""
+Версии ответов LDAP API (ETag / 304 / дельты)
+
+Для оценок и посещаемости по каждому токену (по хэшу) хранятся несколько
+последних версий ответа. Версия - хэш содержимого ответа; клиент присылает ее
+в If-None-Match (ответ 304 без тела, если данные не изменились) или в
+?since=<версия> - тогда возвращаются только добавленные/измененные курсы и
+идентификаторы удаленных.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+from .cache import payload_versions, token_hash
+from .payload import RawPayload
+
+# Поля, по которым определяется запись курса
+ENTRY_ID_FIELDS = ('course_id', 'id')
+
+
+def payload_digest(payload: Any) -> str:
+    """Версия ответа: хэш исходных байт или канонического JSON"""
+    if isinstance(payload, RawPayload):
+        return payload.digest
+    body = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.blake2b(body.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def course_entries(payload: Any) -> Optional[List[Dict]]:
+    """Список записей курсов ответа ({"data": [...]} или [...]); None - формат неизвестен"""
+    try:
+        data = payload.data if isinstance(payload, RawPayload) else payload
+    except ValueError:
+        return None
+    if isinstance(data, dict):
+        data = data.get('data')
+    if not isinstance(data, list) or not all(isinstance(entry, dict) for entry in data):
+        return None
+    return data
+
+
+def _entry_id(entry: Dict) -> Optional[str]:
+    for field in ENTRY_ID_FIELDS:
+        if entry.get(field) is not None:
+            return str(entry[field])
+    return None
+
+
+def _index(payload: Any) -> Optional[Dict[str, Dict]]:
+    """{id курса: запись}; None, если записи нельзя сопоставить по id"""
+    entries = course_entries(payload)
+    if entries is None:
+        return None
+    index = {}
+    for entry in entries:
+        entry_id = _entry_id(entry)
+        if entry_id is None:
+            return None
+        index[entry_id] = entry
+    return index
+
+
+class PayloadVersions:
+    """
+    Последние версии ответов по (endpoint, хэш токена)
+
+    Args:
+        keep: сколько версий хранить на токен (дельта возможна от любой из них)
+        ttl: сколько хранить версии после последнего ответа (сек)
+    """
+
+    def __init__(self, keep: int = 3, ttl: int = 86400):
+        self.keep = keep
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.not_modified = 0
+        self.deltas = 0
+        self.full = 0
+
+    def _key(self, name: str, access_token: str) -> tuple:
+        return (name, token_hash(access_token))
+
+    def remember(self, name: str, access_token: str, payload: Any) -> str:
+        """Запоминает ответ как текущую версию и возвращает ее"""
+        version = payload_digest(payload)
+        key = self._key(name, access_token)
+        with self._lock:
+            history = payload_versions.get(key)
+            history = OrderedDict(history or ())
+            history.pop(version, None)
+            history[version] = payload
+            while len(history) > self.keep:
+                history.popitem(last=False)
+            payload_versions.set(key, history, self.ttl)
+        return version
+
+    def delta(self, name: str, access_token: str, since: str, payload: Any) -> Optional[Dict[str, Any]]:
+        """
+        Изменения payload относительно версии since
+
+        Returns:
+            {'changed': [записи], 'removed': [id]} или None, если версия since
+            неизвестна или записи нельзя сопоставить - тогда нужен полный ответ
+        """
+        history = payload_versions.get(self._key(name, access_token))
+        base = history.get(since) if history else None
+        if base is None:
+            return None
+        base_index = _index(base)
+        current_index = _index(payload)
+        if base_index is None or current_index is None:
+            return None
+
+        changed = [
+            entry for entry_id, entry in current_index.items()
+            if base_index.get(entry_id) != entry
+        ]
+        removed = [entry_id for entry_id in base_index if entry_id not in current_index]
+        return {'changed': changed, 'removed': removed}
+
+    def count(self, outcome: str):
+        """Счетчик ответов: not_modified | deltas | full"""
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = payload_versions.stats()
+        stats.update(keep=self.keep, not_modified=self.not_modified, deltas=self.deltas, full=self.full)
+        return stats
+
+
+versions = PayloadVersions(
+    keep=getattr(settings, 'LDAP_VERSIONS_KEEP', 3),
+    ttl=getattr(settings, 'LDAP_VERSIONS_TTL', 86400),
+)
@@ -3,18 +3,146 @@ LDAP Authentication Views
 Все методы авторизации работают через внешний LDAP API
 """
 
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from .ldap_service import ldap_service
+from .cache import bypass_requested, response_age
+from .circuit_breaker import circuit_breakers
+from .tracing import upstream_tracer
+from .payload import RawPayload
+from .versions import versions
+from .inbox import message_inbox, parse_cursor
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _raw_response(payload, raw: RawPayload) -> HttpResponse:
+    """Ответ с телом LDAP API как есть: байты вставляются в конверт без разбора JSON"""
+    return HttpResponse(raw.wrap(payload), content_type='application/json')
+
+
+def _success_response(ldap_response, **fields):
+    """
+    Успешный ответ прокси (fields - дополнительные поля конверта)
+    Если сервис отдал устаревшие данные (stale-while-revalidate), добавляет
+    stale/age в тело и заголовок Age
+    """
+    payload = {
+        'success': True,
+        **fields,
+    }
+    
+    age = response_age()
+    if age is not None:
+        payload['stale'] = True
+        payload['age'] = age
+    
+    if isinstance(ldap_response, RawPayload):
+        response = _raw_response(payload, ldap_response)
+    else:
+        payload['data'] = ldap_response
+        response = Response(payload, status=status.HTTP_200_OK)
+    if age is not None:
+        response['Age'] = str(age)
+    return response
+
+
+def _etag_matches(request, version: str) -> bool:
+    """If-None-Match содержит текущую версию (или *)"""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag.strip('"') == version:
+            return True
+    return False
+
+
+def _versioned_response(request, name, access_token, ldap_response, respond=_success_response):
+    """
+    Успешный ответ с версией (оценки, посещаемость)
+
+    - If-None-Match с текущей версией - 304 без тела
+    - ?since=<версия> - только изменения: data = {'changed': [...], 'removed': [...]}
+    - иначе полный ответ; версия в поле version и заголовке ETag
+    """
+    version = versions.remember(name, access_token, ldap_response)
+    
+    if _etag_matches(request, version):
+        versions.count('not_modified')
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        since = request.GET.get('since')
+        delta = versions.delta(name, access_token, since, ldap_response) if since else None
+        if delta is not None:
+            versions.count('deltas')
+            response = respond(delta, version=version, since=since, delta=True)
+        else:
+            versions.count('full')
+            response = respond(ldap_response, version=version)
+    
+    response['ETag'] = f'"{version}"'
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _summary_response(request, summary, respond=_success_response):
+    """Ответ со сводкой; 304, если версия исходного ответа не изменилась"""
+    version = summary['version']
+    if _etag_matches(request, version):
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = respond(summary)
+    response['ETag'] = f'"{version}"'
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _unavailable_response(ldap_response):
+    """
+    503 + Retry-After, если запрос отклонен без обращения к LDAP API
+    (circuit breaker endpoint'а открыт)
+    """
+    if not isinstance(ldap_response, dict) or 'retry_after' not in ldap_response:
+        return None
+    
+    response = Response({
+        'success': False,
+        'error': ldap_response.get('error', 'LDAP сервис временно недоступен')
+    }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = str(ldap_response['retry_after'])
+    return response
+
+
+def _upload_exceeds_limit(request) -> bool:
+    """
+    Ранняя проверка размера загрузки по Content-Length - до разбора multipart,
+    чтобы не принимать заведомо слишком большой файл
+    """
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return False
+    # Запас на заголовки multipart
+    return content_length > ldap_service.upload_max_size + 64 * 1024
+
+
+def _upload_too_large_error():
+    return {
+        'success': False,
+        'error': f'Файл больше {ldap_service.upload_max_size // (1024 * 1024)} МБ'
+    }
+
+
 @csrf_exempt
 def test_api(request):
     """Простая тестовая функция для проверки работы API"""
@@ -25,6 +153,76 @@ def test_api(request):
     })
 
 
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def upstream_status(request):
+    """
+    Состояние подключения к LDAP API в текущем воркере (только для staff:
+    хосты, состояние circuit breakers и кэшей - внутренние данные)
+    
+    Response:
+    {
+        "success": true,
+        "data": {
+            "pool": {"pid": 1234, "hosts": {"my.tiue.uz": {...}}},
+            "cache": {"size": 10, "hits": 42, ...},
+            "circuits": {"/mobile/course-grades-list": {"state": "closed", ...}},
+            "latency": {"endpoints": {...: {"p95": 0.4, "read_timeout": 2.1}}, "retry_budget": {...}}
+        }
+    }
+    """
+    return Response({
+        'success': True,
+        'data': {
+            'pool': ldap_service.get_pool_stats(),
+            'cache': ldap_service.get_cache_stats(),
+            'circuits': circuit_breakers.snapshot(),
+            'latency': ldap_service.get_latency_stats(),
+        }
+    }, status=status.HTTP_200_OK)
+
+
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def upstream_traces(request):
+    """
+    Трассы и гистограммы задержек запросов к LDAP API в текущем воркере (только для staff)
+    
+    Query params:
+        endpoint: только этот endpoint LDAP API (например /mobile/profile)
+        request_id: только запросы к LDAP API из входящего запроса с этим X-Request-ID
+        limit: сколько последних трасс вернуть (по умолчанию 50, максимум 500)
+    
+    Response:
+    {
+        "success": true,
+        "data": {
+            "histograms": {"/mobile/profile": {"count": 10, "p95_ms": 250, "buckets": {...}, ...}},
+            "recent": [{"endpoint": "/mobile/profile", "status": 200, "dns_ms": 0.0, ...}]
+        }
+    }
+    """
+    endpoint = request.GET.get('endpoint') or None
+    request_id = request.GET.get('request_id') or None
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 50)), 500))
+    except ValueError:
+        return Response({
+            'success': False,
+            'error': 'limit must be an integer'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'success': True,
+        'data': {
+            'histograms': upstream_tracer.histograms(endpoint),
+            'recent': upstream_tracer.recent(endpoint, request_id, limit),
+        }
+    }, status=status.HTTP_200_OK)
+
+
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -67,6 +265,10 @@ def ldap_login(request):
         
         # Проверяем, что в ответе есть необходимые токены
         if 'access_token' in ldap_response and 'refresh_token' in ldap_response:
+            # Фоновая загрузка курсов/оценок/посещаемости/сообщений в кэш
+            if ldap_service.login_warmup:
+                ldap_service.warm_up_user(ldap_response['access_token'])
+            
             # Получаем профиль пользователя
             profile_success, profile_data = ldap_service.get_user_profile(ldap_response['access_token'])
             
@@ -103,6 +305,10 @@ def ldap_login(request):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     else:
         logger.warning(f"LDAP login failed for user: {username}")
+        unavailable = _unavailable_response(ldap_response)
+        if unavailable:
+            return unavailable
+        
         error_message = ldap_response.get('error', 'Неверное имя пользователя или пароль')
         
         # Определяем статус ответа на основе ошибки
@@ -173,6 +379,10 @@ def ldap_refresh_token(request):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     else:
         logger.warning("LDAP token refresh failed")
+        unavailable = _unavailable_response(ldap_response)
+        if unavailable:
+            return unavailable
+        
         error_message = ldap_response.get('error', 'Не удалось обновить токен')
         return Response({
             'success': False,
@@ -190,6 +400,7 @@ def ldap_get_user_profile(request):
     
     Headers:
     Authorization: Bearer <access_token>
+    Cache-Control: no-cache (опционально, минуя кэш)
     
     Response:
     {
@@ -214,15 +425,18 @@ def ldap_get_user_profile(request):
     access_token = auth_header.split(' ')[1]
     
     # Получаем профиль через LDAP
-    success, ldap_response = ldap_service.get_user_profile(access_token)
+    success, ldap_response = ldap_service.get_user_profile(
+        access_token, refresh=bypass_requested(request)
+    )
     
     if success:
-        return Response({
-            'success': True,
-            'data': ldap_response
-        }, status=status.HTTP_200_OK)
+        return _success_response(ldap_response)
     else:
         logger.warning("LDAP user profile retrieval failed")
+        unavailable = _unavailable_response(ldap_response)
+        if unavailable:
+            return unavailable
+        
         error_message = ldap_response.get('error', 'Не удалось получить профиль')
         
         # Если токен невалиден, возвращаем 401
@@ -252,6 +466,7 @@ def ldap_get_active_courses(request):
     - lang: en|ru (default: en)
     - page: номер страницы (default: 1)
     - pageSize: размер страницы (default: 10)
+    - refresh: 1 - получить свежие данные, минуя кэш
     
     Response:
     {
@@ -286,16 +501,17 @@ def ldap_get_active_courses(request):
     
     # Получаем курсы через LDAP
     success, ldap_response = ldap_service.get_active_courses(
-        access_token, lang, page, page_size
+        access_token, lang, page, page_size, refresh=bypass_requested(request)
     )
     
     if success:
-        return Response({
-            'success': True,
-            'data': ldap_response
-        }, status=status.HTTP_200_OK)
+        return _success_response(ldap_response)
     else:
         logger.warning("LDAP active courses retrieval failed")
+        unavailable = _unavailable_response(ldap_response)
+        if unavailable:
+            return unavailable
+        
         error_message = ldap_response.get('error', 'Не удалось получить курсы')
         
         if 'unauthorized' in error_message.lower():
@@ -316,6 +532,10 @@ def ldap_get_course_grades(request):
     """
     Получение оценок по курсам из LDAP
     Требует Bearer токен в заголовке Authorization
+    
+    Ответ содержит version (и заголовок ETag):
+    - If-None-Match: "<version>" - 304, если оценки не изменились
+    - ?since=<version> - только добавленные/измененные курсы и id удаленных
     """
     auth_header = request.META.get('HTTP_AUTHORIZATION')
     
@@ -327,15 +547,18 @@ def ldap_get_course_grades(request):
     
     access_token = auth_header.split(' ')[1]
     
-    success, ldap_response = ldap_service.get_course_grades(access_token)
+    success, ldap_response = ldap_service.get_course_grades(
+        access_token, refresh=bypass_requested(request)
+    )
     
     if success:
-        return Response({
-            'success': True,
-            'data': ldap_response
-        }, status=status.HTTP_200_OK)
+        return _versioned_response(request, 'grades', access_token, ldap_response)
     else:
         logger.warning("LDAP course grades retrieval failed")
+        unavailable = _unavailable_response(ldap_response)
+        if unavailable:
+            return unavailable
+        
         error_message = ldap_response.get('error', 'Не удалось получить оценки')
         
         if 'unauthorized' in error_message.lower():
@@ -356,6 +579,8 @@ def ldap_get_course_attendance(request):
     """
     Получение данных о посещаемости из LDAP
     Требует Bearer токен в заголовке Authorization
+    
+    Версии, If-None-Match и ?since= - как у оценок
     """
     auth_header = request.META.get('HTTP_AUTHORIZATION')
     
@@ -367,15 +592,18 @@ def ldap_get_course_attendance(request):
     
     access_token = auth_header.split(' ')[1]
     
-    success, ldap_response = ldap_service.get_course_attendance(access_token)
+    success, ldap_response = ldap_service.get_course_attendance(
+        access_token, refresh=bypass_requested(request)
+    )
     
     if success:
-        return Response({
-            'success': True,
-            'data': ldap_response
-        }, status=status.HTTP_200_OK)
+        return _versioned_response(request, 'attendance', access_token, ldap_response)
     else:
         logger.warning("LDAP course attendance retrieval failed")
+        unavailable = _unavailable_response(ldap_response)
+        if unavailable:
+            return unavailable
+        
         error_message = ldap_response.get('error', 'Не удалось получить данные о посещаемости')
         
         if 'unauthorized' in error_message.lower():
@@ -389,6 +617,76 @@ def ldap_get_course_attendance(request):
         }, status=response_status)
 
 
+def _summary_view(request, name, default_error):
+    """Сводка оценок/посещаемости; ETag - версия исходного ответа"""
+    auth_header = request.META.get('HTTP_AUTHORIZATION')
+    
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return Response({
+            'success': False,
+            'error': 'Bearer токен обязателен'
+        }, status=status.HTTP_401_UNAUTHORIZED)
+    
+    access_token = auth_header.split(' ')[1]
+    
+    success, ldap_response = ldap_service.get_summary(
+        name, access_token, refresh=bypass_requested(request)
+    )
+    
+    if success:
+        return _summary_response(request, ldap_response)
+    else:
+        logger.warning(f"LDAP {name} summary failed")
+        unavailable = _unavailable_response(ldap_response)
+        if unavailable:
+            return unavailable
+        
+        error_message = ldap_response.get('error', default_error)
+        
+        if 'unauthorized' in error_message.lower():
+            response_status = status.HTTP_401_UNAUTHORIZED
+        else:
+            response_status = status.HTTP_500_INTERNAL_SERVER_ERROR
+            
+        return Response({
+            'success': False,
+            'error': error_message
+        }, status=response_status)
+
+
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def ldap_get_grades_summary(request):
+    """
+    Сводка оценок: оценка по каждому курсу, средний балл, минимум/максимум и GPA
+    (как calculateGPA приложения: среднее по всем курсам, курс без оценки - 0)
+    Считается на сервере из (кэшированного) ответа LDAP API
+    
+    Response:
+    {
+        "success": true,
+        "data": {
+            "courses": [{"course_id": "107", "course_name": "...", "grade": 85.0}, ...],
+            "overall": {"courses": 8, "graded": 7, "average": 81.4, "min": 60.0, "max": 95.0, "gpa": 71.23},
+            "version": "<версия ответа оценок>"
+        }
+    }
+    """
+    return _summary_view(request, 'grades', 'Не удалось получить оценки')
+
+
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def ldap_get_attendance_summary(request):
+    """
+    Сводка посещаемости: посещено/всего/процент по каждому курсу и в целом,
+    курс с самой низкой посещаемостью (overall.lowest)
+    """
+    return _summary_view(request, 'attendance', 'Не удалось получить данные о посещаемости')
+
+
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -396,6 +694,26 @@ def ldap_get_messages(request):
     """
     Получение сообщений из LDAP
     Требует Bearer токен в заголовке Authorization
+    
+    При LDAP_INBOX_MIRROR сообщения отдаются из локальной копии (см. inbox.py):
+    - сообщения идут от новых к старым
+    - since: курсор (query или тело) - только сообщения, появившиеся после него
+    - before: next_before прошлого ответа - следующая страница более старых
+    - refresh: 1 - обновить копию из LDAP до ответа
+    
+    Response:
+    {
+        "success": true,
+        "data": {
+            "data": [...],
+            "count": 3,
+            "unread_count": 1,
+            "cursor": 42,       # передать в since при следующем запросе
+            "has_more": false,
+            "next_before": null,  # передать в before за более старыми
+            "synced_at": "..."
+        }
+    }
     """
     auth_header = request.META.get('HTTP_AUTHORIZATION')
     
@@ -409,16 +727,29 @@ def ldap_get_messages(request):
     
     logger.info("LDAP get messages")
     
-    success, ldap_response = ldap_service.get_messages(access_token)
+    if getattr(settings, 'LDAP_INBOX_MIRROR', False):
+        # Тело может быть JSON-списком или строкой - курсоры берем только из объекта
+        data = request.data if isinstance(request.data, dict) else {}
+        success, ldap_response = message_inbox.read(
+            access_token,
+            since=parse_cursor(request.GET.get('since', data.get('since'))),
+            before=parse_cursor(request.GET.get('before', data.get('before'))),
+            refresh=bypass_requested(request),
+        )
+    else:
+        success, ldap_response = ldap_service.get_messages(
+            access_token, refresh=bypass_requested(request)
+        )
     
     if success:
         logger.info("LDAP messages retrieved successfully")
-        return Response({
-            'success': True,
-            'data': ldap_response
-        }, status=status.HTTP_200_OK)
+        return _success_response(ldap_response)
     else:
         logger.warning("LDAP messages retrieval failed")
+        unavailable = _unavailable_response(ldap_response)
+        if unavailable:
+            return unavailable
+        
         error_message = ldap_response.get('error', 'Не удалось получить сообщения')
         
         if 'unauthorized' in error_message.lower():
@@ -450,6 +781,9 @@ def ldap_upload_image(request):
     
     access_token = auth_header.split(' ')[1]
     
+    if _upload_exceeds_limit(request):
+        return Response(_upload_too_large_error(), status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    
     # Получаем файл из запроса
     if 'image' not in request.FILES:
         return Response({
@@ -474,6 +808,13 @@ def ldap_upload_image(request):
         }, status=status.HTTP_200_OK)
     else:
         logger.warning("LDAP image upload failed")
+        unavailable = _unavailable_response(ldap_response)
+        if unavailable:
+            return unavailable
+        
+        if 'max_size' in ldap_response:
+            return Response(_upload_too_large_error(), status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        
         error_message = ldap_response.get('error', 'Не удалось загрузить изображение')
         
         if 'unauthorized' in error_message.lower():
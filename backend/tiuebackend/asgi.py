@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Для асинхронных LDAP прокси views запускать с LDAP_ASYNC_VIEWS=True, например:
+    LDAP_ASYNC_VIEWS=True uvicorn tiuebackend.asgi:application --workers 4
 """
 
 import os
@@ -0,0 +1,234 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from authentication.tracing import propagate
+
+logger = logging.getLogger(__name__)
+
+# Пул потоков для выполнения sync views из batch запросов
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'BATCH_MAX_WORKERS', 8),
+    thread_name_prefix='api-batch',
+)
+
+# Под-запрос после таймаута не прерывается (дорабатывает до таймаута LDAP API),
+# поэтому число выполняемых и ожидающих под-запросов всех batch ограничено
+_slots = threading.BoundedSemaphore(getattr(settings, 'BATCH_MAX_PENDING', 32))
+
+# Разрешенные под-запросы: только чтение (имя URL -> метод view) - данные LDAP API
+# и стартовые экраны приложения (dashboard, список новостей).
+# Профиль и сообщения - POST views, но ничего не изменяют
+ALLOWED_VIEWS = {
+    'ldap_profile': 'POST',
+    'ldap_me': 'POST',
+    'ldap_courses': 'GET',
+    'ldap_grades': 'GET',
+    'ldap_grades_summary': 'GET',
+    'ldap_attendance': 'GET',
+    'ldap_attendance_summary': 'GET',
+    'ldap_messages': 'POST',
+    'search_students': 'GET',
+    'dashboard': 'GET',
+    'news-list': 'GET',
+}
+
+# Заголовки, которые передаются под-запросам (из batch запроса и из headers под-запроса)
+ALLOWED_HEADERS = ('Authorization', 'Accept-Language', 'Cache-Control', 'If-None-Match')
+_ALLOWED_META = {'HTTP_' + name.upper().replace('-', '_') for name in ALLOWED_HEADERS}
+# Переменные окружения WSGI batch запроса, которые наследуют под-запросы
+_INHERITED_META = ('SERVER_NAME', 'SERVER_PORT', 'SERVER_PROTOCOL', 'REMOTE_ADDR', 'HTTP_HOST')
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class BatchView(View):
+    """
+    Выполняет несколько API запросов за один HTTP round trip
+
+    POST /api/batch/
+    {
+        "requests": [
+            {"id": "profile", "method": "POST", "path": "/api/auth/profile"},
+            {"id": "courses", "method": "GET", "path": "/api/auth/courses", "query": {"lang": "ru"}},
+            {"id": "grades", "path": "/api/auth/grades", "headers": {"If-None-Match": "..."}, "timeout": 5}
+        ]
+    }
+
+    Под-запросы выполняются параллельно через существующий URLconf и только
+    к endpoints чтения (ALLOWED_VIEWS): данные LDAP, dashboard и список
+    новостей. Middleware для них не вызываются, поэтому пользователь сессии
+    и CSRF в под-запросы не передаются - views авторизуют по заголовку
+    Authorization (Bearer LDAP или Token). Из заголовков batch запроса и
+    headers под-запроса передаются только ALLOWED_HEADERS.
+
+    Response:
+    {
+        "success": true,
+        "data": [
+            {"id": "profile", "status": 200, "body": {...}},
+            {"id": "grades", "status": 504, "error": "Timeout"}
+        ]
+    }
+    """
+
+    def post(self, request):
+        try:
+            payload = json.loads(request.body or b'{}')
+        except (ValueError, UnicodeDecodeError):
+            return self._error('Некорректный JSON', 400)
+
+        sub_requests = payload.get('requests') if isinstance(payload, dict) else None
+        if not isinstance(sub_requests, list) or not sub_requests:
+            return self._error('Поле requests должно быть непустым списком', 400)
+
+        max_requests = getattr(settings, 'BATCH_MAX_REQUESTS', 20)
+        if len(sub_requests) > max_requests:
+            return self._error(f'Не более {max_requests} запросов в batch', 400)
+
+        default_timeout = getattr(settings, 'BATCH_DEFAULT_TIMEOUT', 10)
+        max_timeout = getattr(settings, 'BATCH_MAX_TIMEOUT', 30)
+
+        started = time.monotonic()
+        jobs = []
+        for index, item in enumerate(sub_requests):
+            if not isinstance(item, dict):
+                jobs.append((index, None, None, {'status': 400, 'error': 'Некорректный под-запрос'}))
+                continue
+
+            item_id = item.get('id', index)
+            try:
+                timeout = min(float(item.get('timeout', default_timeout)), max_timeout)
+                sub_request, match = self._build_request(request, item)
+            except (TypeError, ValueError) as e:
+                jobs.append((item_id, None, None, {'status': 400, 'error': str(e)}))
+                continue
+
+            if not _slots.acquire(blocking=False):
+                jobs.append((item_id, None, None, {'status': 503, 'error': 'Сервер перегружен, повторите позже'}))
+                continue
+            # Под-запросы наследуют request ID batch запроса
+            future = _executor.submit(propagate(self._dispatch), sub_request, match)
+            # Слот освобождается, когда под-запрос завершился или отменен до запуска
+            future.add_done_callback(lambda _: _slots.release())
+            jobs.append((item_id, future, timeout, None))
+
+        results = []
+        for item_id, future, timeout, error in jobs:
+            if future is None:
+                results.append({'id': item_id, **error})
+                continue
+
+            # Таймаут под-запроса отсчитывается от начала batch
+            remaining = max(0.0, timeout - (time.monotonic() - started))
+            try:
+                results.append(dict(future.result(timeout=remaining), id=item_id))
+            except FutureTimeoutError:
+                # Отменяется только еще не запущенный под-запрос
+                future.cancel()
+                results.append({'id': item_id, 'status': 504, 'error': 'Timeout'})
+            except Exception as e:
+                logger.error(f"Batch sub-request {item_id} failed: {e}")
+                results.append({'id': item_id, 'status': 500, 'error': 'Внутренняя ошибка сервера'})
+
+        return JsonResponse({
+            'success': True,
+            'data': results
+        }, json_dumps_params={'ensure_ascii': False})
+
+    def _error(self, message, response_status):
+        return JsonResponse({
+            'success': False,
+            'error': message
+        }, status=response_status, json_dumps_params={'ensure_ascii': False})
+
+    def _build_request(self, request, item):
+        """Создает HttpRequest под-запроса на основе разрешенных заголовков batch запроса"""
+        url = urlsplit(str(item.get('path', '')))
+        path = url.path
+        if not path.startswith('/api/'):
+            raise ValueError('path должен начинаться с /api/')
+
+        try:
+            match = resolve(path)
+        except Resolver404:
+            raise ValueError(f'Неизвестный путь {path}')
+        view_method = ALLOWED_VIEWS.get((match.url_name or '').removesuffix('_no_slash'))
+        if view_method is None:
+            raise ValueError(f'Путь {path} недоступен в batch запросе')
+
+        method = str(item.get('method', view_method)).upper()
+        if method != view_method:
+            raise ValueError(f'Метод {method} не поддерживается для {path}')
+        if item.get('body') is not None:
+            raise ValueError('body не поддерживается: параметры передаются в query')
+
+        headers = item.get('headers') or {}
+        if not isinstance(headers, dict):
+            raise ValueError('headers должен быть объектом')
+        allowed = {name.lower() for name in ALLOWED_HEADERS}
+        for name in headers:
+            if str(name).lower() not in allowed:
+                raise ValueError(f'Заголовок {name} не поддерживается')
+
+        query = url.query
+        if item.get('query'):
+            query = '&'.join(filter(None, [query, urlencode(item['query'], doseq=True)]))
+
+        environ = {
+            key: value for key, value in request.META.items()
+            if (key in _INHERITED_META or key in _ALLOWED_META) and isinstance(value, str)
+        }
+        for name, value in headers.items():
+            environ['HTTP_' + str(name).upper().replace('-', '_')] = str(value)
+        environ.update({
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'SCRIPT_NAME': '',
+            'QUERY_STRING': query,
+            'CONTENT_TYPE': '',
+            'CONTENT_LENGTH': '0',
+            'wsgi.input': BytesIO(b''),
+            'wsgi.url_scheme': request.scheme,
+        })
+
+        return WSGIRequest(environ), match
+
+    def _dispatch(self, sub_request, match):
+        """Вызывает view под-запроса (в потоке пула)"""
+        try:
+            view = match.func
+            if iscoroutinefunction(view):
+                response = async_to_sync(view)(sub_request, *match.args, **match.kwargs)
+            else:
+                response = view(sub_request, *match.args, **match.kwargs)
+
+            if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                response.render()
+
+            if response.streaming:
+                return {'status': response.status_code, 'error': 'Streaming ответы не поддерживаются'}
+
+            content = response.content
+            if 'json' in response.get('Content-Type', ''):
+                body = json.loads(content) if content else None
+            else:
+                body = content.decode(response.charset or 'utf-8', errors='replace')
+
+            return {'status': response.status_code, 'body': body}
+        finally:
+            # Соединения с БД потоков пула не закрываются по request_finished
+            connections.close_all()
@@ -1,16 +1,85 @@
 import logging
+import re
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from authentication.tracing import new_request_id, request_id_var
 
 logger = logging.getLogger(__name__)
 
+# Входящий X-Request-ID принимаем, только если он похож на идентификатор
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class RequestIDMiddleware:
+    # Request ID запроса: из X-Request-ID клиента/прокси или новый.
+    # Доступен через authentication.tracing.get_request_id(), уходит в LDAP API
+    # и возвращается клиенту в заголовке X-Request-ID
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response['X-Request-ID'] = request.request_id
+        return response
+
+    async def __acall__(self, request):
+        token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response['X-Request-ID'] = request.request_id
+        return response
+
+    def _start(self, request):
+        request_id = request.META.get('HTTP_X_REQUEST_ID', '')
+        if not REQUEST_ID_RE.match(request_id):
+            request_id = new_request_id()
+        request.request_id = request_id
+        return request_id_var.set(request_id)
+
+
 class LoggingMiddleware:
+    # Поддерживает и sync, и async цепочку - под ASGI async views
+    # не переключаются в поток из-за этого middleware
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
         response = self.get_response(request)
-        
+        self._log(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        self._log(request, response)
+        return response
+
+    def _log(self, request, response):
         # Логируем только ошибки API endpoints (4xx, 5xx)
         if request.path.startswith('/api/') and response.status_code >= 400:
-            logger.warning(f"{request.method} {request.get_full_path()} - {response.status_code}")
-        
-        return response
+            logger.warning(
+                f"{request.method} {request.get_full_path()} - {response.status_code} "
+                f"request_id={getattr(request, 'request_id', None)}"
+            )
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 import pymysql
 
 # Install PyMySQL as MySQL driver
@@ -50,6 +50,158 @@ ALLOWED_HOSTS = list(set(all_hosts))  # Убираем дубликаты
 # LDAP Configuration
 LDAP_BASE_URL = config('LDAP_BASE_URL', default='https://my.tiue.uz')
 
+# Пул keep-alive соединений к LDAP API (на процесс воркера)
+LDAP_POOL_CONNECTIONS = config('LDAP_POOL_CONNECTIONS', default=4, cast=int)  # Количество хостов в пуле
+LDAP_POOL_MAXSIZE = config('LDAP_POOL_MAXSIZE', default=20, cast=int)  # Соединений на один хост
+LDAP_POOL_BLOCK = config('LDAP_POOL_BLOCK', default=False, cast=bool)  # Ждать свободное соединение
+LDAP_POOL_WARMUP = config('LDAP_POOL_WARMUP', default=False, cast=bool)  # TLS прогрев при старте воркера
+LDAP_POOL_WARMUP_CONNECTIONS = config('LDAP_POOL_WARMUP_CONNECTIONS', default=2, cast=int)
+
+# Асинхронные LDAP прокси views (включать только при запуске под ASGI)
+LDAP_ASYNC_VIEWS = config('LDAP_ASYNC_VIEWS', default=False, cast=bool)
+LDAP_ASYNC_MAX_CONNECTIONS = config('LDAP_ASYNC_MAX_CONNECTIONS', default=500, cast=int)
+
+# Кэш ответов LDAP API по токену (TTL в секундах, 0 - не кэшировать)
+LDAP_CACHE_MAXSIZE = config('LDAP_CACHE_MAXSIZE', default=5000, cast=int)
+LDAP_CACHE_TTL = {
+    'profile': config('LDAP_CACHE_TTL_PROFILE', default=600, cast=int),
+    'courses': config('LDAP_CACHE_TTL_COURSES', default=900, cast=int),
+    'grades': config('LDAP_CACHE_TTL_GRADES', default=300, cast=int),
+    'attendance': config('LDAP_CACHE_TTL_ATTENDANCE', default=300, cast=int),
+    'messages': config('LDAP_CACHE_TTL_MESSAGES', default=60, cast=int),
+}
+
+# Прогрев кэша курсами/оценками/посещаемостью/сообщениями сразу после входа
+LDAP_LOGIN_WARMUP = config('LDAP_LOGIN_WARMUP', default=False, cast=bool)
+
+# Stale-while-revalidate: после истечения TTL отдаем последний успешный ответ
+# и обновляем его в фоне (0 - выключено). Окно короткое: дольше него клиент
+# может видеть данные по токену, который LDAP API уже отозвал
+LDAP_STALE_TTL = config('LDAP_STALE_TTL', default=300, cast=int)  # Максимальный возраст устаревших данных
+LDAP_STALE_MAXSIZE = config('LDAP_STALE_MAXSIZE', default=5000, cast=int)
+LDAP_REFRESH_WORKERS = config('LDAP_REFRESH_WORKERS', default=4, cast=int)  # Потоки фонового обновления
+LDAP_REFRESH_MAX_PENDING = config('LDAP_REFRESH_MAX_PENDING', default=100, cast=int)
+
+# Circuit breaker для LDAP API (по каждому endpoint'у)
+LDAP_CIRCUIT_BREAKER = {
+    'failure_rate': config('LDAP_CB_FAILURE_RATE', default=0.5, cast=float),  # Доля ошибок для открытия
+    'min_calls': config('LDAP_CB_MIN_CALLS', default=10, cast=int),  # Минимум вызовов в окне
+    'window': config('LDAP_CB_WINDOW', default=20, cast=int),  # Последние N вызовов
+    'open_seconds': config('LDAP_CB_OPEN_SECONDS', default=30, cast=float),  # Пауза до пробных запросов
+    'half_open_calls': config('LDAP_CB_HALF_OPEN_CALLS', default=1, cast=int),
+}
+
+# Поиск студентов в LDAP API: страницы по LDAP_SEARCH_PAGE_SIZE, запрашиваются параллельно
+LDAP_SEARCH_PAGE_SIZE = config('LDAP_SEARCH_PAGE_SIZE', default=100, cast=int)
+LDAP_SEARCH_MAX_LIMIT = config('LDAP_SEARCH_MAX_LIMIT', default=500, cast=int)  # Максимальный limit одного запроса
+LDAP_SEARCH_PARALLEL_PAGES = config('LDAP_SEARCH_PARALLEL_PAGES', default=4, cast=int)
+LDAP_SEARCH_CACHE_TTL = config('LDAP_SEARCH_CACHE_TTL', default=300, cast=int)  # Кэш результатов поиска (0 - выключен)
+LDAP_SEARCH_CACHE_MAXSIZE = config('LDAP_SEARCH_CACHE_MAXSIZE', default=2000, cast=int)
+# Typeahead (?typeahead=1): полная выдача короткого запроса уточняется локально
+LDAP_SEARCH_TYPEAHEAD_LIMIT = config('LDAP_SEARCH_TYPEAHEAD_LIMIT', default=200, cast=int)  # Сколько результатов запрашивать
+LDAP_SEARCH_TYPEAHEAD_MIN_CHARS = config('LDAP_SEARCH_TYPEAHEAD_MIN_CHARS', default=2, cast=int)
+
+# Локальная копия справочника студентов (manage.py sync_student_directory)
+LDAP_DIRECTORY_MIRROR = config('LDAP_DIRECTORY_MIRROR', default=True, cast=bool)  # Искать по копии, если она есть
+LDAP_DIRECTORY_PAGE_SIZE = config('LDAP_DIRECTORY_PAGE_SIZE', default=1000, cast=int)  # Записей на страницу выгрузки
+LDAP_DIRECTORY_RELOAD_SECONDS = config('LDAP_DIRECTORY_RELOAD_SECONDS', default=60, cast=int)  # Проверка обновлений таблицы
+LDAP_DIRECTORY_USERNAME = config('LDAP_DIRECTORY_USERNAME', default='')  # Учетная запись для синхронизации
+LDAP_DIRECTORY_PASSWORD = config('LDAP_DIRECTORY_PASSWORD', default='')
+
+# Потоковая передача: разбор больших ответов и загрузка изображений без буферизации
+LDAP_STREAM_CHUNK_SIZE = config('LDAP_STREAM_CHUNK_SIZE', default=65536, cast=int)  # Размер чанка
+LDAP_UPLOAD_MAX_SIZE = config('LDAP_UPLOAD_MAX_SIZE', default=10 * 1024 * 1024, cast=int)  # Лимит загружаемого изображения (байт)
+
+# Кэш "токен -> пользователь" для LDAPBearerAuthentication
+LDAP_IDENTITY_TTL = config('LDAP_IDENTITY_TTL', default=3600, cast=int)  # Если срок жизни токена неизвестен
+LDAP_IDENTITY_MAX_TTL = config('LDAP_IDENTITY_MAX_TTL', default=86400, cast=int)
+LDAP_IDENTITY_NEGATIVE_TTL = config('LDAP_IDENTITY_NEGATIVE_TTL', default=30, cast=int)  # Для отклоненных токенов
+LDAP_IDENTITY_CACHE_MAXSIZE = config('LDAP_IDENTITY_CACHE_MAXSIZE', default=10000, cast=int)
+
+# Обмен refresh token'а: одновременные обновления объединяются, результат хранится grace-период
+LDAP_REFRESH_GRACE_SECONDS = config('LDAP_REFRESH_GRACE_SECONDS', default=30, cast=int)
+LDAP_REFRESH_CACHE_MAXSIZE = config('LDAP_REFRESH_CACHE_MAXSIZE', default=1000, cast=int)
+
+# ETag/304 и дельты (?since=<версия>) для оценок и посещаемости
+LDAP_VERSIONS_KEEP = config('LDAP_VERSIONS_KEEP', default=3, cast=int)  # Сколько прошлых версий хранить на токен
+LDAP_VERSIONS_TTL = config('LDAP_VERSIONS_TTL', default=86400, cast=int)
+LDAP_VERSIONS_MAXSIZE = config('LDAP_VERSIONS_MAXSIZE', default=5000, cast=int)
+
+# Сводки оценок и посещаемости (/grades/summary, /attendance/summary), кэш по хэшу ответа
+LDAP_SUMMARY_CACHE_TTL = config('LDAP_SUMMARY_CACHE_TTL', default=86400, cast=int)
+LDAP_SUMMARY_CACHE_MAXSIZE = config('LDAP_SUMMARY_CACHE_MAXSIZE', default=5000, cast=int)
+
+# Прогрев кэша перед окончанием занятий (время из Schedule.time) для недавно активных токенов
+LDAP_PREFETCH_ENABLED = config('LDAP_PREFETCH_ENABLED', default=False, cast=bool)
+LDAP_PREFETCH = {
+    'datasets': config('LDAP_PREFETCH_DATASETS', default='grades,attendance', cast=Csv()),
+    'lead': config('LDAP_PREFETCH_LEAD_SECONDS', default=120, cast=int),  # За сколько до окончания пары
+    'active_within': config('LDAP_PREFETCH_ACTIVE_SECONDS', default=3600, cast=int),  # Активность токена
+    'rate': config('LDAP_PREFETCH_RATE', default=5, cast=float),  # Обновлений в секунду
+    'budget': config('LDAP_PREFETCH_BUDGET', default=1000, cast=int),  # Максимум обновлений за окно
+    'reload': config('LDAP_PREFETCH_RELOAD_SECONDS', default=300, cast=int),  # Перечитывание расписания
+}
+LDAP_PREFETCH_MAX_TOKENS = config('LDAP_PREFETCH_MAX_TOKENS', default=5000, cast=int)
+
+# Локальная копия сообщений (/api/auth/messages?since=<cursor>): обновление из LDAP в фоне
+LDAP_INBOX_MIRROR = config('LDAP_INBOX_MIRROR', default=False, cast=bool)
+LDAP_INBOX_SYNC_INTERVAL = config('LDAP_INBOX_SYNC_INTERVAL', default=60, cast=int)  # Не чаще раза в N сек на пользователя
+LDAP_INBOX_PAGE_SIZE = config('LDAP_INBOX_PAGE_SIZE', default=200, cast=int)  # Максимум сообщений в ответе
+
+# Адаптивные таймауты LDAP API: read timeout = p99 * multiplier в пределах [min_read, max_read],
+# connect timeout - так же по времени установки соединений, в пределах [min_connect, connect]
+LDAP_ADAPTIVE_TIMEOUTS = {
+    'connect': config('LDAP_CONNECT_TIMEOUT', default=5, cast=float),  # До замеров и максимум
+    'min_connect': config('LDAP_MIN_CONNECT_TIMEOUT', default=0.5, cast=float),
+    'min_read': config('LDAP_MIN_READ_TIMEOUT', default=2, cast=float),
+    'max_read': config('LDAP_MAX_READ_TIMEOUT', default=30, cast=float),
+    'multiplier': config('LDAP_TIMEOUT_MULTIPLIER', default=3, cast=float),
+    'min_samples': config('LDAP_TIMEOUT_MIN_SAMPLES', default=20, cast=int),  # Замеров до адаптации
+}
+
+# Повторы идемпотентных запросов: не больше ratio от общего числа запросов
+LDAP_MAX_RETRIES = config('LDAP_MAX_RETRIES', default=1, cast=int)
+LDAP_RETRY_BACKOFF = config('LDAP_RETRY_BACKOFF', default=0.1, cast=float)  # Базовая пауза (сек)
+LDAP_RETRY_BUDGET = {
+    'ratio': config('LDAP_RETRY_BUDGET_RATIO', default=0.1, cast=float),
+    'min_per_second': config('LDAP_RETRY_BUDGET_MIN_PER_SECOND', default=1, cast=float),
+}
+# Hedged GET: второй запрос, если первый не ответил за p95 endpoint'а
+LDAP_HEDGE_REQUESTS = config('LDAP_HEDGE_REQUESTS', default=False, cast=bool)
+LDAP_HEDGE_WORKERS = config('LDAP_HEDGE_WORKERS', default=32, cast=int)
+
+# Bulkhead: не больше max_concurrent одновременных запросов к LDAP API на процесс,
+# еще max_queue ждут до queue_timeout сек, остальным - 503 + Retry-After (0 - без ограничения).
+# auth_reserve мест только для входа/обновления токена, фоновым запросам - не больше background_share
+LDAP_BULKHEAD = {
+    'max_concurrent': config('LDAP_BULKHEAD_MAX_CONCURRENT', default=20, cast=int),
+    'max_queue': config('LDAP_BULKHEAD_MAX_QUEUE', default=20, cast=int),
+    'queue_timeout': config('LDAP_BULKHEAD_QUEUE_TIMEOUT', default=2, cast=float),
+    'retry_after': config('LDAP_BULKHEAD_RETRY_AFTER', default=2, cast=int),
+    'auth_reserve': config('LDAP_BULKHEAD_AUTH_RESERVE', default=2, cast=int),
+    'background_share': config('LDAP_BULKHEAD_BACKGROUND_SHARE', default=0.5, cast=float),
+}
+# То же для async сервиса (ASGI): корутины дешевле потоков, лимит выше
+LDAP_ASYNC_BULKHEAD = {
+    'max_concurrent': config('LDAP_ASYNC_BULKHEAD_MAX_CONCURRENT', default=200, cast=int),
+    'max_queue': config('LDAP_ASYNC_BULKHEAD_MAX_QUEUE', default=200, cast=int),
+    'queue_timeout': config('LDAP_BULKHEAD_QUEUE_TIMEOUT', default=2, cast=float),
+    'retry_after': config('LDAP_BULKHEAD_RETRY_AFTER', default=2, cast=int),
+    'auth_reserve': config('LDAP_ASYNC_BULKHEAD_AUTH_RESERVE', default=10, cast=int),
+    'background_share': config('LDAP_BULKHEAD_BACKGROUND_SHARE', default=0.5, cast=float),
+}
+
+# Трассировка запросов к LDAP API (гистограммы по endpoint'ам в памяти процесса)
+LDAP_TRACE_RECENT = config('LDAP_TRACE_RECENT', default=500, cast=int)  # Сколько последних трасс хранить
+LDAP_TRACE_LOG_LEVEL = config('LDAP_TRACE_LOG_LEVEL', default='WARNING')  # INFO - лог каждого запроса
+
+# Batch endpoint /api/batch/: несколько API запросов за один round trip
+BATCH_MAX_REQUESTS = config('BATCH_MAX_REQUESTS', default=20, cast=int)  # Под-запросов в одном batch
+BATCH_MAX_WORKERS = config('BATCH_MAX_WORKERS', default=8, cast=int)  # Потоки для под-запросов
+BATCH_MAX_PENDING = config('BATCH_MAX_PENDING', default=32, cast=int)  # Выполняемых и ожидающих под-запросов всех batch
+BATCH_DEFAULT_TIMEOUT = config('BATCH_DEFAULT_TIMEOUT', default=10, cast=float)  # Таймаут под-запроса (сек)
+BATCH_MAX_TIMEOUT = config('BATCH_MAX_TIMEOUT', default=30, cast=float)
+
 
 # Application definition
 
@@ -72,6 +224,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # ВКЛЮЧЕНО для React Native разработки
+    'tiuebackend.middleware.RequestIDMiddleware',
     'tiuebackend.middleware.LoggingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -183,7 +336,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Django REST Framework
 REST_FRAMEWORK = {
-    # Гибридная аутентификация: Token для админов + LDAP Bearer для студентов
+    # Token для админов; LDAP Bearer (студенты) подключается только в нужных views
+    # через authentication_classes - LDAPUser не запись CustomUser
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',  # Для админов
         'rest_framework.authentication.SessionAuthentication',  # Для Django admin
@@ -269,6 +423,11 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'authentication.tracing': {
+            'handlers': ['console'],
+            'level': LDAP_TRACE_LOG_LEVEL,
+            'propagate': False,
+        },
     },
     'root': {
         'handlers': ['console'],
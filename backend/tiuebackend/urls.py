@@ -32,6 +32,13 @@ urlpatterns = [
     path('api/schedule/', include('schedule.urls')),
 ]
 
+# Batch: несколько API запросов за один HTTP round trip
+from tiuebackend.batch_views import BatchView
+urlpatterns += [
+    path('api/batch/', BatchView.as_view(), name='api_batch'),
+    path('api/batch', BatchView.as_view(), name='api_batch_no_slash'),
+]
+
 # Serve media files через кастомный view с правильными MIME типами
 from tiuebackend.media_views import MediaServeView
 urlpatterns += [
@@ -1,3 +1,9 @@
 from django.test import TestCase
 
-# Create your tests here.
+
+class LDAPBearerScopeTests(TestCase):
+
+    def test_user_list_rejects_ldap_bearer_token(self):
+        # LDAP Bearer подключен только во views, которые работают с LDAPUser
+        response = self.client.get('/api/users/', HTTP_AUTHORIZATION='Bearer ldap-token')
+        self.assertEqual(response.status_code, 401)
@@ -1,5 +1,6 @@
 from rest_framework import generics, status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from django.views.decorators.csrf import csrf_exempt
@@ -9,6 +10,7 @@ from .models import CustomUser, Student, Grade, Attendance
 from .serializers import CustomUserSerializer
 from news.models import News, Event
 from schedule.models import Schedule
+from authentication.authentication import LDAPBearerAuthentication, LDAPUser
 import logging
 
 logger = logging.getLogger(__name__)
@@ -186,6 +188,7 @@ def dashboard_view(request):
 
 @csrf_exempt
 @api_view(['POST'])
+@authentication_classes([TokenAuthentication, SessionAuthentication, LDAPBearerAuthentication])
 @permission_classes([AllowAny])  # Делаем собственную проверку аутентификации
 def upload_avatar(request):
     """
@@ -247,24 +250,17 @@ def upload_avatar(request):
         # Гибридная аутентификация для аватаров
         auth_header = request.META.get('HTTP_AUTHORIZATION', '')
         
-        if auth_header.startswith('Bearer '):
-            # LDAP пользователь - создаем/находим локальную запись
-            ldap_token = auth_header.split(' ')[1]
-            
-            # Получаем профиль из LDAP
-            from authentication.ldap_service import ldap_service
-            success, profile_data = ldap_service.get_user_profile(ldap_token)
-            
-            if not success:
+        if isinstance(request.user, LDAPUser):
+            # LDAP пользователь (LDAPBearerAuthentication) - создаем/находим локальную запись
+            if not request.user.is_authenticated:
                 return Response({
                     'success': False,
                     'error': 'Неверный LDAP токен'
                 }, status=status.HTTP_401_UNAUTHORIZED)
             
-            # Извлекаем username из email или используем uid
-            username = profile_data.get('email', '').split('@')[0] if profile_data.get('email') else profile_data.get('uid', 'unknown')
-            email = profile_data.get('email', f'{username}@tiue.uz')
-            full_name = profile_data.get('full_name', '')
+            username = request.user.username
+            email = request.user.email
+            full_name = request.user.full_name
             
             # Создаем или получаем локального пользователя
             user, created = CustomUser.objects.get_or_create(